@@ -1,64 +1,211 @@
 import logging
 import multiprocessing as mp
 import os
-import time
+import queue
+import shutil
+import tempfile
+import threading
 from functools import partial
-from multiprocessing.pool import ThreadPool
-from typing import Dict
+from multiprocessing.pool import Pool, ThreadPool
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 import elasticsearch as es
 
+from src.async_linking import AsyncLinker
 from src.cli import parse_cl_args
-from src.globals import shared_dict
-from src.interfaces import CandidateNamedEntity, EntityMapping, NamedEntity
-from src.io import run_flush_daemon
-from src.linking import choose_entity_candidate, generate_entity_candidates
-from src.parsing import extract_entities, extract_text_from_html
-from src.warc import extract_metadata_from_warc, stream_records_from_warc
+from src.interfaces import (CandidateNamedEntity, EntityMapping, NamedEntity,
+                            ProgramArguments, WARCRecordLocation, WARCRecordMetadata,
+                            WARCRecordResult, WorkerStats)
+from src.io import (MergedOutputRouter, OutputRouter, SplitOutputRouter,
+                    WriterMessage, run_writer)
+from src.kb_server import KBServerPool
+from src.knowledge_base import (TYPE_SIGNATURE_FINGERPRINT, open_trident_db,
+                                use_kb_servers)
+from src.linking import (ES_INDEX, choose_entity_candidate,
+                         elasticsearch_connection_stats,
+                         generate_entity_candidates_batch)
+from src.parsing import (extract_entities_batch, extract_text_blocks_from_html,
+                         popular_entities_gazetteer)
+from src.pruning import prune_text_blocks
+from src.shared_cache import SharedCache, create_shared_cache
+from src.utils import (ArchiveProgress, CacheStats, batched, cache_stats,
+                       imap_bounded)
+from src.warc import (extract_metadata_from_warc, read_warc_records,
+                      stream_record_locations_from_warc,
+                      stream_records_from_warc)
 
+# worker process configuration, see 'init_worker'
+program_args = ProgramArguments(archive_paths=[])
 
-def process_record(record: str):
+# worker process state, created on first use after fork (see 'get_es_client',
+# 'get_thread_pool', 'get_async_linker' and 'get_shared_cache') and reused
+# across records
+worker_es_client: Optional[es.Elasticsearch] = None
+worker_thread_pool: Optional[ThreadPool] = None
+worker_async_linker: Optional[AsyncLinker] = None
+worker_shared_cache: Optional[SharedCache] = None
+shared_cache_path: Optional[str] = None
+processed_records = 0
+
+
+def init_worker(
+    worker_program_args: ProgramArguments,
+    kb_server_addresses: List[str],
+    kb_server_authkey: bytes,
+    worker_shared_cache_path: Optional[str]
+):
     """
-    The main data pipeline. Runs for every record in a WARC archive.
-    This function is meant to be the target of a sub-process.
+    Initializer of the worker processes of the pool.
+
+    Parameters
+    ----------
+    - worker_program_args `ProgramArguments`
+    The program options.
+
+    - kb_server_addresses `List[str]`
+    The addresses of the knowledge base servers, empty if the worker
+    opens the knowledge base itself.
+
+    - kb_server_authkey `bytes`
+    The key of the knowledge base servers.
+
+    - worker_shared_cache_path `Optional[str]`
+    The file of the cache shared by the workers, None without it.
+    """
+    global program_args, worker_es_client, worker_thread_pool, worker_async_linker, \
+        worker_shared_cache, shared_cache_path, processed_records
+    program_args = worker_program_args
+    shared_cache_path = worker_shared_cache_path
+    if len(kb_server_addresses) > 0:
+        use_kb_servers(kb_server_addresses, kb_server_authkey)
+    # nothing created by the parent process is used after fork
+    worker_es_client = None
+    worker_thread_pool = None
+    worker_async_linker = None
+    worker_shared_cache = None
+    processed_records = 0
+
+
+def get_es_client() -> es.Elasticsearch:
+    """
+    Returns the elasticsearch client of the worker process, it is created
+    on first use and its connections are kept alive across records.
+    """
+    global worker_es_client
+    if worker_es_client is None:
+        # the es client is thread safe, we spawn one for each child
+        # process due to complication with 'fork' mentioned in the es docs:
+        # https://elasticsearch-py.readthedocs.io/en/v7.15.2/api.html#elasticsearch
+        worker_es_client = es.Elasticsearch(maxsize=mp.cpu_count())
+    return worker_es_client
+
+
+def get_thread_pool() -> ThreadPool:
+    """
+    Returns the thread pool of the worker process, it is created on
+    first use and reused across records.
+    """
+    global worker_thread_pool
+    if worker_thread_pool is None:
+        worker_thread_pool = ThreadPool()
+    return worker_thread_pool
+
+
+def get_async_linker() -> AsyncLinker:
+    """
+    Returns the asyncio linking engine of the worker process, it is
+    created on first use and reused across records.
+    """
+    global worker_async_linker
+    if worker_async_linker is None:
+        worker_async_linker = AsyncLinker(
+            program_args.max_concurrency, program_args.candidate_query, get_shared_cache())
+    return worker_async_linker
+
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """
+    Returns the connection of the worker process to the cache shared by
+    the workers, it is opened on first use. None without a shared cache.
+    """
+    global worker_shared_cache
+    if worker_shared_cache is None and shared_cache_path is not None:
+        worker_shared_cache = SharedCache(shared_cache_path)
+    return worker_shared_cache
+
+
+def get_worker_stats() -> WorkerStats:
+    es_requests, es_connections = elasticsearch_connection_stats(worker_es_client) \
+        if worker_es_client is not None else (0, 0)
+    return WorkerStats(pid=os.getpid(), records=processed_records,
+                       es_requests=es_requests, es_connections=es_connections,
+                       caches={**cache_stats(), **(worker_shared_cache.stats()
+                                                   if worker_shared_cache is not None else {})})
+
+
+def prepare_record(record_bytes: bytes) -> Optional[Tuple[WARCRecordMetadata, str]]:
+    """
+    First stage of the data pipeline, it extracts the metadata and the
+    (pruned) text of a WARC record.
 
     Parameters
     ----------
-    - record `str`
-    The WARC record string, including both metadata and HTML.
+    - record_bytes `bytes`
+    The raw WARC record, including both metadata and HTML.
+
+    Returns
+    -------
+    `Optional[Tuple[WARCRecordMetadata, str]]` The record metadata ([0])
+    alongside the text sent to NER ([1]), None if the record could not
+    be processed.
     """
+    record = record_bytes.decode('utf-8', errors='ignore')
+    del record_bytes
+
     try:
         warc_metadata = extract_metadata_from_warc(record)
     # we are handling the case where the record is an empty string
     except ValueError:
         logging.error("The provided WARC record does not have a record ID. We are explicitly not using Trec ID but Record ID as mentioned on the Canvas announcement (see https://canvas.vu.nl/courses/55617/discussion_topics/452242)")
-        return
+        return None
+
+    text, pruning_report = prune_text_blocks(
+        extract_text_blocks_from_html(record), program_args.pruning)
+    logging.debug(
+        f'pruned record {warc_metadata.record_id}: {pruning_report}')
+
+    return warc_metadata, text
 
-    # init job information in the shared dict
-    # in order for the i/o daemon to check upon
-    # the status of this page
-    shared_dict[warc_metadata] = {
-        "mappings": [],
-        "is_done": False,
-        "is_flushed": False
-    }
 
-    text = extract_text_from_html(record)
+def link_entities(
+    es_client: es.Elasticsearch,
+    named_entities: List[NamedEntity],
+    failed: Optional[Set[str]] = None
+) -> List[Optional[CandidateNamedEntity]]:
+    """
+    Last stage of the data pipeline (threads engine), it links named
+    entities to the knowledge base.
 
-    named_entities, cached_mappings = extract_entities(text)
+    Parameters
+    ----------
+    - es_client `elasticsearch.Elasticsearch`
+    The client used to search the entity candidates.
 
-    # free some memory
-    del text
+    - named_entities `List[NamedEntity]`
+    The entities found by NER which need to be linked.
 
-    t_pool = ThreadPool()
+    - failed `Optional[Set[str]]`
+    If provided, the names whose candidate search failed are added to it.
 
-    # the es client is thread safe, we spawn one for each child
-    # process due to complication with 'fork' mentioned in the es docs:
-    # https://elasticsearch-py.readthedocs.io/en/v7.15.2/api.html#elasticsearch
-    es_client = es.Elasticsearch(maxsize=mp.cpu_count())
+    Returns
+    -------
+    `List[Optional[CandidateNamedEntity]]` The chosen candidate of each
+    entity, None if the entity has no candidates.
+    """
+    t_pool = get_thread_pool()
 
-    entity_candidates_list = t_pool.map(
-        partial(generate_entity_candidates, es_client), named_entities)
+    entity_candidates_list = generate_entity_candidates_batch(
+        es_client, named_entities, program_args.candidate_query, get_shared_cache(), failed)
 
     ############
     # NOTE: we leave the cosine similarity strategy here as a possible
@@ -75,49 +222,275 @@ def process_record(record: str):
 
     candidate_cache: Dict[NamedEntity, CandidateNamedEntity] = {}
 
-    entity_candidates = t_pool.map(
+    return t_pool.map(
         partial(choose_entity_candidate, candidate_cache),
         zip(named_entities, entity_candidates_list))
 
-    t_pool.close()
-    t_pool.join()
 
-    shared_dict[warc_metadata] = {
-        "mappings": [
+def build_record_result(
+    warc_metadata: WARCRecordMetadata,
+    named_entities: Iterable[NamedEntity],
+    entity_candidates: Iterable[Optional[CandidateNamedEntity]],
+    cached_mappings: Iterable[EntityMapping]
+) -> WARCRecordResult:
+    """
+    Returns the entity mappings of a record given the chosen candidate
+    of each of its named entities (in the same order).
+    """
+    return WARCRecordResult(
+        metadata=warc_metadata,
+        mappings=[
             *(EntityMapping(named_entity=ent.name, entity_url=cand.id)
               for (ent, cand) in zip(named_entities, entity_candidates)
-              if cand is not None), *cached_mappings],
-        "is_done": True,
-        "is_flushed": False
-    }
+              if cand is not None), *cached_mappings])
+
+
+def process_records(task: Tuple[int, List[Union[bytes, WARCRecordLocation]]]) -> Tuple[int, List[WARCRecordResult], WorkerStats]:
+    """
+    Runs the data pipeline on a batch of WARC records. Record locations
+    are read (and inflated) first. The texts of the whole batch go through
+    NER together (see `extract_entities_batch`), then the distinct entities
+    of the batch are linked at once. The entities already linked by any
+    worker are taken from the shared cache (see `src/shared_cache.py`).
+    This function is meant to be the target of a sub-process.
+
+    Parameters
+    ----------
+    - task `Tuple[int, List[Union[bytes, WARCRecordLocation]]]`
+    The archive id ([0]) alongside the raw WARC records or the byte ranges
+    of the records in the archive ([1]).
+
+    Returns
+    -------
+    `Tuple[int, List[WARCRecordResult], WorkerStats]` The archive id ([0])
+    alongside the results of the records that were processed ([1]) and
+    the counters of the worker ([2]).
+    """
+    global processed_records
+    archive_id, batch = task
+    prepared: List[Tuple[WARCRecordMetadata, str]] = []
+    for record in batch:
+        records = read_warc_records(record) \
+            if isinstance(record, WARCRecordLocation) else [record]
+        for record_bytes in records:
+            prepared_record = prepare_record(record_bytes)
+            if prepared_record is not None:
+                prepared.append(prepared_record)
+    del batch
+
+    extracted_entities = extract_entities_batch(
+        [text for _, text in prepared], batch_size=max(1, len(prepared)),
+        skip_covered=program_args.skip_covered_ner)
+
+    # the chosen candidate of an entity does not depend on its record
+    batch_entities = list(dict.fromkeys(
+        entity for named_entities, _ in extracted_entities for entity in named_entities))
+    shared_cache = get_shared_cache()
+    links: Dict[NamedEntity, Optional[CandidateNamedEntity]] = \
+        shared_cache.get_links(batch_entities) if shared_cache is not None else {}
+    unlinked = [entity for entity in batch_entities if entity not in links]
+
+    failed: Set[str] = set()
+    if program_args.engine == 'asyncio':
+        new_links = dict(zip(unlinked, get_async_linker().link([unlinked], failed)[0]))
+    else:
+        new_links = dict(zip(unlinked, link_entities(get_es_client(), unlinked, failed)))
+    if shared_cache is not None:
+        # the entities whose search failed are linked again by the next batches
+        shared_cache.put_links({
+            entity: candidate for entity, candidate in new_links.items() if entity.name not in failed})
+    links.update(new_links)
+
+    results = [
+        build_record_result(
+            warc_metadata, named_entities, [links[entity] for entity in named_entities], cached_mappings)
+        for (warc_metadata, _), (named_entities, cached_mappings)
+        in zip(prepared, extracted_entities)]
+    processed_records += len(results)
+    return archive_id, results, get_worker_stats()
+
+
+def log_worker_stats(worker_stats: List[WorkerStats]):
+    """
+    Logs the totals of the (last) counters sent back by each worker.
+    """
+    records = sum(stats.records for stats in worker_stats)
+    es_requests = sum(stats.es_requests for stats in worker_stats)
+    es_connections = sum(stats.es_connections for stats in worker_stats)
+    reused = 1 - es_connections / es_requests if es_requests > 0 else 0
+    logging.info(
+        f'{len(worker_stats)} workers processed {records} records, '
+        f'elasticsearch: {es_requests} requests over {es_connections} connections '
+        f'({reused:.1%} sent on a kept-alive connection)')
+
+    caches: Dict[str, CacheStats] = {}
+    for stats in worker_stats:
+        for name, counters in stats.caches.items():
+            total = caches.get(name, CacheStats())
+            caches[name] = CacheStats(
+                hits=total.hits + counters.hits,
+                misses=total.misses + counters.misses,
+                evictions=total.evictions + counters.evictions,
+                size=total.size + counters.size)
+    for name, total in sorted(caches.items()):
+        lookups = total.hits + total.misses
+        if lookups == 0:
+            continue
+        logging.info(
+            f'cache {name}: {lookups} lookups ({total.hits / lookups:.1%} hits), '
+            f'{total.evictions} evictions, {total.size} entries')
+
+
+def stream_tasks(
+    args: ProgramArguments,
+    progress: ArchiveProgress,
+    results: "queue.Queue[Optional[WriterMessage]]",
+    completed_record_ids: Set[str]
+) -> Iterator[Tuple[int, List[Union[bytes, WARCRecordLocation]]]]:
+    """
+    Streams the records of all the archives as `process_records` tasks,
+    in batches of `args.batch_size` records of the same archive.
+    Archives are read one after the other but their records share the
+    same pool, so that idle workers pick up the records of the next
+    archive while the previous one is still being processed.
+
+    Parameters
+    ----------
+    - args `ProgramArguments`
+    The program options.
+
+    - progress `ArchiveProgress`
+    Bookkeeping of the submitted batches.
+
+    - results `queue.Queue[Optional[WriterMessage]]`
+    The writer queue, notified when an archive without pending records
+    is fully read.
+
+    - completed_record_ids `Set[str]`
+    Records processed by a previous run, which are skipped.
+    """
+    for archive_id, archive_path in enumerate(args.archive_paths):
+        logging.info(f'processing archive \'{archive_path}\'')
+
+        # workers read and inflate their own records with parallel
+        # decompression, only the byte ranges are sent through the pool pipe
+        records: Iterator[Union[bytes, WARCRecordLocation]] = stream_record_locations_from_warc(
+            archive_path, skip_record_ids=completed_record_ids) \
+            if args.parallel_decompression else stream_records_from_warc(
+                archive_path, write_index=args.write_index,
+                skip_record_ids=completed_record_ids)
+
+        for batch in batched(records, args.batch_size):
+            progress.submit(archive_id)
+            yield archive_id, batch
+
+        if progress.exhaust(archive_id):
+            results.put((archive_id, None))
 
 
 def main():
-    archive_path = parse_cl_args()
+    args = parse_cl_args()
 
     # in production, we only log critical errors
     logging.basicConfig(
         format='%(asctime)s [%(levelname)s]: %(message)s',
         level=logging.DEBUG if os.getenv('ENV') == 'development' else logging.CRITICAL)
 
-    # start daemon which flushes linked entities to file periodically
-    mp.Process(
-        target=run_flush_daemon,
-        daemon=True
-    ).start()
+    n_workers = mp.cpu_count()
+    max_in_flight = args.max_in_flight * n_workers
+
+    router: OutputRouter
+    if args.output_dir is not None:
+        router = SplitOutputRouter(
+            args.output_dir, args.archive_paths, args.output_format, args.resume)
+    else:
+        router = MergedOutputRouter(
+            args.output, args.output_format, args.resume)
+
+    completed_record_ids = router.completed_record_ids()
+    if args.resume:
+        logging.info(
+            f'resuming, {len(completed_record_ids)} records were already processed')
+
+    # start the writer which flushes linked entities as soon as
+    # the results of a record are handed over by the pool
+    results: "queue.Queue[Optional[WriterMessage]]" = queue.Queue(
+        maxsize=max_in_flight)
+    # the writer keeps draining the queue after an error, which is raised here
+    writer_errors: List[BaseException] = []
+    writer = threading.Thread(target=run_writer, args=(results, router, writer_errors))
+    writer.start()
+
+    # the writer is always stopped (and the pool terminated), so that an
+    # error of a worker or of the reader surfaces instead of hanging
+    kb_servers: Optional[KBServerPool] = None
+    temporary_cache_dir: Optional[str] = None
+    process_pool: Optional[Pool] = None
+    try:
+        # the popular entity dumps of the gazetteer are loaded before
+        # forking, so that the workers share them instead of loading their own
+        popular_entities_gazetteer.load()
+
+        # the knowledge base servers own the Trident databases, the workers
+        # send them batched lookups instead of opening their own
+        if args.kb_servers > 0:
+            kb_servers = KBServerPool(args.kb_servers, open_trident_db)
+
+        # the candidates and the chosen candidates are shared by the workers,
+        # the cache is emptied if it was filled with another configuration
+        cache_path: Optional[str] = None
+        if args.shared_cache:
+            cache_path = args.shared_cache_path
+            if cache_path is None:
+                temporary_cache_dir = tempfile.mkdtemp(prefix='shared-cache-')
+                cache_path = os.path.join(temporary_cache_dir, 'cache.sqlite')
+            create_shared_cache(
+                cache_path, repr((ES_INDEX, args.candidate_query, TYPE_SIGNATURE_FINGERPRINT)))
+
+        # a single long-lived pool processes the records of all the archives
+        process_pool = mp.Pool(
+            n_workers, initializer=init_worker, initargs=(
+                args,
+                kb_servers.addresses if kb_servers is not None else [],
+                kb_servers.authkey if kb_servers is not None else b'',
+                cache_path))
+        progress = ArchiveProgress()
 
-    logging.info(f'processing archive \'{archive_path}\'')
-    process_pool = mp.Pool()
-    process_pool.map(process_record, stream_records_from_warc(archive_path))
-    process_pool.close()
-    process_pool.join()
-    logging.info('processing completed')
+        # records are read lazily, at most 'max_in_flight' batches per
+        # worker are held in memory at any time
+        worker_stats: Dict[int, WorkerStats] = {}
+        for archive_id, record_results, stats in imap_bounded(
+                process_pool, process_records, stream_tasks(
+                    args, progress, results, completed_record_ids),
+                max_in_flight=max_in_flight,
+                chunksize=args.chunksize):
+            worker_stats[stats.pid] = stats
+            results.put((archive_id, record_results))
+            if progress.complete(archive_id):
+                results.put((archive_id, None))
+            if len(writer_errors) > 0:
+                raise writer_errors[0]
+        process_pool.close()
+        process_pool.join()
+        logging.info('processing completed')
+        log_worker_stats(list(worker_stats.values()))
+    finally:
+        if process_pool is not None:
+            process_pool.terminate()
+            process_pool.join()
+        if kb_servers is not None:
+            kb_servers.close()
+        if temporary_cache_dir is not None:
+            shutil.rmtree(temporary_cache_dir, ignore_errors=True)
 
-    # waiting for all the entities to be flushed to file
-    logging.info('waiting for I/O to finish')
-    while not all(p_info['is_flushed'] for p_info in shared_dict.values()):
-        time.sleep(1)
+        # waiting for all the entities to be flushed to file
+        logging.info('waiting for I/O to finish')
+        results.put(None)
+        writer.join()
+        router.close()
 
+    if len(writer_errors) > 0:
+        raise writer_errors[0]
     logging.info('all jobs terminated successfully')
     logging.info('exiting')
 
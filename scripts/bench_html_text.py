@@ -0,0 +1,74 @@
+"""
+This script measures the throughput (pages per second) of the text
+extraction from HTML pages and checks its parity against the previous
+`beautifulsoup` based implementation on a sample archive.
+
+Arguments
+---------
+sys.argv[1] - WARC archive path
+sys.argv[2] - number of repetitions (optional, default = 3)
+"""
+
+import os
+import sys
+import timeit
+import typing
+
+sys.path.append(os.getcwd())
+
+import bs4  # noqa: E402
+
+import src.parsing as parsing  # noqa: E402
+from src.warc import stream_records_from_warc  # noqa: E402
+
+
+def legacy_extract_text_from_html(page: str) -> str:
+    html_start_idx = page.find('<!DOCTYPE')
+    if html_start_idx == -1:
+        return ''
+    soup = bs4.BeautifulSoup(page[html_start_idx:], features="html.parser")
+    for tag in soup(parsing.NON_RELEVANT_HTML_TAGS):
+        tag.extract()
+    if soup.body is None:
+        return ''
+    return typing.cast(str, soup.body.get_text().strip().replace("\n", " ").replace("\r", " "))
+
+
+def main():
+    archive_path = sys.argv[1]
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    pages = [r.decode('utf-8', errors='ignore')
+             for r in stream_records_from_warc(archive_path)]
+
+    lxml_etree = parsing.etree
+    backends = [('beautifulsoup', legacy_extract_text_from_html, None)]
+    if lxml_etree is not None:
+        backends.append(('lxml', parsing.extract_text_from_html, lxml_etree))
+    backends.append(('python', parsing.extract_text_from_html, None))
+
+    outputs = {}
+    for name, extract, etree in backends:
+        parsing.etree = etree
+        outputs[name] = [extract(page) for page in pages]
+        elapsed = min(timeit.repeat(
+            lambda: [extract(page) for page in pages], number=1, repeat=repetitions))
+        print(f'{name:>14}: {len(pages) / elapsed:10.1f} pages/s')
+    parsing.etree = lxml_etree
+
+    # parity is checked on whitespace-normalized text, only for pages
+    # the previous implementation could handle
+    reference = outputs['beautifulsoup']
+    for name in outputs:
+        if name == 'beautifulsoup':
+            continue
+        compared = [(a, b) for a, b in zip(reference, outputs[name]) if a]
+        equal = sum(' '.join(a.split()) == ' '.join(b.split())
+                    for a, b in compared)
+        extra = sum(1 for a, b in zip(reference, outputs[name]) if not a and b)
+        print(f'{name:>14}: {equal}/{len(compared)} pages identical, '
+              f'{extra} pages extracted that were previously empty')
+
+
+if __name__ == '__main__':
+    main()
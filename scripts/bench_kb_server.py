@@ -0,0 +1,99 @@
+"""
+This script measures the throughput of the knowledge base servers (see
+`src/kb_server.py`) as the number of server processes grows: client
+processes send batched attribute lookups ('po') of random entities and
+the lookups answered per second are reported.
+
+The servers use the pure Python stand-in backend filled with synthetic
+entities, or the Trident knowledge base (KB_PATH) with 'trident'.
+
+Arguments
+---------
+sys.argv[1] - backend, 'dict' or 'trident' (optional, default = dict)
+sys.argv[2] - max. number of servers (optional, default = number of CPUs)
+sys.argv[3] - number of client processes (optional, default = number of CPUs)
+sys.argv[4] - lookups per request (optional, default = 50)
+"""
+
+import functools
+import multiprocessing as mp
+import os
+import random
+import sys
+import time
+import typing
+
+sys.path.append(os.getcwd())
+
+from src.kb_server import DictBackend, KBServerPool, connect  # noqa: E402
+
+# synthetic knowledge base of the 'dict' backend
+N_ENTITIES = 100_000
+ATTRIBUTES_PER_ENTITY = 20
+
+# duration (in seconds) of each measure
+MEASURE_SECONDS = 3.0
+
+
+def synthetic_triples() -> typing.Iterator[typing.Tuple[str, str, str]]:
+    rng = random.Random(0)
+    for i in range(N_ENTITIES):
+        for _ in range(ATTRIBUTES_PER_ENTITY):
+            yield entity_term(i), f'P{rng.randrange(100)}', entity_term(rng.randrange(N_ENTITIES))
+
+
+def entity_term(i: int) -> str:
+    return f'<http://www.wikidata.org/entity/Q{i}>'
+
+
+def dict_backend() -> DictBackend:
+    return DictBackend(synthetic_triples())
+
+
+def open_trident() -> typing.Any:
+    from src.knowledge_base import open_trident_db
+    return open_trident_db()
+
+
+def run_client(addresses: typing.List[str], authkey: bytes, entity_ids: typing.List[int],
+               batch_size: int, client_id: int) -> int:
+    client = connect(addresses, authkey, client_id)
+    rng = random.Random(client_id)
+    lookups = 0
+    deadline = time.perf_counter() + MEASURE_SECONDS
+    while time.perf_counter() < deadline:
+        client.po_many(rng.sample(entity_ids, batch_size))
+        lookups += batch_size
+    client.close()
+    return lookups
+
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'dict'
+    max_servers = int(sys.argv[2]) if len(sys.argv) > 2 else mp.cpu_count()
+    n_clients = int(sys.argv[3]) if len(sys.argv) > 3 else mp.cpu_count()
+    batch_size = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+
+    backend_factory = {'dict': dict_backend, 'trident': open_trident}[backend]
+    # the entities are the first items (Q1, Q2, ...)
+    terms = [entity_term(i) for i in range(1, N_ENTITIES)]
+
+    print(f'{backend} backend, {n_clients} clients, {batch_size} lookups per request')
+    print(f'{"servers":>8} {"lookups/s":>12}')
+    for n_servers in range(1, max_servers + 1):
+        with KBServerPool(n_servers, backend_factory) as servers:
+            # the servers are ready once they answer a first request
+            for server in range(n_servers):
+                client = connect(servers.addresses, servers.authkey, server)
+                ids = client.lookup_ids(terms)
+                client.close()
+            entity_ids = [entity_id for entity_id in ids if entity_id is not None]
+            with mp.Pool(n_clients) as pool:
+                lookups = pool.map(functools.partial(
+                    run_client, servers.addresses, servers.authkey, entity_ids, batch_size),
+                    range(n_clients))
+        print(f'{n_servers:>8} {sum(lookups) / MEASURE_SECONDS:12.0f}')
+
+
+if __name__ == '__main__':
+    main()
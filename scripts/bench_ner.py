@@ -0,0 +1,73 @@
+"""
+This script measures the NER throughput (documents per second) on the
+texts of a sample archive: the previous path, which runs the full
+`en_core_web_sm` pipeline on one text at a time, against the batched
+path, which runs only the components the linker uses through
+`spacy.Language.pipe`. It also checks that both produce the same entities.
+
+Arguments
+---------
+sys.argv[1] - WARC archive path
+sys.argv[2] - batch size (optional, default = 8)
+sys.argv[3] - number of spaCy processes (optional, default = 1)
+"""
+
+import os
+import sys
+import time
+import typing
+
+sys.path.append(os.getcwd())
+
+import spacy  # noqa: E402
+from spacy.tokens import Doc  # noqa: E402
+
+import src.parsing as parsing  # noqa: E402
+from src.interfaces import (EntityMapping, NamedEntity,  # noqa: E402
+                            PruningConfig, TextChunk)
+from src.pruning import prune_text_blocks  # noqa: E402
+from src.warc import stream_records_from_warc  # noqa: E402
+
+
+def extract_entities_from_doc(doc: Doc) -> typing.Tuple[typing.Set[NamedEntity], typing.List[EntityMapping]]:
+    """
+    Same as `parsing.extract_entities` for a text already processed by spaCy.
+    """
+    return parsing._extract_entities_from_chunks(
+        [(doc, TextChunk(start=0, end=len(doc.text), owned_start=0, owned_end=len(doc.text)))],
+        parsing.popular_entities_gazetteer.find(doc.text))
+
+
+def main():
+    archive_path = sys.argv[1]
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    n_process = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+
+    texts = [prune_text_blocks(parsing.extract_text_blocks_from_html(
+        r.decode('utf-8', errors='ignore')), PruningConfig())[0]
+        for r in stream_records_from_warc(archive_path)]
+
+    full_nlp = spacy.load("en_core_web_sm")
+    print(f'full pipeline: {full_nlp.pipe_names}')
+    print(f'linker pipeline: {parsing.spacy_nlp.pipe_names}')
+
+    start = time.perf_counter()
+    reference = [extract_entities_from_doc(full_nlp(text))
+                 for text in texts]
+    elapsed = time.perf_counter() - start
+    print(f'{"per document":>14}: {len(texts) / elapsed:10.1f} docs/s')
+
+    start = time.perf_counter()
+    batched = parsing.extract_entities_batch(
+        texts, batch_size=batch_size, n_process=n_process)
+    elapsed = time.perf_counter() - start
+    print(f'{"batched":>14}: {len(texts) / elapsed:10.1f} docs/s '
+          f'(batch size {batch_size}, {n_process} processes)')
+
+    equal = sum(a[0] == b[0] and set(a[1]) == set(b[1])
+                for a, b in zip(reference, batched))
+    print(f'{equal}/{len(texts)} documents with identical entities')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+This script measures the throughput (lines per second) of the output
+sinks against the previous `print` based path.
+
+Arguments
+---------
+sys.argv[1] - number of records (optional, default = 100000)
+sys.argv[2] - mappings per record (optional, default = 10)
+"""
+
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+
+from src.interfaces import (EntityMapping, WARCRecordMetadata,  # noqa: E402
+                            WARCRecordResult)
+from src.io import OUTPUT_FORMATS, open_output_sink  # noqa: E402
+
+
+def main():
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_mappings = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    results = [
+        WARCRecordResult(
+            metadata=WARCRecordMetadata(
+                record_id=f'<urn:uuid:00000000-0000-0000-0000-{i:012d}>'),
+            mappings=[EntityMapping(
+                named_entity=f'Entity {j}',
+                entity_url=f'<http://www.wikidata.org/entity/Q{i * n_mappings + j}>')
+                for j in range(n_mappings)])
+        for i in range(n_records)]
+    n_lines = n_records * n_mappings
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'print.tsv')
+        with open(path, 'w') as f, contextlib.redirect_stdout(f):
+            start = time.perf_counter()
+            for result in results:
+                for mapping in result.mappings:
+                    print(
+                        f'{result.metadata.record_id}\t{mapping.named_entity}\t{mapping.entity_url}')
+            f.flush()
+            os.fsync(f.fileno())
+            elapsed = time.perf_counter() - start
+        print(f'{"print":>10}: {n_lines / elapsed:12.0f} lines/s')
+
+        for output_format in OUTPUT_FORMATS:
+            path = os.path.join(tmp_dir, f'sink.{output_format}')
+            try:
+                start = time.perf_counter()
+                sink = open_output_sink(path, output_format)
+                for result in results:
+                    sink.write(result)
+                sink.close()
+                elapsed = time.perf_counter() - start
+            except ImportError as e:
+                print(f'{output_format:>10}: skipped ({e})')
+                continue
+            print(f'{output_format:>10}: {n_lines / elapsed:12.0f} lines/s '
+                  f'({os.path.getsize(path) / 2 ** 20:.1f} MiB)')
+
+
+if __name__ == '__main__':
+    main()
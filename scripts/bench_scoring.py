@@ -0,0 +1,57 @@
+"""
+This script measures the per-candidate latency of the candidate scoring
+(see `src/knowledge_base.py`) for every NER label, on the first items
+of Wikidata (Q1, Q2, ...) used as candidates.
+
+Both scoring paths are measured explicitly. With Trident (the type
+store is disabled), the cold latency includes the lookups of the
+candidate attributes, the warm latency only the scoring itself (the
+attributes are cached but not the scores). With the type store (see
+`scripts/build_type_store.py`), if it is available, the candidates are
+scored with array lookups only.
+
+Arguments
+---------
+sys.argv[1] - number of candidates (optional, default = 1000)
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import src.knowledge_base as kb  # noqa: E402
+from src.interfaces import CandidateNamedEntity, EntityLabel  # noqa: E402
+
+
+def measure(label: EntityLabel, candidates) -> float:
+    kb.score_entity.cache.clear()
+    start = time.perf_counter()
+    kb.score_candidates(label, candidates)
+    return (time.perf_counter() - start) / len(candidates) * 1e6
+
+
+def main():
+    n_candidates = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    candidates = [CandidateNamedEntity(
+        id=kb.WIKIDATA_ENTITY_FORMAT.format(f'Q{i}'), es_score=0, label='', description='')
+        for i in range(1, n_candidates + 1)]
+
+    store = kb.get_type_store()
+    print(f'{"label":>12} {"cold us":>9} {"warm us":>9} {"store us":>9}')
+    for label in EntityLabel:
+        if label not in kb.LABEL_CLASSES and label not in kb.LABEL_TEMPLATES:
+            continue
+        # the cache keys are the positional arguments of the functions, see `cached`
+        kb.get_type_store.cache.put((), None)
+        kb.fetch_attributes.cache.clear()
+        cold = measure(label, candidates)
+        warm = measure(label, candidates)
+        kb.get_type_store.cache.put((), store)
+        stored = f'{measure(label, candidates):9.2f}' if store is not None else f'{"-":>9}'
+        print(f'{label.name:>12} {cold:9.2f} {warm:9.2f} {stored}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+This script compares the WARC metadata parser against the previous
+regular-expression based implementation on a sample archive.
+
+Arguments
+---------
+sys.argv[1] - WARC archive path
+sys.argv[2] - number of repetitions (optional, default = 5)
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.append(os.getcwd())
+
+from dateutil import parser as date_parser  # noqa: E402
+
+from src.warc import (extract_metadata_from_warc,  # noqa: E402
+                      stream_records_from_warc)
+
+
+def legacy_extract_metadata_from_warc(warc_record: str):
+    w_type = date = trec_id = ip_addr = digest = uri = record_id = None
+    for line in warc_record.splitlines():
+        w_type_match = re.search(r'^WARC-Type: ([a-zA-Z0-9]+)$', line)
+        if w_type_match is not None:
+            w_type = w_type_match.groups()[0]
+        try:
+            date_match = re.search(r'^WARC-Date: ([a-zA-Z0-9\:\-]+)$', line)
+            if date_match is not None:
+                date = date_parser.parse(date_match.groups()[0])
+        except date_parser.ParserError:
+            continue
+        trec_id_match = re.search(
+            r'^WARC-(Trec|TREC)-ID: ([a-zA-Z0-9\-]+)$', line)
+        if trec_id_match is not None:
+            trec_id = trec_id_match.groups()[1]
+        ip_addr_match = re.search(
+            r'^WARC-IP-Address: ([a-zA-Z0-9\-\.]+)$', line)
+        if ip_addr_match is not None:
+            ip_addr = ip_addr_match.groups()[0]
+        digest_match = re.search(
+            r'^WARC-Payload-Digest: ([a-zA-Z0-9\-\.\:]+)$', line)
+        if digest_match is not None:
+            digest = digest_match.groups()[0]
+        uri_match = re.search(r'^WARC-Target-URI: (.+)$', line)
+        if uri_match is not None:
+            uri = uri_match.groups()[0]
+        record_id_match = re.search(r'^WARC-Record-ID: (.+)$', line)
+        if record_id_match is not None:
+            record_id = record_id_match.groups()[0]
+            break
+    if record_id is None:
+        raise ValueError()
+    return (record_id, trec_id, w_type, date, ip_addr, digest, uri)
+
+
+def run_all(parse, records):
+    for record in records:
+        try:
+            parse(record)
+        except ValueError:
+            pass
+
+
+def main():
+    archive_path = sys.argv[1]
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    records = [r.decode('utf-8', errors='ignore')
+               for r in stream_records_from_warc(archive_path)]
+
+    # sanity check: both implementations must agree
+    for record in records:
+        try:
+            expected = legacy_extract_metadata_from_warc(record)
+        except ValueError:
+            continue
+        m = extract_metadata_from_warc(record)
+        actual = (m.record_id, m.trec_id, m.w_type,
+                  m.date, m.ip_addr, m.digest, m.uri)
+        if actual[:3] + actual[4:] != expected[:3] + expected[4:] or \
+                m.date is None or m.date.timestamp() != expected[3].timestamp():
+            print(f'mismatch on record {m.record_id}: {actual} != {expected}')
+
+    def parse_with_date(record):
+        extract_metadata_from_warc(record).date
+
+    for name, parse in [('legacy', legacy_extract_metadata_from_warc),
+                        ('headers', extract_metadata_from_warc),
+                        ('headers + date', parse_with_date)]:
+        elapsed = min(timeit.repeat(
+            lambda: run_all(parse, records), number=1, repeat=repetitions))
+        print(f'{name:>16}: {len(records) / elapsed:12.0f} records/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+This script builds the type store used by the main program to score the
+entity candidates without querying Trident (see `src/type_store.py`).
+
+The knowledge base is walked once per label template (see
+`TYPE_SIGNATURE_TEMPLATES` in `src/knowledge_base.py`): the subjects of
+each (predicate, object) template get its bit in their type signature.
+Only these entities are stored, alongside their number of attributes,
+since any other entity matches no label. The store has to be built again
+when the templates change, the main program ignores it otherwise.
+
+Arguments
+---------
+sys.argv[1] - output path (optional, default = TYPE_STORE_PATH)
+"""
+
+import os
+import sys
+import time
+import typing
+
+sys.path.append(os.getcwd())
+
+import src.knowledge_base as kb  # noqa: E402
+from src.dump_store import WIKIDATA_ENTITY_URI_PATTERN  # noqa: E402
+from src.type_store import TYPE_STORE_PATH, write_type_store  # noqa: E402
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else TYPE_STORE_PATH
+    start_time = time.perf_counter()
+    db = kb.get_trident_db()
+
+    signatures: typing.Dict[int, int] = {}
+    for bit, (prop, item) in enumerate(kb.TYPE_SIGNATURE_TEMPLATES):
+        predicate = kb.fetch_id(kb.WIKIDATA_PROPERTY_FORMAT.format(prop))
+        obj = kb.fetch_id(kb.WIKIDATA_ENTITY_FORMAT.format(item))
+        if predicate is None or obj is None:
+            print(f'({prop}, {item}) is not in the knowledge base')
+            continue
+        subjects = db.s(predicate, obj)
+        for entity in subjects:
+            signatures[entity] = signatures.get(entity, 0) | (1 << bit)
+        print(f'({prop}, {item}): {len(subjects)} subjects')
+
+    rows: typing.List[typing.Tuple[int, int, int]] = []
+    for entity, signature in signatures.items():
+        # only the items (Q...) are candidates
+        match = WIKIDATA_ENTITY_URI_PATTERN.fullmatch(db.lookup_str(entity))
+        if match is None:
+            continue
+        rows.append((int(match.group(1)), kb.count_attributes(db, entity), signature))
+
+    template_counts = [len(kb.label_templates(label)) for label in kb.LABEL_TEMPLATES]
+    n_entities = write_type_store(path, kb.TYPE_SIGNATURE_FINGERPRINT, template_counts, rows)
+    print(f'{n_entities} entities written to \'{path}\' ({os.path.getsize(path)} bytes) '
+          f'in {time.perf_counter() - start_time:.0f}s')
+
+
+if __name__ == '__main__':
+    main()
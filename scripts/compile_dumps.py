@@ -0,0 +1,42 @@
+"""
+This script compiles the TSV dumps of popular entities (see
+`scripts/fetch_popular_entities.py`) into the binary format which is
+memory-mapped by the main program (see `src/dump_store.py`).
+The compiled dump of a category is written next to its TSV dump and is
+used as long as it is more recent than it.
+
+Arguments
+---------
+sys.argv[1:] - categories/labels (optional, default = all the TSV dumps)
+"""
+
+import glob
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from src.dump_store import (COMPILED_DUMP_SUFFIX, DUMP_DIRECTORY,  # noqa: E402
+                            compile_dump, dump_path, read_dump_entries)
+
+
+def main():
+    labels = sys.argv[1:]
+    if len(labels) == 0:
+        labels = sorted(
+            os.path.basename(path)[len('wd-dump_'):-len('.tsv')]
+            for path in glob.glob(os.path.join(DUMP_DIRECTORY, 'wd-dump_*.tsv')))
+
+    for label in labels:
+        start = time.perf_counter()
+        tsv_path = dump_path(label)
+        compiled_path = dump_path(label, COMPILED_DUMP_SUFFIX)
+        n_names = compile_dump(read_dump_entries(tsv_path), compiled_path)
+        print(f'{label:>10}: {n_names} names, '
+              f'{os.path.getsize(tsv_path)} -> {os.path.getsize(compiled_path)} bytes '
+              f'in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+This script compares the shapes of the Elasticsearch query which
+retrieves the entity candidates (see `candidate_search_body` in
+`src/linking.py`) on a gold set: for each shape, with and without the
+exact keyword boost, it reports the search latency, the failed searches
+and the recall of the candidates (the gold entity is among them).
+
+The gold set has the format read by `scripts/score.py`, one
+`<record id>\t<entity name>\t<entity URL>` line per annotation. Each
+distinct (name, entity) pair is evaluated once.
+
+Arguments
+---------
+sys.argv[1] - gold set path
+sys.argv[2] - number of candidates (optional, default = 15)
+sys.argv[3] - keyword boost (optional, default = 2.0)
+"""
+
+import os
+import statistics
+import sys
+import time
+import typing
+
+import elasticsearch as es
+
+sys.path.append(os.getcwd())
+
+from src.interfaces import CandidateQueryConfig  # noqa: E402
+from src.linking import (CANDIDATE_QUERY_SHAPES, ES_INDEX,  # noqa: E402
+                         candidate_search_body, parse_candidates)
+
+
+def read_gold_pairs(path: str) -> typing.List[typing.Tuple[str, str]]:
+    pairs: typing.Dict[typing.Tuple[str, str], None] = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            _, name, entity = line.strip().split('\t', 2)
+            pairs[(name, entity.strip('<>'))] = None
+    return list(pairs)
+
+
+def evaluate(
+    es_client: es.Elasticsearch,
+    pairs: typing.List[typing.Tuple[str, str]],
+    config: CandidateQueryConfig
+) -> typing.Tuple[typing.List[float], int, int]:
+    """
+    Returns the latencies in milliseconds ([0]), the number of failed
+    searches ([1]) and the number of gold entities found ([2]).
+    """
+    latencies: typing.List[float] = []
+    failed, found = 0, 0
+    for name, entity in pairs:
+        start = time.perf_counter()
+        try:
+            response = es_client.search(
+                index=ES_INDEX, body=candidate_search_body(name, config))
+        except es.ElasticsearchException:
+            failed += 1
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        if any(candidate.id.strip('<>') == entity for candidate in parse_candidates(response)):
+            found += 1
+    return latencies, failed, found
+
+
+def main():
+    pairs = read_gold_pairs(sys.argv[1])
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    keyword_boost = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+    print(f'{len(pairs)} (name, entity) pairs, {size} candidates per name')
+
+    es_client = es.Elasticsearch()
+    print(f'{"shape":>28} {"p50 ms":>8} {"p95 ms":>8} {"failed":>7} {"recall":>7}')
+    for shape in CANDIDATE_QUERY_SHAPES:
+        for boost in (0.0, keyword_boost):
+            config = CandidateQueryConfig(shape=shape, size=size, keyword_boost=boost)
+            # a first pass warms up the caches of elasticsearch
+            evaluate(es_client, pairs, config)
+            latencies, failed, found = evaluate(es_client, pairs, config)
+            p50, p95 = (statistics.median(latencies),
+                        sorted(latencies)[int(0.95 * (len(latencies) - 1))]) \
+                if len(latencies) > 0 else (0.0, 0.0)
+            label = f'{shape} (boost {boost:g})' if boost > 0 else shape
+            print(f'{label:>28} {p50:8.2f} {p95:8.2f} {failed:7d} '
+                  f'{found / max(1, len(pairs)):7.3f}')
+
+
+if __name__ == '__main__':
+    main()
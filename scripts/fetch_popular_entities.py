@@ -1,115 +1,281 @@
 """
-This scripts generates a TSV dump for specific categories of entities
+This scripts generates the dump of a specific category of entities
 that have many occurrences in web pages.
 
-The dump is used by the main program to perform a first pass on very 
-popular entities.
+The dump is used by the main program to perform a first pass on very
+popular entities. It is written both as TSV (`src/dumps/wd-dump_<category>.tsv`)
+and in the compiled format memory-mapped by the main program
+(see `src/dump_store.py`).
+
+The subjects of the category are split in partitions which are processed
+by a pool of processes, each one with its own Trident and Elasticsearch
+clients. Every partition checkpoints its progress in a work directory
+(`wd-dump_<category>.parts`), an interrupted run resumes from there when
+it is started again. The partitions and the arguments they depend on are
+written to a manifest in the work directory when a run starts: a resumed
+run reuses its partitions (whatever its number of processes) and refuses
+to resume with another min. number of attributes or other subjects.
 
 Arguments
 ---------
 sys.argv[1] - category/label
 sys.argv[2] - min. number of attributes to be consider popular (optional, default = 25)
+sys.argv[3] - number of processes (optional, default = number of CPUs)
 """
 
 import json
+import multiprocessing as mp
 import os
+import shutil
 import sys
+import time
+import typing
 
 import elasticsearch as es
 import trident
 
+sys.path.append(os.getcwd())
 
-def get_super_entity(label: str) -> str:
-    return {
-        'person': 'Q5',
-        'org': 'Q4830453',
-        'software': 'Q218616',
-        'city': 'Q515',
-        'country': 'Q6256',
-        'website': 'Q35127'
-    }[label]
+from src.dump_store import (COMPILED_DUMP_SUFFIX, DUMP_CATEGORIES,  # noqa: E402
+                            compile_dump, dump_path, read_dump_entries)
+from src.knowledge_base import count_attributes  # noqa: E402
 
+ES_INDEX = 'wikidata_en'
 
-def main():
-    category = sys.argv[1]
+# number of subjects whose attributes are counted and whose labels
+# are fetched (with a single 'mget') before a checkpoint
+FETCH_BATCH_SIZE = 500
 
-    min_attributes = 25
-    if len(sys.argv) > 2:
-        min_attributes = int(sys.argv[2])
+# number of partitions per process, smaller partitions balance the
+# load better at the cost of more checkpoint files
+PARTITIONS_PER_PROCESS = 4
 
-    if category == 'country':
-        with open('scripts/data/countries.json', 'r') as f:
-            countries = json.load(f)
+# marker line of the partition files, written after each batch with
+# the number of subjects of the partition processed so far
+CHECKPOINT_MARKER = '#done'
+
+# file of the work directory describing its partitions, see 'plan_partitions'
+MANIFEST_FILE = 'manifest.json'
+
+# worker process state, see 'init_worker'
+trident_db: typing.Any = None
+es_client: typing.Any = None
+countries: typing.Dict[str, str] = {}
 
-    trident_db = trident.Db(os.getenv(
-        'KB_PATH', "assets/wikidata-20200203-truthy-uri-tridentdb"))
 
+def kb_path() -> str:
+    return os.getenv('KB_PATH', "assets/wikidata-20200203-truthy-uri-tridentdb")
+
+
+def init_worker(category: str):
+    global trident_db, es_client, countries
+    trident_db = trident.Db(kb_path())
     es_client = es.Elasticsearch()
+    if category == 'country':
+        with open('scripts/json/countries.json', 'r') as f:
+            countries = {c['name']: c['code'] for c in json.load(f)}
+
+
+def decode_label(value: str) -> str:
+    return value\
+        .encode()\
+        .decode('unicode_escape')\
+        .encode()\
+        .decode('utf-8')\
+        .strip()
+
+
+def fetch_batch(entities: typing.List[int], min_attributes: int) -> typing.List[str]:
+    """
+    Returns the dump lines of the popular entities of a batch of subjects.
+    """
+    popular = [(entity, trident_db.lookup_str(entity)) for entity in entities
+               if count_attributes(trident_db, entity) > min_attributes]
+    if len(popular) == 0:
+        return []
+
+    response = es_client.mget(
+        index=ES_INDEX, body={'ids': [wd_uri for _, wd_uri in popular]})
 
-    p31 = trident_db.lookup_id('<http://www.wikidata.org/prop/direct/P31>')
+    lines: typing.List[str] = []
+    for (entity, wd_uri), doc in zip(popular, response['docs']):
+        if not doc.get('found', False):
+            continue
+        for field, value in doc['_source'].items():
+            if field == 'schema_description':
+                continue
+            label = decode_label(value)
+            if label in countries:
+                lines.append(f"{entity}\t{countries[label]}\t{wd_uri}\n")
+            lines.append(f"{entity}\t{label}\t{wd_uri}\n")
+    return lines
 
-    super_entity = trident_db.lookup_id(
-        f'<http://www.wikidata.org/entity/{get_super_entity(category)}>')
 
-    cnt_tot = 0
-    cnt_pop = 0
-    itr = trident_db.s_itr(p31, super_entity)
-    entity = itr.field1()
-    dump_str = ""
-    with open(f"wd-dump_{category}.tsv", 'w') as f:
-        while True:
-            cnt_tot += 1
+def load_partition_checkpoint(path: str) -> int:
+    """
+    Returns the number of subjects of a partition which were already
+    processed and drops the lines written after the last checkpoint.
+    """
+    if not os.path.exists(path):
+        return 0
+    done = 0
+    synced_size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(CHECKPOINT_MARKER.encode()) and line.endswith(b'\n'):
+                done = int(line.split(b'\t')[1])
+                synced_size = f.tell()
+    with open(path, 'r+b') as f:
+        f.truncate(synced_size)
+    return done
 
-            next_entity = itr.field1()
 
-            if len(trident_db.po(entity)) > min_attributes:
-                cnt_pop += 1
+def plan_partitions(
+    work_dir: str,
+    category: str,
+    min_attributes: int,
+    entities: typing.List[int],
+    n_processes: int
+) -> typing.List[int]:
+    """
+    Returns the start of each partition of the (sorted) subjects, and the
+    end of the last one. The plan of a new run is written to the manifest
+    of the work directory, an interrupted run reads it back so that its
+    partition files keep their meaning.
 
-                wd_uri = trident_db.lookup_str(entity)
+    Parameters
+    ----------
+    - work_dir `str`
+    The work directory of the category.
 
-                try:
-                    es_res = es_client.get(index='wikidata_en', id=wd_uri)
+    - category `str`
+    The dump category.
 
-                    label: str = ""
-                    for field in es_res['_source']:
-                        if field == 'schema_description':
-                            continue
-                        label = es_res['_source'][field]\
-                            .encode()\
-                            .decode('unicode_escape')\
-                            .encode()\
-                            .decode('utf-8')\
-                            .strip()
+    - min_attributes `int`
+    The min. number of attributes of popular entities.
+
+    - entities `List[int]`
+    The sorted subjects of the category.
+
+    - n_processes `int`
+    The number of processes of a new run.
+
+    Returns
+    -------
+    `List[int]` The partition boundaries, indexes of `entities`.
+    """
+    manifest_path = os.path.join(work_dir, MANIFEST_FILE)
+    subjects = [len(entities), entities[0], entities[-1]] if len(entities) > 0 else [0]
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        mismatches = [
+            f'{key} {manifest[key]} (now {value})'
+            for key, value in (('category', category), ('min_attributes', min_attributes),
+                               ('subjects', subjects))
+            if manifest[key] != value]
+        if len(mismatches) > 0:
+            raise ValueError(
+                f'\'{work_dir}\' was created with {", ".join(mismatches)}, '
+                f'run again with the same arguments or delete it to start over')
+        boundaries: typing.List[int] = manifest['boundaries']
+        print(f'resuming {len(boundaries) - 1} partitions from \'{work_dir}\'')
+        return boundaries
+
+    n_partitions = max(1, min(len(entities), n_processes * PARTITIONS_PER_PROCESS))
+    partition_size = -(-len(entities) // n_partitions)
+    boundaries = [min(i * partition_size, len(entities)) for i in range(n_partitions + 1)]
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump({'category': category, 'min_attributes': min_attributes,
+                   'subjects': subjects, 'boundaries': boundaries}, f)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+    return boundaries
+
+
+def fetch_partition(task: typing.Tuple[str, typing.List[int], int]) -> typing.Tuple[str, int]:
+    """
+    Processes a partition of the subjects, resuming from its checkpoint.
+    This function is meant to be the target of a sub-process.
+
+    Parameters
+    ----------
+    - task `Tuple[str, List[int], int]`
+    The partition file ([0]), the partition subjects ([1]) and the
+    min. number of attributes of popular entities ([2]).
+
+    Returns
+    -------
+    `Tuple[str, int]` The partition file ([0]) and the number of subjects
+    processed by this run ([1]).
+    """
+    path, entities, min_attributes = task
+    done = load_partition_checkpoint(path)
+    with open(path, 'a') as f:
+        for start in range(done, len(entities), FETCH_BATCH_SIZE):
+            batch = entities[start:start + FETCH_BATCH_SIZE]
+            f.writelines(fetch_batch(batch, min_attributes))
+            f.write(f'{CHECKPOINT_MARKER}\t{start + len(batch)}\n')
+            f.flush()
+            os.fsync(f.fileno())
+    return path, len(entities) - done
+
+
+def main():
+    category = sys.argv[1]
+    if category not in DUMP_CATEGORIES:
+        raise ValueError(
+            f'unknown category \'{category}\', expected one of {list(DUMP_CATEGORIES)}')
+
+    min_attributes = 25
+    if len(sys.argv) > 2:
+        min_attributes = int(sys.argv[2])
 
-                        if category == 'country':
-                            try:
-                                country = next(
-                                    c for c in countries if c['name'] == label)
-                                dump_str += (
-                                    f"{entity}\t{country['code']}\t{wd_uri}\n")
-                            except StopIteration:
-                                pass
+    n_processes = mp.cpu_count()
+    if len(sys.argv) > 3:
+        n_processes = int(sys.argv[3])
 
-                        dump_str += (f"{entity}\t{label}\t{wd_uri}\n")
+    start_time = time.perf_counter()
 
-                except es.NotFoundError:
-                    pass
+    db = trident.Db(kb_path())
+    p31 = db.lookup_id('<http://www.wikidata.org/prop/direct/P31>')
+    super_entity = db.lookup_id(
+        f'<http://www.wikidata.org/entity/{DUMP_CATEGORIES[category]}>')
+    # only the subject ids are materialized, the subjects are sorted so
+    # that the partitions are the same when the run is resumed
+    entities = sorted(db.s(p31, super_entity))
+    del db
+    print(f'{len(entities)} subjects in category \'{category}\'')
 
-            if cnt_tot % 10_000 == 0:
-                os.system('clear')
-                print(f'Total: {cnt_tot}')
-                print(f'Selected: {cnt_pop}')
+    work_dir = f'wd-dump_{category}.parts'
+    os.makedirs(work_dir, exist_ok=True)
+    boundaries = plan_partitions(work_dir, category, min_attributes, entities, n_processes)
+    tasks = [(os.path.join(work_dir, f'{i:05d}.tsv'),
+              entities[boundaries[i]:boundaries[i + 1]],
+              min_attributes)
+             for i in range(len(boundaries) - 1)]
 
-            if cnt_pop % 10_000 == 0:
-                f.write(dump_str)
-                dump_str = ""
+    processed = 0
+    with mp.Pool(n_processes, initializer=init_worker, initargs=(category,)) as pool:
+        for path, n_entities in pool.imap_unordered(fetch_partition, tasks):
+            processed += n_entities
+            print(f'{os.path.basename(path)} done, '
+                  f'{processed} subjects processed in {time.perf_counter() - start_time:.0f}s')
 
-            if next_entity == entity or next_entity == -1 or next_entity is None:
-                break
+    # partitions are concatenated in subject order
+    tsv_path = dump_path(category)
+    with open(f'{tsv_path}.tmp', 'w') as out:
+        for path, _, _ in tasks:
+            with open(path, 'r') as f:
+                out.writelines(line for line in f
+                               if not line.startswith(CHECKPOINT_MARKER))
+    os.replace(f'{tsv_path}.tmp', tsv_path)
 
-            entity = next_entity
+    n_names = compile_dump(read_dump_entries(tsv_path),
+                           dump_path(category, COMPILED_DUMP_SUFFIX))
+    print(f'{n_names} names written to \'{tsv_path}\' '
+          f'in {time.perf_counter() - start_time:.0f}s')
 
-        f.write(dump_str)
+    shutil.rmtree(work_dir)
 
 
 if __name__ == '__main__':
@@ -14,15 +14,27 @@ echo "Installing dependencies"
 python3 -m pip install \
     numpy \
     spacy \
-    decorator \
     python-dateutil \
     elasticsearch \
     typing-extensions \
     beautifulsoup4 \
+    lxml \
     scipy
 
 python3 -m spacy download en_core_web_sm
 
+echo ""
+echo ""
+echo "Compiling the popular entity dumps"
+
+python3 scripts/compile_dumps.py
+
+echo ""
+echo ""
+echo "Building the type store of the knowledge base"
+
+python3 scripts/build_type_store.py
+
 echo ""
 echo ""
 
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, cast
+
+import elasticsearch as es
+
+from src.interfaces import (CandidateNamedEntity, CandidateQueryConfig,
+                            NamedEntity)
+from src.linking import (ES_INDEX, candidate_search_body, candidates_cache,
+                         choose_entity_candidate, parse_candidates)
+from src.shared_cache import SharedCache
+
+# None without the 'elasticsearch[async]' extra
+AsyncElasticsearch: Optional[type]
+try:
+    from elasticsearch import AsyncElasticsearch as _AsyncElasticsearch
+    AsyncElasticsearch = _AsyncElasticsearch
+except ImportError:
+    AsyncElasticsearch = None
+
+
+class AsyncLinker:
+    """
+    Asyncio linking engine of a worker process. Each named entity goes
+    from candidate generation to candidate scoring as soon as its own
+    search is answered, so the slowest search only delays its entity.
+
+    At most `max_concurrency` searches are in flight at any time, the
+    candidates are scored on a dedicated single thread since the Trident
+    client is not thread safe (see `src/knowledge_base.py`). The candidates
+    found in the cache shared by the workers (if any) are not searched.
+    Requires the `elasticsearch[async]` extra (`aiohttp`).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        query_config: CandidateQueryConfig = CandidateQueryConfig(),
+        shared_cache: Optional[SharedCache] = None
+    ):
+        if AsyncElasticsearch is None:
+            raise ImportError(
+                "the asyncio engine requires 'aiohttp', please install 'elasticsearch[async]'.")
+        self.max_concurrency = max_concurrency
+        self.query_config = query_config
+        self.shared_cache = shared_cache
+        self.loop = asyncio.new_event_loop()
+        self.es_client = AsyncElasticsearch(maxsize=max_concurrency)
+        self.trident_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='trident')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def link(
+        self,
+        records_entities: List[List[NamedEntity]],
+        failed: Optional[Set[str]] = None
+    ) -> List[List[Optional[CandidateNamedEntity]]]:
+        """
+        Chooses the candidate of the named entities of many records,
+        all the entities are processed concurrently.
+
+        Parameters
+        ----------
+        records_entities: `List[List[NamedEntity]]`
+        The named entities of each record.
+
+        failed: `Optional[Set[str]]`
+        If provided, the names whose search failed are added to it.
+
+        Returns
+        -------
+        `List[List[Optional[CandidateNamedEntity]]]` The chosen candidate of
+        each entity of each record, None if the entity has no candidates.
+        """
+        return self.loop.run_until_complete(self._link_records(
+            records_entities, failed if failed is not None else set()))
+
+    def close(self):
+        self.loop.run_until_complete(self.es_client.close())
+        self.loop.close()
+        self.trident_executor.shutdown()
+
+    async def _link_records(
+        self,
+        records_entities: List[List[NamedEntity]],
+        failed: Set[str]
+    ) -> List[List[Optional[CandidateNamedEntity]]]:
+        if self._semaphore is None:
+            # created in the running loop (the loop argument is deprecated)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        searches: Dict[str, asyncio.Future] = {}
+        if self.shared_cache is not None:
+            names = dict.fromkeys(entity.name for entities in records_entities for entity in entities)
+            for name, candidates in self.shared_cache.get_candidates(
+                    [name for name in names if name not in candidates_cache]).items():
+                candidates_cache.put(name, candidates)
+        searched: Dict[str, List[CandidateNamedEntity]] = {}
+        records_candidates = list(await asyncio.gather(*(
+            self._link_record(searches, searched, failed, entities) for entities in records_entities)))
+        if self.shared_cache is not None:
+            self.shared_cache.put_candidates(searched)
+        return records_candidates
+
+    async def _link_record(
+        self,
+        searches: Dict[str, asyncio.Future],
+        searched: Dict[str, List[CandidateNamedEntity]],
+        failed: Set[str],
+        entities: List[NamedEntity]
+    ) -> List[Optional[CandidateNamedEntity]]:
+        # the chosen candidates are cached per record (see 'link_entities')
+        candidate_cache: Dict[NamedEntity, CandidateNamedEntity] = {}
+        return list(await asyncio.gather(*(
+            self._link_entity(searches, searched, failed, candidate_cache, entity) for entity in entities)))
+
+    async def _link_entity(
+        self,
+        searches: Dict[str, asyncio.Future],
+        searched: Dict[str, List[CandidateNamedEntity]],
+        failed: Set[str],
+        candidate_cache: Dict[NamedEntity, CandidateNamedEntity],
+        entity: NamedEntity
+    ) -> Optional[CandidateNamedEntity]:
+        # a name found in many records (or with many labels) is only searched once
+        if entity.name not in searches:
+            searches[entity.name] = asyncio.ensure_future(self._search_candidates(searched, failed, entity.name))
+        candidates = await searches[entity.name]
+        return await self.loop.run_in_executor(
+            self.trident_executor, choose_entity_candidate,
+            candidate_cache, (entity, candidates))
+
+    async def _search_candidates(
+        self,
+        searched: Dict[str, List[CandidateNamedEntity]],
+        failed: Set[str],
+        name: str
+    ) -> List[CandidateNamedEntity]:
+        cached_candidates: Optional[List[CandidateNamedEntity]] = candidates_cache.get(name)
+        if cached_candidates is not None:
+            return cached_candidates
+        async with cast(asyncio.Semaphore, self._semaphore):
+            try:
+                response = await self.es_client.search(
+                    index=ES_INDEX, request_cache=True,
+                    body=candidate_search_body(name, self.query_config))
+            except es.ElasticsearchException as e:
+                logging.error(f'candidate search failed for \'{name}\': {e}')
+                failed.add(name)
+                return []
+        candidates = searched[name] = parse_candidates(response)
+        candidates_cache.put(name, candidates)
+        return candidates
@@ -1,5 +1,12 @@
 import argparse
-from typing import List
+import importlib.util
+import os
+
+from src.interfaces import (CandidateQueryConfig, ProgramArguments,
+                            PruningConfig)
+from src.io import OUTPUT_FORMATS
+from src.linking import CANDIDATE_QUERY_SHAPES
+from src.warc import find_warc_archives
 
 PROGRAM_DESCRIPTION = '''    
 Welcome to '[WDPS 2021] - Assignment 1' CLI.
@@ -9,41 +16,166 @@ run it by passing one or more WARC archive paths
 to this script.
 '''
 
+# engines linking the named entities of a worker (see `src/async_linking.py`)
+LINKING_ENGINES = ['threads', 'asyncio']
+
 
-def parse_cl_args() -> List[str]:
+def parse_cl_args() -> ProgramArguments:
     """
-    Parses the CLI arguments. It returns the archive path if provided.
+    Parses the CLI arguments. It returns the archive paths (globs and
+    directories are expanded) alongside the program options.
 
     Returns
     -------
-    `str` The list of paths provided to the program. 
+    `ProgramArguments` The arguments provided to the program.
     """
     parser = argparse.ArgumentParser(
         prog='wdps-assignment1',
         description=PROGRAM_DESCRIPTION)
-    parser.add_argument(
-        'archive',
-        nargs=1,
-        type=str,
-        help='WARC archive you want to process.')
-    """
-    NOTE(andrea): this is the interface we designed initially.
-    Unfortunately it looks like the grading script needs to have
-    specific CLI interface.
-
     parser.add_argument(
         'archives',
         metavar='archive_path',
         nargs='+',
         type=str,
-        help='One or multiple paths for the WARC archives you want to process.')
+        help='One or multiple WARC archives, glob patterns or directories you want to process.')
+    parser.add_argument(
+        '--write-index',
+        action='store_true',
+        help='Write a sidecar offset index (<archive>.idx) next to the archive.')
+    parser.add_argument(
+        '--parallel-decompression',
+        action='store_true',
+        help='Let each worker read and inflate its own records (uses and writes the offset index).')
+    parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        default=4,
+        help='Maximum number of record batches per worker that are read but not processed yet (default: 4).')
+    parser.add_argument(
+        '--chunksize',
+        type=int,
+        default=1,
+        help='Number of record batches sent to a worker at once (default: 1).')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=ProgramArguments.batch_size,
+        help=f'Number of records of the same archive whose text is sent to NER together (default: {ProgramArguments.batch_size}).')
+    parser.add_argument(
+        '--skip-covered-ner',
+        action='store_true',
+        help='Do not run NER on pages whose capitalized words are all preloaded entities.')
+    parser.add_argument(
+        '--engine',
+        choices=LINKING_ENGINES,
+        default=ProgramArguments.engine,
+        help=f'Engine linking the entities of a worker: a thread pool or an asyncio event loop, the latter requires \'elasticsearch[async]\' (default: {ProgramArguments.engine}).')
+    parser.add_argument(
+        '--max-concurrency',
+        type=int,
+        default=ProgramArguments.max_concurrency,
+        help=f'Maximum number of candidate searches in flight per worker with the asyncio engine (default: {ProgramArguments.max_concurrency}).')
+    parser.add_argument(
+        '--query-shape',
+        choices=CANDIDATE_QUERY_SHAPES,
+        default=CandidateQueryConfig.shape,
+        help=f'Elasticsearch query retrieving the entity candidates (default: {CandidateQueryConfig.shape}).')
+    parser.add_argument(
+        '--candidates',
+        type=int,
+        default=CandidateQueryConfig.size,
+        help=f'Number of candidates retrieved per named entity (default: {CandidateQueryConfig.size}).')
+    parser.add_argument(
+        '--keyword-boost',
+        type=float,
+        default=CandidateQueryConfig.keyword_boost,
+        help='Boost of the candidates whose label is exactly the entity name, 0 to disable it (default: 0).')
+    parser.add_argument(
+        '--kb-servers',
+        type=int,
+        default=ProgramArguments.kb_servers,
+        help='Number of knowledge base server processes the workers send their (batched) Trident lookups to, 0 to let each worker open the knowledge base (default: 0).')
+    parser.add_argument(
+        '--shared-cache',
+        action='store_true',
+        help='Share the candidates and chosen candidates of the workers in a SQLite file (default: each worker caches its own candidates only).')
+    parser.add_argument(
+        '--shared-cache-path',
+        type=str,
+        default=None,
+        help='SQLite file of \'--shared-cache\', kept across runs (default: a temporary file removed at exit).')
     parser.add_argument(
         '-o', '--output',
-        required=True,
         type=str,
-        help='Output TSV file path. The file will be created if it does not exist, if it exists, it will be overwritten.')
-    """
+        default=None,
+        help='Output file path. The file will be created if it does not exist, if it exists, it will be overwritten (default: standard output).')
+    parser.add_argument(
+        '--format',
+        dest='output_format',
+        choices=list(OUTPUT_FORMATS),
+        default=None,
+        help='Output format (default: inferred from the output file extension, TSV otherwise).')
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        default=None,
+        help='Write one output file per archive in this directory instead of a single merged output.')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume an interrupted run: skip the records listed in the checkpoint journal of the output and append to it.')
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='Remove boilerplate and duplicate paragraphs from the page text and cap its length before NER (default: the whole page text is sent to NER).')
+    parser.add_argument(
+        '--max-page-chars',
+        type=int,
+        default=PruningConfig.max_chars,
+        help=f'Maximum number of characters per page sent to NER with \'--prune\', 0 for no limit (default: {PruningConfig.max_chars}).')
     args = parser.parse_args()
-    if len(args.archive) != 1:
-        raise ValueError("Please input a single WARC path.")
-    return args.archive[0]  # type: ignore
+    archive_paths = find_warc_archives(args.archives)
+    if len(archive_paths) == 0:
+        raise ValueError("Please input at least one WARC path.")
+    # globs and directories only expand to existing files, not literal paths
+    missing_paths = [path for path in archive_paths if not os.path.isfile(path)]
+    if len(missing_paths) > 0:
+        raise ValueError(f"WARC archive not found: {', '.join(missing_paths)}.")
+    if args.output is not None and args.output_dir is not None:
+        raise ValueError("'--output' and '--output-dir' are mutually exclusive.")
+    if args.resume and args.output is None and args.output_dir is None:
+        raise ValueError("'--resume' requires '--output' or '--output-dir'.")
+    if args.max_in_flight < 1 or args.chunksize < 1 or args.batch_size < 1:
+        raise ValueError("'--max-in-flight', '--chunksize' and '--batch-size' must be positive.")
+    if args.max_concurrency < 1 or args.candidates < 1:
+        raise ValueError("'--max-concurrency' and '--candidates' must be positive.")
+    if args.keyword_boost < 0 or args.kb_servers < 0:
+        raise ValueError("'--keyword-boost' and '--kb-servers' must not be negative.")
+    if args.shared_cache_path is not None and not args.shared_cache:
+        raise ValueError("'--shared-cache-path' requires '--shared-cache'.")
+    if args.engine == 'asyncio' and importlib.util.find_spec('aiohttp') is None:
+        raise ValueError("'--engine asyncio' requires 'aiohttp', please install 'elasticsearch[async]'.")
+    return ProgramArguments(
+        archive_paths=archive_paths,
+        write_index=args.write_index,
+        parallel_decompression=args.parallel_decompression,
+        max_in_flight=args.max_in_flight,
+        chunksize=args.chunksize,
+        batch_size=args.batch_size,
+        skip_covered_ner=args.skip_covered_ner,
+        engine=args.engine,
+        max_concurrency=args.max_concurrency,
+        candidate_query=CandidateQueryConfig(
+            shape=args.query_shape,
+            size=args.candidates,
+            keyword_boost=args.keyword_boost),
+        kb_servers=args.kb_servers,
+        shared_cache=args.shared_cache,
+        shared_cache_path=args.shared_cache_path,
+        output=args.output,
+        output_format=args.output_format,
+        output_dir=args.output_dir,
+        resume=args.resume,
+        pruning=PruningConfig(
+            enabled=args.prune,
+            max_chars=args.max_page_chars))
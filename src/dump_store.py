@@ -0,0 +1,339 @@
+import heapq
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import typing
+import unicodedata
+from array import array
+
+DUMP_DIRECTORY = 'src/dumps'
+
+# known dump categories and the Wikidata class their entities are
+# instances of (see 'scripts/fetch_popular_entities.py')
+DUMP_CATEGORIES = {
+    'person': 'Q5',
+    'org': 'Q4830453',
+    'software': 'Q218616',
+    'city': 'Q515',
+    'country': 'Q6256',
+    'website': 'Q35127'
+}
+
+# compiled dump layout (little endian):
+# header | name offsets (uint32, count + 1) | QIDs (uint32, count) | names
+COMPILED_DUMP_MAGIC = b'WDDUMP02'
+COMPILED_DUMP_HEADER = struct.Struct('<8sII')
+COMPILED_DUMP_SUFFIX = '.bin'
+
+WIKIDATA_ENTITY_URI_PATTERN = re.compile(
+    r'<http://www\.wikidata\.org/entity/Q(\d+)>')
+WIKIDATA_ENTITY_URI_FORMAT = '<http://www.wikidata.org/entity/Q{}>'
+
+
+def dump_path(label: str, suffix: str = '.tsv') -> str:
+    return os.path.join(DUMP_DIRECTORY, f'wd-dump_{label}{suffix}')
+
+
+def normalize_dump_name(name: str) -> str:
+    """
+    Normalizes an entity name for the dump lookups: unicode composition,
+    case and whitespace are made uniform, so that names which only differ
+    by them are the same dump entry.
+    """
+    return ' '.join(unicodedata.normalize('NFC', name).split()).casefold()
+
+
+def read_dump_entries(path: str) -> typing.Iterator[typing.Tuple[str, str]]:
+    """
+    Reads the (name, entity URI) entries of a TSV dump, in file order.
+    Malformed lines are skipped.
+
+    Parameters
+    ----------
+    path: `str`
+    The TSV dump path.
+
+    Returns
+    -------
+    `Iterator[Tuple[str, str]]` The entries, duplicates included.
+    """
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                _, name, uri = line.split('\t')
+            except ValueError:
+                continue
+            yield name.strip(), uri.strip()
+
+
+def compile_dump(entries: typing.Iterable[typing.Tuple[str, str]], path: str) -> int:
+    """
+    Writes a compiled dump: the names are normalized (see
+    `normalize_dump_name`) and deduplicated (the last entry of a name wins,
+    as in a dict), then sorted by their UTF-8 bytes and stored
+    next to the numeric QID of their entity so that the file can be
+    memory-mapped and searched in place (see `CompiledDump`).
+
+    Parameters
+    ----------
+    entries: `Iterable[Tuple[str, str]]`
+    The (name, entity URI) entries, see `read_dump_entries`.
+
+    path: `str`
+    The output path, the file is replaced atomically.
+
+    Returns
+    -------
+    `int` Number of names written.
+    """
+    qids: typing.Dict[bytes, int] = {}
+    for name, uri in entries:
+        match = WIKIDATA_ENTITY_URI_PATTERN.fullmatch(uri)
+        if match is None:
+            logging.warning(f'skipping \'{name}\', \'{uri}\' is not a Wikidata entity')
+            continue
+        qids[normalize_dump_name(name).encode('utf-8')] = int(match.group(1))
+
+    keys = sorted(qids)
+    offsets = array('I', [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+    qid_array = array('I', (qids[key] for key in keys))
+    names_size = offsets[-1]
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+        qid_array.byteswap()
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(COMPILED_DUMP_HEADER.pack(
+            COMPILED_DUMP_MAGIC, len(keys), names_size))
+        f.write(offsets.tobytes())
+        f.write(qid_array.tobytes())
+        for key in keys:
+            f.write(key)
+    os.replace(tmp_path, path)
+    return len(keys)
+
+
+class CompiledDump(typing.Mapping[str, str]):
+    """
+    Read-only name to entity URI mapping backed by a memory-mapped
+    compiled dump (see `compile_dump`). Lookups are binary searches on
+    the mapped file, so opening it is instant and its pages are shared by
+    all the processes which map it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count: int
+        magic, self._count, names_size = COMPILED_DUMP_HEADER.unpack_from(self._mmap)
+        if magic != COMPILED_DUMP_MAGIC:
+            raise ValueError(f'\'{path}\' is not a compiled dump (or was compiled by another version).')
+        offsets_start = COMPILED_DUMP_HEADER.size
+        qids_start = offsets_start + 4 * (self._count + 1)
+        self._names_start = qids_start + 4 * self._count
+        if len(self._mmap) != self._names_start + names_size:
+            raise ValueError(f'\'{path}\' is truncated.')
+
+        self._offsets: typing.Sequence[int]
+        self._qids: typing.Sequence[int]
+        if sys.byteorder == 'little':
+            view = memoryview(self._mmap)
+            self._offsets = view[offsets_start:qids_start].cast('I')
+            self._qids = view[qids_start:self._names_start].cast('I')
+        else:
+            self._offsets = array('I', self._mmap[offsets_start:qids_start])
+            self._qids = array('I', self._mmap[qids_start:self._names_start])
+            typing.cast(array, self._offsets).byteswap()
+            typing.cast(array, self._qids).byteswap()
+
+    def _name(self, i: int) -> bytes:
+        return self._mmap[self._names_start + self._offsets[i]:
+                          self._names_start + self._offsets[i + 1]]
+
+    def _lower_bound(self, key: bytes) -> int:
+        # index of the first name which is not lower than 'key'
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, name: str) -> int:
+        key = name.encode('utf-8', errors='surrogatepass')
+        i = self._lower_bound(key)
+        if i < self._count and self._name(i) == key:
+            return i
+        return -1
+
+    def match_prefix(self, prefix: str) -> typing.Tuple[bool, bool]:
+        """
+        Returns whether some names start with a prefix (the prefix itself
+        included) and whether the prefix is a name, with a single search.
+        """
+        key = prefix.encode('utf-8', errors='surrogatepass')
+        i = self._lower_bound(key)
+        if i == self._count:
+            return False, False
+        name = self._name(i)
+        return name.startswith(key), name == key
+
+    def qid(self, name: str) -> typing.Optional[int]:
+        """
+        Returns the numeric QID of the entity of a name, None if missing.
+        """
+        i = self._find(name)
+        return self._qids[i] if i >= 0 else None
+
+    def __getitem__(self, name: str) -> str:
+        if not isinstance(name, str):
+            raise KeyError(name)
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        return WIKIDATA_ENTITY_URI_FORMAT.format(self._qids[i])
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self._find(name) >= 0
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for i in range(self._count):
+            yield self._name(i).decode('utf-8')
+
+    def __len__(self) -> int:
+        return self._count
+
+
+def load_dump(label: str) -> CompiledDump:
+    """
+    Loads a dump category, memory-mapping its compiled version when it is
+    up to date (see `scripts/compile_dumps.py`) and compiling the TSV dump
+    into a temporary file otherwise. A category without any dump is empty.
+
+    Parameters
+    ----------
+    label: `str`
+    The dump category (e.g. 'city').
+
+    Returns
+    -------
+    `CompiledDump` The normalized name to entity URI mapping.
+    """
+    tsv_path = dump_path(label)
+    compiled_path = dump_path(label, COMPILED_DUMP_SUFFIX)
+    if os.path.exists(compiled_path):
+        if os.path.exists(tsv_path) and os.path.getmtime(compiled_path) < os.path.getmtime(tsv_path):
+            logging.warning(
+                f'\'{compiled_path}\' is older than \'{tsv_path}\', run scripts/compile_dumps.py')
+        else:
+            try:
+                return CompiledDump(compiled_path)
+            except ValueError as e:
+                logging.warning(f'{e} Run scripts/compile_dumps.py')
+    entries: typing.Iterable[typing.Tuple[str, str]] = []
+    if os.path.exists(tsv_path):
+        entries = read_dump_entries(tsv_path)
+    else:
+        logging.warning(
+            f'dump category \'{label}\' is not available, run scripts/fetch_popular_entities.py {label}')
+    # the file stays mapped once removed, the processes forked later share it
+    fd, tmp_path = tempfile.mkstemp(prefix=f'wd-dump_{label}', suffix=COMPILED_DUMP_SUFFIX)
+    os.close(fd)
+    try:
+        compile_dump(entries, tmp_path)
+        return CompiledDump(tmp_path)
+    finally:
+        os.remove(tmp_path)
+
+
+class DumpRegistry(typing.Mapping[str, str]):
+    """
+    Name to entity URI mapping over several dump categories. When a name
+    is in many of them the last category wins (same as loading them in
+    order in a single dict). Names are looked up after `normalize_dump_name`.
+
+    The categories are validated when the registry is created and are all
+    loaded together the first time it is used: a lookup may find a name
+    in any category, and the gazetteer searches all of them (the main
+    process loads them before forking the workers).
+    """
+
+    def __init__(self, labels: typing.Sequence[str]):
+        unknown_labels = [label for label in labels if label not in DUMP_CATEGORIES]
+        if len(unknown_labels) > 0:
+            raise ValueError(
+                f'unknown dump categories {unknown_labels}, expected some of {list(DUMP_CATEGORIES)}')
+        self.labels = list(labels)
+        self._dumps: typing.Optional[typing.List[CompiledDump]] = None
+        self._lock = threading.Lock()
+
+    def categories(self) -> typing.List[CompiledDump]:
+        """
+        Returns the (normalized name to entity URI) mappings of the
+        categories of the registry, in order, loading them if needed.
+        """
+        dumps = self._dumps
+        if dumps is None:
+            with self._lock:
+                if self._dumps is None:
+                    self._dumps = [load_dump(label) for label in self.labels]
+                dumps = self._dumps
+        return dumps
+
+    def get(self, name: str, default: typing.Optional[str] = None) -> typing.Optional[str]:  # type: ignore
+        key = normalize_dump_name(name)
+        for dump in reversed(self.categories()):
+            uri = dump.get(key)
+            if uri is not None:
+                return uri
+        return default
+
+    def __getitem__(self, name: str) -> str:
+        uri = self.get(name)
+        if uri is None:
+            raise KeyError(name)
+        return uri
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self.get(name) is not None
+
+    def match_prefix(self, prefix: str) -> typing.Tuple[bool, bool]:
+        """
+        Same as `CompiledDump.match_prefix` over all the categories, the
+        prefix is already normalized.
+        """
+        is_prefix, is_name = False, False
+        for dump in self.categories():
+            if len(dump) == 0:
+                continue
+            dump_is_prefix, dump_is_name = dump.match_prefix(prefix)
+            is_prefix |= dump_is_prefix
+            is_name |= dump_is_name
+        return is_prefix, is_name
+
+    def __iter__(self) -> typing.Iterator[str]:
+        # the categories are sorted (code point and UTF-8 orders are the
+        # same), a name found in many of them is only returned once
+        previous: typing.Optional[str] = None
+        for name in heapq.merge(*self.categories()):
+            if name != previous:
+                yield name
+            previous = name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def load_dumps(*labels) -> DumpRegistry:
+    return DumpRegistry(labels)
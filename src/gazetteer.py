@@ -0,0 +1,124 @@
+import re
+import typing
+
+from src.dump_store import DumpRegistry
+from src.interfaces import GazetteerHit, GazetteerMatch
+from src.utils import LRUCache
+
+# words and single punctuation characters, names and texts are compared
+# token by token so that the spacing around punctuation does not matter
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+WORD_PATTERN = re.compile(r'\w')
+
+# maximum number of prefixes whose search in the dumps is cached by a
+# process, the frequent capitalized words are then only searched once
+PREFIX_CACHE_SIZE = 100_000
+
+_Token = typing.Tuple[str, int, int]
+
+
+def _is_capitalized(token: str) -> bool:
+    # same filter the token pass on spaCy tokens used to apply:
+    # 'Paris' is capitalized, 'paris' and 'PARIS' are not
+    return token[0].isupper() and not (len(token) > 1 and token[1].isupper())
+
+
+class Gazetteer:
+    """
+    Multi-pattern matcher of the preloaded entity names. A text is scanned
+    in a single pass which finds the longest non-overlapping names starting
+    at a capitalized token. The names are searched token by token in the
+    sorted compiled dumps (see `CompiledDump`): a name is extended as long
+    as some normalized name starts with it (see `normalize_dump_name`), so
+    no other copy of the names is built.
+
+    The dumps are loaded on first use, or explicitly with `load` (e.g.
+    before forking the worker processes so that they share them).
+    """
+
+    def __init__(self, dumps: DumpRegistry):
+        self._dumps = dumps
+        self._prefix_cache = LRUCache(maxsize=PREFIX_CACHE_SIZE)
+
+    def load(self):
+        """
+        Loads the dumps if needed.
+        """
+        self._dumps.categories()
+
+    def find(self, text: str) -> GazetteerMatch:
+        """
+        Finds the preloaded entities in a text.
+
+        Parameters
+        ----------
+        text: `str`
+        Raw text
+
+        Returns
+        -------
+        `GazetteerMatch` The hits in text order.
+        """
+        tokens = [(match.group(), match.start(), match.end())
+                  for match in TOKEN_PATTERN.finditer(text)]
+        hits: typing.List[GazetteerHit] = []
+        complete = True
+        i = 0
+        while i < len(tokens):
+            if not tokens[i][0][0].isupper():
+                i += 1
+                continue
+            hit = self._longest_hit(tokens, i) if _is_capitalized(tokens[i][0]) else None
+            if hit is None:
+                # a capitalized token that is not part of a known name
+                complete = False
+                i += 1
+                continue
+            key, j = hit
+            start, end = tokens[i][1], tokens[j - 1][2]
+            hits.append(GazetteerHit(
+                name=' '.join(text[start:end].split()), key=key, start=start, end=end))
+            i = j
+        return GazetteerMatch(hits=hits, complete=complete)
+
+    def _match_prefix(self, prefix: str) -> typing.Tuple[bool, bool]:
+        match = self._prefix_cache.get(prefix)
+        if match is None:
+            match = self._dumps.match_prefix(prefix)
+            self._prefix_cache.put(prefix, match)
+        return typing.cast(typing.Tuple[bool, bool], match)
+
+    def _longest_hit(
+        self,
+        tokens: typing.List[_Token],
+        start: int
+    ) -> typing.Optional[typing.Tuple[str, int]]:
+        # extends the names from 'start' token by token and returns the name
+        # and end token of the longest name. Normalized names separate their
+        # tokens with a single space, or with nothing next to a punctuation
+        # character (two words without space would be a single token), the
+        # spacing of the text wins when both names exist
+        hit: typing.Optional[typing.Tuple[str, int]] = None
+        prefixes = ['']
+        for j in range(start, len(tokens)):
+            token = tokens[j][0].casefold()
+            if j == start:
+                extended = [token]
+            elif WORD_PATTERN.match(token) and WORD_PATTERN.match(tokens[j - 1][0]):
+                extended = [f'{prefix} {token}' for prefix in prefixes]
+            elif tokens[j][1] > tokens[j - 1][2]:
+                extended = [variant for prefix in prefixes
+                            for variant in (f'{prefix}{token}', f'{prefix} {token}')]
+            else:
+                extended = [variant for prefix in prefixes
+                            for variant in (f'{prefix} {token}', f'{prefix}{token}')]
+            prefixes = []
+            for prefix in extended:
+                is_prefix, is_name = self._match_prefix(prefix)
+                if is_prefix:
+                    prefixes.append(prefix)
+                if is_name:
+                    hit = (prefix, j + 1)
+            if len(prefixes) == 0:
+                break
+        return hit
@@ -1,9 +1,9 @@
 import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from typing_extensions import TypedDict
+from src.utils import CacheStats, parse_warc_date
 
 
 class EntityLabel(Enum):
@@ -46,6 +46,99 @@ class EntityMapping:
     entity_url: Optional[str]
 
 
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class TextBlock:
+    """
+    Block-level chunk of text extracted from an HTML page (a paragraph,
+    a list item, a table cell etc.), `link_length` is the number of its
+    characters which are inside links.
+    """
+    text: str
+    link_length: int = 0
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class TextChunk:
+    """
+    Segment of a text which goes through NER on its own. The model reads
+    the characters in [`start`, `end`) but only the tokens and entities
+    starting in [`owned_start`, `owned_end`) are kept, the rest is context
+    shared with the neighbouring chunks.
+    """
+    start: int
+    end: int
+    owned_start: int
+    owned_end: int
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class GazetteerHit:
+    """
+    Occurrence of a preloaded entity in a text, `name` is the entity as
+    written in the text, `key` its (normalized) name in the dumps and
+    [`start`, `end`) the characters it spans.
+    """
+    name: str
+    key: str
+    start: int
+    end: int
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class GazetteerMatch:
+    """
+    Preloaded entities found in a text, `complete` is True when every
+    capitalized token of the text is part of a hit.
+    """
+    hits: List[GazetteerHit]
+    complete: bool
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class CandidateQueryConfig:
+    """
+    Shape of the elasticsearch query which retrieves the candidates of
+    a named entity (see `candidate_search_body` in `src/linking.py`).
+    """
+    # 'query_string' on all fields (the name is parsed as Lucene syntax),
+    # 'escaped_query_string' (the name is searched as plain words),
+    # 'multi_match' on the label fields or 'match' on the main label field
+    shape: str = 'query_string'
+    # number of candidates retrieved per named entity
+    size: int = 15
+    # boost of the candidates whose label is exactly the name, 0 disables it
+    keyword_boost: float = 0.0
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class PruningConfig:
+    """
+    Options of the pruning stage which runs between text extraction
+    and NER (see `src/pruning.py`).
+    """
+    # off by default, the whole page text is sent to NER
+    enabled: bool = False
+    # blocks with a higher fraction of link text are boilerplate
+    max_link_density: float = 0.5
+    # blocks with less words are only kept next to a content block
+    min_block_words: int = 4
+    # blocks with at least this many words are content blocks
+    min_content_words: int = 10
+    remove_duplicates: bool = True
+    # hard cap of characters per page, 0 disables it
+    max_chars: int = 100_000
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class PruningReport:
+    """
+    Number of characters removed by each pruning stage.
+    """
+    boilerplate_chars: int = 0
+    duplicate_chars: int = 0
+    truncated_chars: int = 0
+
+
 @dataclass(eq=True, frozen=True, unsafe_hash=False)
 class WARCRecordMetadata:
     """
@@ -67,16 +160,84 @@ class WARCRecordMetadata:
     record_id: str
     trec_id: Optional[str] = None
     w_type: Optional[str] = None
-    date: Optional[datetime.datetime] = None
+    raw_date: Optional[str] = None
     ip_addr: Optional[str] = None
     digest: Optional[str] = None
     uri: Optional[str] = None
 
+    @property
+    def date(self) -> Optional[datetime.datetime]:
+        """
+        The `WARC-Date` field, parsed on first access.
+        """
+        if self.raw_date is None:
+            return None
+        return parse_warc_date(self.raw_date)
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class WARCRecordLocation:
+    """
+    Byte range of one or more WARC records in an archive. For `.warc.gz`
+    archives the range delimits a single gzip member.
+    """
+    path: str
+    offset: int
+    length: int
+
 
-class WARCJobInformation(TypedDict):
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class WARCRecordResult:
     """
-    Utility class used by the multiprocessing Manager dict.
+    Entity mappings found in a WARC record, sent back by the worker
+    processes to the writer.
     """
+    metadata: WARCRecordMetadata
     mappings: List[EntityMapping]
-    is_done: bool
-    is_flushed: bool
+
+
+@dataclass(eq=True, frozen=True, unsafe_hash=False)
+class WorkerStats:
+    """
+    Cumulative counters of a worker process, sent back alongside the
+    results of each of its tasks.
+    """
+    pid: int
+    records: int = 0
+    es_requests: int = 0
+    # connections opened to elasticsearch, requests sent over already
+    # open (keep-alive) connections are the difference
+    es_connections: int = 0
+    # counters of the caches of the worker by name, see `src.utils.cache_stats`
+    caches: Dict[str, CacheStats] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class ProgramArguments:
+    """
+    Options provided to the program through the CLI.
+    """
+    archive_paths: List[str]
+    write_index: bool = False
+    parallel_decompression: bool = False
+    max_in_flight: int = 4
+    chunksize: int = 1
+    batch_size: int = 8
+    skip_covered_ner: bool = False
+    # 'threads' or 'asyncio', see `src/async_linking.py`
+    engine: str = 'threads'
+    max_concurrency: int = 32
+    candidate_query: CandidateQueryConfig = CandidateQueryConfig()
+    # 0 when each worker opens the knowledge base itself
+    kb_servers: int = 0
+    # whether the workers share their candidates and chosen candidates,
+    # otherwise each worker only caches its own
+    shared_cache: bool = False
+    # SQLite file of the cache shared by the workers (see
+    # `src/shared_cache.py`), None for a temporary one
+    shared_cache_path: Optional[str] = None
+    output: Optional[str] = None
+    output_format: Optional[str] = None
+    output_dir: Optional[str] = None
+    resume: bool = False
+    pruning: PruningConfig = PruningConfig()
@@ -1,32 +1,487 @@
+import gzip
+import io
+import json
+import os
+import queue
+import sys
 import time
-from typing import List
+from typing import Dict, List, Optional, Set, TextIO, Tuple, Type
 
-from src.globals import shared_dict
-from src.interfaces import WARCRecordMetadata
+from src.interfaces import EntityMapping, WARCRecordResult
 
-DAEMON_SLEEP_TIME_S: float = 5
+# 1 MiB write buffer
+OUTPUT_BUFFER_SIZE: int = 1 << 20
+# how often written data is forced to disk
+OUTPUT_FSYNC_INTERVAL_S: float = 30
+# rows buffered before a parquet row group is written
+PARQUET_ROW_GROUP_SIZE: int = 100_000
 
+CHECKPOINT_SUFFIX = '.ckpt'
+CHECKPOINT_SYNC_MARKER = '#sync'
 
-def run_flush_daemon():
+
+def load_checkpoint(output_path: str) -> Tuple[Set[str], int]:
     """
-    I/O specialized daemon which flushes linked entities to console when
-    the child processes flag a record as being processed (see `WARCJobInformation.is_done`).
+    Reads the checkpoint journal of an output file (see `CheckpointJournal`).
+    Only the records listed before the last sync marker are considered
+    completed, the ones after it may not have reached the disk.
+
+    Parameters
+    ----------
+    output_path: `str`
+    The output file path.
+
+    Returns
+    -------
+    `Tuple[Set[str], int]` The completed record ids ([0]) and the size
+    of the output file at the last sync ([1]).
     """
-    while True:
-        time.sleep(DAEMON_SLEEP_TIME_S)
+    completed: Set[str] = set()
+    output_size = 0
+    pending: List[str] = []
+    try:
+        with open(output_path + CHECKPOINT_SUFFIX, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith(CHECKPOINT_SYNC_MARKER):
+                    completed.update(pending)
+                    pending = []
+                    output_size = int(line.split('\t')[1])
+                elif line:
+                    pending.append(line)
+    except FileNotFoundError:
+        pass
+    return completed, output_size
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of the records whose mappings were written to an
+    output file. Record ids are buffered and only appended, followed by
+    a sync marker with the output file size, once the output itself has
+    been synced to disk.
+    """
+
+    def __init__(self, output_path: str, completed: Set[str], output_size: int):
+        path = output_path + CHECKPOINT_SUFFIX
+        # the journal is rewritten with the committed records only,
+        # dropping whatever was written after the last sync marker
+        with open(path + '.tmp', 'w') as f:
+            f.writelines(f'{record_id}\n' for record_id in completed)
+            f.write(f'{CHECKPOINT_SYNC_MARKER}\t{output_size}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self._fd = open(path, 'a')
+        self._pending: List[str] = []
+
+    def add(self, record_id: str):
+        self._pending.append(record_id)
+
+    def commit(self, output_size: int):
+        """
+        Appends the pending record ids, the output must have been synced.
+        """
+        self._fd.writelines(f'{record_id}\n' for record_id in self._pending)
+        self._fd.write(f'{CHECKPOINT_SYNC_MARKER}\t{output_size}\n')
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        self._pending.clear()
+
+    def close(self):
+        self._fd.close()
+
+
+class OutputSink:
+    """
+    Base class for the writers of linked entities. Mappings are written
+    to a large buffer which is flushed and synced to disk periodically
+    (see `OUTPUT_FSYNC_INTERVAL_S`) and when the sink is closed.
+
+    Sinks which can be appended to keep a `CheckpointJournal` next to the
+    output file, so that an interrupted run can be resumed.
+    """
+
+    def __init__(self, path: Optional[str], resume: bool = False):
+        self.path = path
+        self.completed_record_ids: Set[str] = set()
+        self._journal: Optional[CheckpointJournal] = None
+        self._last_sync = time.monotonic()
+        if resume and not self.supports_checkpoint():
+            raise ValueError(
+                f"'{type(self).__name__}' output cannot be resumed")
+
+    def supports_checkpoint(self) -> bool:
+        return False
+
+    def write(self, result: WARCRecordResult):
+        """
+        Writes the entity mappings of a processed record. Records that
+        were already written by a previous run are ignored.
+
+        Parameters
+        ----------
+        result: `WARCRecordResult`
+        The processed record.
+        """
+        record_id = result.metadata.record_id
+        if record_id in self.completed_record_ids:
+            return
+        for mapping in result.mappings:
+            self._write_mapping(record_id, mapping)
+        if self._journal is not None:
+            self._journal.add(record_id)
+        if time.monotonic() - self._last_sync >= OUTPUT_FSYNC_INTERVAL_S:
+            self.sync()
+
+    def sync(self):
+        """
+        Flushes the write buffer and forces the written data to disk,
+        then commits the checkpoint journal.
+        """
+        self._flush()
+        if self._journal is not None:
+            self._journal.commit(self._output_size())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        if self._journal is not None:
+            self._journal.close()
+
+    def _write_mapping(self, record_id: str, mapping: EntityMapping):
+        raise NotImplementedError()
+
+    def _flush(self):
+        raise NotImplementedError()
+
+    def _output_size(self) -> int:
+        raise NotImplementedError()
+
+
+class _TextOutputSink(OutputSink):
+    """
+    Line-oriented sink writing to a buffered text stream, the standard
+    output is used when no path is provided.
+    """
+
+    def __init__(self, path: Optional[str], resume: bool = False):
+        super().__init__(path, resume)
+        output_size: Optional[int] = None
+        if resume and self.path is not None:
+            self.completed_record_ids, output_size = load_checkpoint(
+                self.path)
+        self._raw = self._open_raw(output_size)
+        self._fd: TextIO = io.TextIOWrapper(
+            io.BufferedWriter(self._raw, OUTPUT_BUFFER_SIZE),  # type: ignore
+            encoding='utf-8',
+            newline='\n')
+        if self.path is not None and self.supports_checkpoint():
+            self._journal = CheckpointJournal(
+                self.path, self.completed_record_ids, output_size or 0)
+
+    def supports_checkpoint(self) -> bool:
+        return self.path is not None
+
+    def _open_raw(self, resume_size: Optional[int]) -> io.RawIOBase:
+        if self.path is None:
+            sys.stdout.flush()
+            return io.FileIO(sys.stdout.fileno(), 'w', closefd=False)
+        if resume_size is None:
+            return io.FileIO(self.path, 'w')
+        # drops the lines written after the last checkpoint
+        raw = io.FileIO(self.path, 'a')
+        raw.truncate(resume_size)
+        return raw
+
+    def _flush(self):
+        self._fd.flush()
+        if self.path is not None:
+            os.fsync(self._raw.fileno())
+
+    def _output_size(self) -> int:
+        return os.fstat(self._raw.fileno()).st_size
+
+    def close(self):
+        super().close()
+        self._fd.close()
+
+
+class TSVOutputSink(_TextOutputSink):
+
+    def _write_mapping(self, record_id: str, mapping: EntityMapping):
+        self._fd.write(
+            f'{record_id}\t{mapping.named_entity}\t{mapping.entity_url}\n')
+
+
+class GzipTSVOutputSink(TSVOutputSink):
+
+    def supports_checkpoint(self) -> bool:
+        # a truncated gzip stream cannot be appended to
+        return False
+
+    def _open_raw(self, resume_size: Optional[int]) -> io.RawIOBase:
+        if self.path is None:
+            raise ValueError('gzip output requires an output path')
+        self._gzip_raw = io.FileIO(self.path, 'w')
+        return gzip.GzipFile(fileobj=self._gzip_raw, mode='wb')  # type: ignore
+
+    def _flush(self):
+        self._fd.flush()
+        self._raw.flush()
+        os.fsync(self._gzip_raw.fileno())
+
+    def close(self):
+        super().close()
+        self._gzip_raw.close()
+
+
+class JSONLinesOutputSink(_TextOutputSink):
+
+    def _write_mapping(self, record_id: str, mapping: EntityMapping):
+        self._fd.write(json.dumps({
+            'record_id': record_id,
+            'named_entity': mapping.named_entity,
+            'entity_url': mapping.entity_url}))
+        self._fd.write('\n')
+
+
+class ParquetOutputSink(OutputSink):
+    """
+    Columnar sink, mappings are buffered and written in row groups of
+    `PARQUET_ROW_GROUP_SIZE` rows. Requires the `pyarrow` package.
+    """
+
+    def __init__(self, path: Optional[str], resume: bool = False):
+        super().__init__(path, resume)
+        if self.path is None:
+            raise ValueError('parquet output requires an output path')
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "the 'parquet' output format requires the 'pyarrow' package")
+        self._pa = pa
+        self._schema = pa.schema([
+            ('record_id', pa.string()),
+            ('named_entity', pa.string()),
+            ('entity_url', pa.string())])
+        self._writer = pq.ParquetWriter(self.path, self._schema)
+        self._columns: Dict[str, List[Optional[str]]] = {
+            name: [] for name in self._schema.names}
+
+    def _write_mapping(self, record_id: str, mapping: EntityMapping):
+        self._columns['record_id'].append(record_id)
+        self._columns['named_entity'].append(mapping.named_entity)
+        self._columns['entity_url'].append(mapping.entity_url)
+        if len(self._columns['record_id']) >= PARQUET_ROW_GROUP_SIZE:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if len(self._columns['record_id']) == 0:
+            return
+        self._writer.write_table(
+            self._pa.Table.from_pydict(self._columns, schema=self._schema))
+        for column in self._columns.values():
+            column.clear()
 
-        warc_to_delete: List[WARCRecordMetadata] = []
-        for warc in shared_dict.keys():
-            if not shared_dict[warc]['is_done'] or shared_dict[warc]['is_flushed']:
+    def _flush(self):
+        # parquet files are only readable once closed, row groups
+        # are written when full or on close
+        pass
+
+    def close(self):
+        self._write_row_group()
+        self._writer.close()
+
+
+OUTPUT_FORMATS: Dict[str, Type[OutputSink]] = {
+    'tsv': TSVOutputSink,
+    'tsv.gz': GzipTSVOutputSink,
+    'jsonl': JSONLinesOutputSink,
+    'parquet': ParquetOutputSink,
+}
+
+
+def infer_output_format(path: Optional[str]) -> str:
+    """
+    Infers the output format from the output file extension,
+    defaults to TSV.
+    """
+    if path is not None:
+        for output_format in OUTPUT_FORMATS:
+            if path.endswith(f'.{output_format}'):
+                return output_format
+        if path.endswith('.gz'):
+            return 'tsv.gz'
+    return 'tsv'
+
+
+def open_output_sink(path: Optional[str], output_format: Optional[str] = None, resume: bool = False) -> OutputSink:
+    """
+    Opens the output sink for the given path and format.
+
+    Parameters
+    ----------
+    path: `Optional[str]`
+    The output file path, the standard output is used if None
+    (only for text formats).
+
+    output_format: `Optional[str]`
+    One of `OUTPUT_FORMATS`, inferred from the path if None.
+
+    resume: `bool`
+    Whether to append to the output of a previous run, from its last
+    checkpoint, instead of overwriting it.
+
+    Returns
+    -------
+    `OutputSink` The opened sink.
+    """
+    if output_format is None:
+        output_format = infer_output_format(path)
+    return OUTPUT_FORMATS[output_format](path, resume)
+
+
+def output_path_for_archive(output_dir: str, archive_path: str, output_format: str) -> str:
+    """
+    Returns the path of the output file of a single archive, i.e. the
+    archive file name with the output format extension.
+    """
+    name = os.path.basename(archive_path)
+    for suffix in ('.gz', '.warc'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return os.path.join(output_dir, f'{name}.{output_format}')
+
+
+class OutputRouter:
+    """
+    Routes the results of each archive to its output sink.
+    """
+
+    def completed_record_ids(self) -> Set[str]:
+        """
+        The records written by a previous run, when resuming.
+        """
+        return set()
+
+    def get(self, archive_id: int) -> OutputSink:
+        raise NotImplementedError()
+
+    def release(self, archive_id: int):
+        """
+        Called once all the records of an archive have been written.
+        """
+        pass
+
+    def close(self):
+        raise NotImplementedError()
+
+
+class MergedOutputRouter(OutputRouter):
+    """
+    Writes the results of all the archives to the same sink.
+    """
+
+    def __init__(self, path: Optional[str], output_format: Optional[str] = None, resume: bool = False):
+        self._sink = open_output_sink(path, output_format, resume)
+
+    def completed_record_ids(self) -> Set[str]:
+        return self._sink.completed_record_ids
+
+    def get(self, archive_id: int) -> OutputSink:
+        return self._sink
+
+    def close(self):
+        self._sink.close()
+
+
+class SplitOutputRouter(OutputRouter):
+    """
+    Writes the results of each archive to its own file in the output
+    directory (see `output_path_for_archive`). Sinks are opened when the
+    first result of an archive is written and closed as soon as the
+    archive is done, so that the number of open files stays bounded.
+    """
+
+    def __init__(self, output_dir: str, archive_paths: List[str], output_format: Optional[str] = None, resume: bool = False):
+        self._output_format = output_format or 'tsv'
+        self._resume = resume
+        self._paths = [output_path_for_archive(output_dir, path, self._output_format)
+                       for path in archive_paths]
+        if len(set(self._paths)) != len(self._paths):
+            raise ValueError(
+                'some archives have the same file name, their outputs would overwrite each other')
+        os.makedirs(output_dir, exist_ok=True)
+        self._sinks: Dict[int, OutputSink] = {}
+
+    def completed_record_ids(self) -> Set[str]:
+        completed: Set[str] = set()
+        if self._resume:
+            for path in self._paths:
+                completed.update(load_checkpoint(path)[0])
+        return completed
+
+    def get(self, archive_id: int) -> OutputSink:
+        if archive_id not in self._sinks:
+            self._sinks[archive_id] = open_output_sink(
+                self._paths[archive_id], self._output_format, self._resume)
+        return self._sinks[archive_id]
+
+    def release(self, archive_id: int):
+        # archives without results still get an (empty) output file
+        self.get(archive_id).close()
+        del self._sinks[archive_id]
+
+    def close(self):
+        for sink in self._sinks.values():
+            sink.close()
+        self._sinks.clear()
+
+
+# (archive id, results) or (archive id, None) once the archive is done
+WriterMessage = Tuple[int, Optional[List[WARCRecordResult]]]
+
+
+def run_writer(
+    results: "queue.Queue[Optional[WriterMessage]]",
+    router: OutputRouter,
+    errors: List[BaseException]
+):
+    """
+    I/O specialized thread which flushes linked entities to the output
+    sinks as soon as the results of a record are handed over by the worker
+    processes. It blocks on the queue, without polling, until it receives
+    `None`.
+
+    Parameters
+    ----------
+    results: `queue.Queue[Optional[WriterMessage]]`
+    The queue of processed records, a message without results signals
+    that all the records of the archive have been processed.
+
+    router: `OutputRouter`
+    The output sinks, they are not closed by the writer.
+
+    errors: `List[BaseException]`
+    The error of the writer is appended to it, the queue is then still
+    drained (and the results dropped) so that the producers never block.
+    """
+    while True:
+        message = results.get()
+        if message is None:
+            return
+        if len(errors) > 0:
+            continue
+        archive_id, record_results = message
+        try:
+            if record_results is None:
+                router.release(archive_id)
                 continue
-            for mapping in shared_dict[warc]['mappings']:
-                print(
-                    f'{warc.record_id}\t{mapping.named_entity}\t{mapping.entity_url}')
-            # workaround for DictProxy update not working on nested fields
-            _temp_job_info = shared_dict[warc]
-            _temp_job_info['is_flushed'] = True
-            shared_dict[warc] = _temp_job_info
-            warc_to_delete.append(warc)
-
-        for warc in warc_to_delete:
-            shared_dict.pop(warc)
+            sink = router.get(archive_id)
+            for result in record_results:
+                sink.write(result)
+        except BaseException as e:
+            errors.append(e)
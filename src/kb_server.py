@@ -0,0 +1,196 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import typing
+from multiprocessing.connection import Client, Connection, Listener, wait
+
+# requests are (operation, arguments) tuples, the arguments are a list
+# with one item per lookup and the response is the list of the results
+KB_OPERATIONS = ['lookup_id', 'po', 'exists']
+
+# how often (in seconds) a server checks for new connections
+KB_SERVER_POLL_INTERVAL = 0.05
+
+# how long (in seconds) a client waits for a starting server
+KB_SERVER_CONNECT_TIMEOUT = 60
+
+
+class DictBackend:
+    """
+    Pure Python stand-in of `trident.Db` (for tests and benchmarks),
+    built from (subject, predicate, object) term triples.
+    """
+
+    def __init__(self, triples: typing.Iterable[typing.Tuple[str, str, str]]):
+        self._ids: typing.Dict[str, int] = {}
+        self._po: typing.Dict[int, typing.List[typing.Tuple[int, int]]] = {}
+        for subject, predicate, obj in triples:
+            s, p, o = (self._ids.setdefault(term, len(self._ids))
+                       for term in (subject, predicate, obj))
+            self._po.setdefault(s, []).append((p, o))
+        self._terms = {i: term for term, i in self._ids.items()}
+
+    def lookup_id(self, term: str) -> typing.Optional[int]:
+        return self._ids.get(term)
+
+    def lookup_str(self, entity_id: int) -> str:
+        return self._terms[entity_id]
+
+    def po(self, entity_id: int) -> typing.List[typing.Tuple[int, int]]:
+        return self._po.get(entity_id, [])
+
+    def exists(self, s: int, p: int, o: int) -> bool:
+        return (p, o) in self._po.get(s, [])
+
+
+def _answer(backend, operation: str, arguments: list) -> list:
+    if operation == 'lookup_id':
+        return [backend.lookup_id(term) for term in arguments]
+    if operation == 'po':
+        return [backend.po(entity_id) for entity_id in arguments]
+    if operation == 'exists':
+        return [backend.exists(s, p, o) for s, p, o in arguments]
+    raise ValueError(f'unknown operation \'{operation}\', expected one of {KB_OPERATIONS}')
+
+
+def serve_kb(address: str, authkey: bytes, backend_factory: typing.Callable[[], typing.Any]):
+    """
+    Knowledge base server, this function is meant to be the target of a
+    sub-process. The backend is created in the process and is only used by
+    its serving thread, the requests of all the connections are answered
+    one at a time.
+
+    Parameters
+    ----------
+    address: `str`
+    The unix socket path the server listens on.
+
+    authkey: `bytes`
+    The key the clients authenticate with.
+
+    backend_factory: `Callable[[], Any]`
+    Creates the backend, e.g. a `trident.Db` or a `DictBackend`.
+    """
+    backend = backend_factory()
+    listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    accepted: 'queue.Queue[Connection]' = queue.Queue()
+
+    def accept():
+        while True:
+            try:
+                accepted.put(listener.accept())
+            except (OSError, EOFError) as e:
+                logging.warning(f'knowledge base client rejected: {e}')
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    connections: typing.List[Connection] = []
+    while True:
+        while not accepted.empty():
+            connections.append(accepted.get())
+        for connection in wait(connections, timeout=KB_SERVER_POLL_INTERVAL):
+            connection = typing.cast(Connection, connection)
+            try:
+                operation, arguments = connection.recv()
+            except (EOFError, OSError):
+                connections.remove(connection)
+                continue
+            try:
+                connection.send(_answer(backend, operation, arguments))
+            except Exception as e:
+                # the error is raised again by the client
+                connection.send(e)
+
+
+class KBClient:
+    """
+    Connection to a knowledge base server (see `serve_kb`). It has the
+    lookups of `trident.Db` used by the linker and their batched versions,
+    which answer a whole list of lookups with a single round trip.
+    The client is thread safe.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self._connection = Client(address, family='AF_UNIX', authkey=authkey)
+        self._lock = threading.Lock()
+
+    def request(self, operation: str, arguments: list) -> list:
+        if len(arguments) == 0:
+            return []
+        with self._lock:
+            self._connection.send((operation, arguments))
+            response = self._connection.recv()
+        if isinstance(response, Exception):
+            raise response
+        return typing.cast(list, response)
+
+    def lookup_ids(self, terms: typing.List[str]) -> typing.List[typing.Optional[int]]:
+        return self.request('lookup_id', terms)
+
+    def po_many(self, entity_ids: typing.List[int]) -> typing.List[typing.List[typing.Tuple[int, int]]]:
+        return self.request('po', entity_ids)
+
+    def exists_many(self, triples: typing.List[typing.Tuple[int, int, int]]) -> typing.List[bool]:
+        return self.request('exists', triples)
+
+    def lookup_id(self, term: str) -> typing.Optional[int]:
+        return self.lookup_ids([term])[0]
+
+    def po(self, entity_id: int) -> typing.List[typing.Tuple[int, int]]:
+        return self.po_many([entity_id])[0]
+
+    def exists(self, s: int, p: int, o: int) -> bool:
+        return self.exists_many([(s, p, o)])[0]
+
+    def close(self):
+        self._connection.close()
+
+
+class KBServerPool:
+    """
+    Knowledge base server processes, each one owns its own backend.
+    The clients are spread over the servers (see `connect`).
+    """
+
+    def __init__(self, n_servers: int, backend_factory: typing.Callable[[], typing.Any]):
+        self._directory = tempfile.mkdtemp(prefix='kb-server-')
+        self.authkey = os.urandom(16)
+        self.addresses = [os.path.join(self._directory, f'{i}.sock') for i in range(n_servers)]
+        self._processes = [
+            mp.Process(target=serve_kb, args=(address, self.authkey, backend_factory), daemon=True)
+            for address in self.addresses]
+        for process in self._processes:
+            process.start()
+
+    def close(self):
+        for process in self._processes:
+            process.terminate()
+            process.join()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self) -> 'KBServerPool':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def connect(addresses: typing.Sequence[str], authkey: bytes, key: int) -> KBClient:
+    """
+    Connects to one of the knowledge base servers, chosen by `key` (e.g.
+    the process ID), waiting for it to listen if it is still starting.
+    """
+    address = addresses[key % len(addresses)]
+    deadline = time.monotonic() + KB_SERVER_CONNECT_TIMEOUT
+    while True:
+        try:
+            return KBClient(address, authkey)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(KB_SERVER_POLL_INTERVAL)
@@ -1,20 +1,73 @@
-import multiprocessing as mp
 import os
-from typing import Optional, Set, Tuple
+import sys
+import threading
+import zlib
+from typing import Dict, FrozenSet, List, Optional, Sequence, Set, Tuple, Union
 
 import trident
 
+from src.dump_store import WIKIDATA_ENTITY_URI_PATTERN
 from src.interfaces import CandidateNamedEntity, EntityLabel
+from src.kb_server import KBClient, connect
+from src.type_store import TypeStore, load_type_store
 from src.utils import cached
 
 KB_PATH: str = os.getenv(
     'KB_PATH', "assets/wikidata-20200203-truthy-uri-tridentdb")
 
-trident_db = trident.Db(KB_PATH)
-trident_lock = mp.Lock()
+# bounds of the caches of the knowledge base lookups
+FETCH_ID_CACHE_SIZE = 500_000
+ATTRIBUTES_CACHE_BYTES = 512 * 1024 * 1024
+SCORE_CACHE_SIZE = 500_000
 
+# approximate size of an attribute, a (predicate, object) tuple
+ATTRIBUTE_BYTES = 120
 
-@cached
+# opened (or connected to) on first use, see 'get_trident_db'
+trident_db: Optional[Union[trident.Db, KBClient]] = None
+# the Trident client is not thread safe, each process has its own one
+trident_lock = threading.Lock()
+_trident_open_lock = threading.Lock()
+
+# knowledge base servers used instead of opening Trident (see `use_kb_servers`)
+kb_server_addresses: List[str] = []
+kb_server_authkey = b''
+
+
+def open_trident_db() -> trident.Db:
+    return trident.Db(KB_PATH)
+
+
+def use_kb_servers(addresses: Sequence[str], authkey: bytes):
+    """
+    Makes this process query the knowledge base through the servers of
+    a `src.kb_server.KBServerPool` instead of opening Trident.
+    """
+    global trident_db, kb_server_addresses, kb_server_authkey
+    kb_server_addresses = list(addresses)
+    kb_server_authkey = authkey
+    trident_db = None
+
+
+def get_trident_db() -> Union[trident.Db, KBClient]:
+    """
+    Returns the Trident database, or a client of one of the knowledge
+    base servers, it is only opened when it is first needed (the
+    candidates are scored without it if the type store is available,
+    see `score_candidates`).
+    """
+    global trident_db
+    if trident_db is None:
+        with _trident_open_lock:
+            if trident_db is None:
+                if len(kb_server_addresses) > 0:
+                    trident_db = connect(kb_server_addresses, kb_server_authkey, os.getpid())
+                else:
+                    trident_db = open_trident_db()
+    return trident_db
+
+
+@cached(maxsize=FETCH_ID_CACHE_SIZE)
 def fetch_id(term: str) -> Optional[int]:
     """
     Cached version of `trident.Db.lookup_id`.
@@ -28,10 +81,11 @@ def fetch_id(term: str) -> Optional[int]:
     -------
     `Optional[int]` The trident internal ID or None.
     """
-    return trident_db.lookup_id(term)
+    return get_trident_db().lookup_id(term)
 
 
-@cached
+@cached(maxbytes=ATTRIBUTES_CACHE_BYTES,
+        sizeof=lambda attributes: sys.getsizeof(attributes) + ATTRIBUTE_BYTES * len(attributes))
 def fetch_attributes(entity_id: int) -> Set[Tuple[int, int]]:
     """
     Cached version of `trident.Db.po`.
@@ -46,295 +100,325 @@ def fetch_attributes(entity_id: int) -> Set[Tuple[int, int]]:
     'Set[Tuple[int, int]]'
     Set of tuples in the form (predicate, object).
     """
-    return set(trident_db.po(entity_id))
+    return set(get_trident_db().po(entity_id))
 
 
-@cached
-def score_candidate(label: EntityLabel, candidate: CandidateNamedEntity) -> float:
+def count_attributes(db: trident.Db, entity_id: int) -> int:
     """
-    This function scores a named entity candidate based on compliance with
-    a specific NER label.
+    Counts the (predicate, object) pairs of an entity without retrieving
+    them, same as `len(fetch_attributes(entity_id))` since the triples of
+    the knowledge base are distinct.
 
     Parameters
     ----------
-    label `EntityLabel`
-    The label to compare the candidates with.
+    db `trident.Db`
+    The knowledge base.
 
-    candidate `CandidateNamedEntity`
-    The list of named entity candidates.
+    entity_id `int`
+    The Trident internal ID.
 
     Returns
     -------
-    `float` The compliance score.
+    `int` Number of triples whose subject is the entity.
     """
-    trident_lock.acquire(block=True)
-    score = {
-        EntityLabel.PERSON: score_person,
-        EntityLabel.NORP: score_norp,
-        EntityLabel.FAC: score_fac,
-        EntityLabel.ORG: score_org,
-        EntityLabel.GPE: score_gpe,
-        EntityLabel.LOC: score_loc,
-        EntityLabel.PRODUCT: score_product,
-        EntityLabel.EVENT: score_event,
-        EntityLabel.WORK_OF_ART: score_work_of_art,
-        EntityLabel.LAW: score_law,
-        EntityLabel.LANGUAGE: score_language,
-        EntityLabel.DATE: score_date,
-    }[label](fetch_id(candidate.id))
-    trident_lock.release()
-    return score
-
-
-# pre-fetch utility trident ids
-
-
-# instance of
-PREDICATE_ID_P31 = fetch_id('<http://www.wikidata.org/prop/direct/P31>')
-# subclass of
-PREDICATE_ID_P279 = fetch_id('<http://www.wikidata.org/prop/direct/P279>')
-# named after
-PREDICATE_ID_P138 = fetch_id('<http://www.wikidata.org/prop/direct/P138>')
-# followed by
-PREDICATE_ID_P156 = fetch_id('<http://www.wikidata.org/prop/direct/P156>')
-# day of week
-PREDICATE_ID_P2894 = fetch_id('<http://www.wikidata.org/prop/direct/P2894>')
-#  title i.e. movie
-PREDICATE_ID_P1476 = fetch_id('<http://www.wikidata.org/prop/direct/P1476>')
-# genre type of film / movie / kind of music
-PREDICATE_ID_P136 = fetch_id('<http://www.wikidata.org/prop/direct/P136>')
-# made from materials
-PREDICATE_ID_P186 = fetch_id('<http://www.wikidata.org/prop/direct/P186>')
-# cars - industry
-PREDICATE_ID_P452 = fetch_id('<http://www.wikidata.org/prop/direct/P452>')
-# start time
-PREDICATE_ID_P580 = fetch_id('<http://www.wikidata.org/prop/direct/P580>')
-# end time
-PREDICATE_ID_P582 = fetch_id('<http://www.wikidata.org/prop/direct/P582>')
-# lowest atmospheric pressure
-PREDICATE_ID_P2532 = fetch_id('<http://www.wikidata.org/prop/direct/P2532>')
-# part of the series
-PREDICATE_ID_P179 = fetch_id('<http://www.wikidata.org/prop/direct/P179>')
-
-# predicates for FAC
-# Location
-PREDICATE_ID_P276 = fetch_id('<http://www.wikidata.org/prop/direct/P276>')
-# Coordinate location
-PREDICATE_ID_P625 = fetch_id('<http://www.wikidata.org/prop/direct/P625>')
-# Architectural style
-PREDICATE_ID_P149 = fetch_id('<http://www.wikidata.org/prop/direct/P149>')
-# Maximum capacity
-PREDICATE_ID_P1083 = fetch_id('<http://www.wikidata.org/prop/direct/P1083>')
-# Located in the administrative territorial entity
-PREDICATE_ID_P131 = fetch_id('<http://www.wikidata.org/prop/direct/P131>')
-# Street address
-PREDICATE_ID_P6375 = fetch_id('<http://www.wikidata.org/prop/direct/P6375>')
-
-# predicates for organization
-# Founded by
-PREDICATE_ID_P112 = fetch_id('<http://www.wikidata.org/prop/direct/P112>')
-# Chief executive officer
-PREDICATE_ID_P169 = fetch_id('<http://www.wikidata.org/prop/direct/P169>')
-# Board member
-PREDICATE_ID_P3320 = fetch_id('<http://www.wikidata.org/prop/direct/P3320>')
-# Motto
-PREDICATE_ID_P1546 = fetch_id('<http://www.wikidata.org/prop/direct/P1546>')
-# Motto text
-PREDICATE_ID_P1451 = fetch_id('<http://www.wikidata.org/prop/direct/P1451>')
-# Owned by
-PREDICATE_ID_P127 = fetch_id('<http://www.wikidata.org/prop/direct/P127>')
-# Employees
-PREDICATE_ID_P1128 = fetch_id('<http://www.wikidata.org/prop/direct/P1128>')
-# Product or material produced
-PREDICATE_ID_P1056 = fetch_id('<http://www.wikidata.org/prop/direct/P1056>')
-# Legal form
-PREDICATE_ID_P1454 = fetch_id('<http://www.wikidata.org/prop/direct/P1454>')
-# Inception
-PREDICATE_ID_P571 = fetch_id('<http://www.wikidata.org/prop/direct/P571>')
-# Total revenue
-PREDICATE_ID_P2139 = fetch_id('<http://www.wikidata.org/prop/direct/P2139>')
-# Director/manager
-PREDICATE_ID_P1037 = fetch_id('<http://www.wikidata.org/prop/direct/P1037>')
-
-# predicates for language
-# native label
-PREDICATE_ID_P1705 = fetch_id('<http://www.wikidata.org/prop/direct/P1705>')
-# country
-PREDICATE_ID_P17 = fetch_id('<http://www.wikidata.org/prop/direct/P17>')
-# has part
-PREDICATE_ID_P527 = fetch_id('<http://www.wikidata.org/prop/direct/P527>')
-
-
-def score_person(entity_id: int) -> float:
-    if not trident_db.exists(entity_id, PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q5>')):
-        return 0
-    attributes = fetch_attributes(entity_id)
-    # prioritize entities with more annotations
-    return len(attributes)
-
-
-def score_norp(entity_id: int) -> float:
-    template_attributes = {
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q41710>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q33829>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q22947>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q6266>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q4392985>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q16334295>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q17573152>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/P140>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q7140620>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q844569>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q11499147>')),
-    }
-    attributes = fetch_attributes(entity_id)
-    return len(attributes & template_attributes) / len(template_attributes)
-
-
-def score_fac(entity_id: int) -> float:
-    attributes = fetch_attributes(entity_id)
-    if (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q41176>')) not in attributes:
-        return 0
-    return len(attributes)
-
-def score_org(entity_id: int) -> float:
-    attributes = fetch_attributes(entity_id)
-    if (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q4830453>')) not in attributes:
-        return 0
-    return len(attributes)
-
-
-def score_gpe(entity_id: int) -> float:
-    template_attributes = {
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q3624078>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q619610>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q179164>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q6256>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q515>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q1549591>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q208511>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q2264924>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q208511>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q486972>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q532>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q7930989>'))
-    }
-    attributes = fetch_attributes(entity_id)
-    return len(attributes & template_attributes) / len(template_attributes)
-
-
-def score_loc(entity_id: int) -> float:
-    attributes = fetch_attributes(entity_id)
-    if (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q2221906>')) not in attributes:
-        return 0
-    return len(attributes)
-
-
-def score_product(entity_id: int) -> float:
+    return db.count_s(entity_id)
+
+
+# labels whose candidates must be an instance of a class, the instances
+# with more attributes (i.e. more annotated) are preferred
+LABEL_CLASSES: Dict[EntityLabel, str] = {
+    EntityLabel.PERSON: 'Q5',
+    EntityLabel.FAC: 'Q41176',
+    EntityLabel.ORG: 'Q4830453',
+    EntityLabel.LOC: 'Q2221906',
+    EntityLabel.LAW: 'Q7748',
+}
+
+# (property, item) templates of the other labels, their candidates are
+# scored by the fraction of the (distinct) templates in their attributes
+LABEL_TEMPLATES: Dict[EntityLabel, List[Tuple[str, str]]] = {
+    EntityLabel.NORP: [
+        ('P31', 'Q41710'),
+        ('P31', 'Q33829'),
+        ('P279', 'Q22947'),
+        ('P31', 'Q6266'),
+        ('P31', 'Q4392985'),
+        ('P31', 'Q16334295'),
+        ('P279', 'Q17573152'),
+        ('P31', 'P140'),
+        ('P279', 'Q7140620'),
+        ('P279', 'Q844569'),
+        ('P31', 'Q11499147'),
+    ],
+    EntityLabel.GPE: [
+        ('P31', 'Q3624078'),
+        ('P31', 'Q619610'),
+        ('P31', 'Q179164'),
+        ('P31', 'Q6256'),
+        ('P31', 'Q515'),
+        ('P31', 'Q1549591'),
+        ('P31', 'Q208511'),
+        ('P31', 'Q2264924'),
+        ('P31', 'Q486972'),
+        ('P31', 'Q532'),
+        ('P279', 'Q7930989'),
+    ],
     # instance of food, cars, objects
-    template_attributes = {
+    EntityLabel.PRODUCT: [
         # food
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q2095>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q2095>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q746549>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q17062980>')),
-        # (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q84431525>')),
+        ('P31', 'Q2095'),
+        ('P279', 'Q2095'),
+        ('P31', 'Q746549'),
+        ('P31', 'Q17062980'),
+        # ('P31', 'Q84431525'),
         # cars
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q10429667>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q786820>')),
-        (PREDICATE_ID_P452, fetch_id('<http://www.wikidata.org/entity/Q190117>')),
+        ('P31', 'Q10429667'),
+        ('P31', 'Q786820'),
+        # industry
+        ('P452', 'Q190117'),
         # objects
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q2578402>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q811367>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q39546>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q1183543>')),
-
-    }
-    attributes = fetch_attributes(entity_id)
-    return len(attributes & template_attributes) / len(template_attributes)
-
-
-def score_event(entity_id: int) -> float:
+        ('P279', 'Q2578402'),
+        ('P279', 'Q811367'),
+        ('P279', 'Q39546'),
+        ('P279', 'Q1183543'),
+    ],
     # instance of Wars, rebellions, battles, sport, hurricanes
-    template_attributes = {
+    EntityLabel.EVENT: [
         # wars
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q103495>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q11514315>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q198>')),
-
+        ('P31', 'Q103495'),
+        ('P31', 'Q11514315'),
+        ('P31', 'Q198'),
         # rebellions
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q124734>')),
-
+        ('P31', 'Q124734'),
         # battles: includes part of & location & point in time
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q178561>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q1261499>')),
-
+        ('P31', 'Q178561'),
+        ('P31', 'Q1261499'),
         # sport
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q18608583>')),
-        (PREDICATE_ID_P279, fetch_id('<http://www.wikidata.org/entity/Q44637051>')),
-
+        ('P31', 'Q18608583'),
+        ('P279', 'Q44637051'),
         # hurricane Saffir–Simpson classification category 1 - 5
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q63100559>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q63100584>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q63100595>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q63100601>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q63100611>')),
-        (PREDICATE_ID_P179, fetch_id('<http://www.wikidata.org/entity/Q205801>')),
-
-
-    }
-    attributes = fetch_attributes(entity_id)
-    return len(attributes & template_attributes) / len(template_attributes)
-
-
-def score_work_of_art(entity_id: int) -> float:
+        ('P31', 'Q63100559'),
+        ('P31', 'Q63100584'),
+        ('P31', 'Q63100595'),
+        ('P31', 'Q63100601'),
+        ('P31', 'Q63100611'),
+        # part of the series
+        ('P179', 'Q205801'),
+    ],
     # movies, songs, books, novels, sculptures --> title p1476 & genre p136
-    template_attributes = {
+    EntityLabel.WORK_OF_ART: [
         # film
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q11424>')),
+        ('P31', 'Q11424'),
         # single
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q134556>')),
+        ('P31', 'Q134556'),
         # song
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q7366>')),
+        ('P31', 'Q7366'),
         # sculpture
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q860861>')),
+        ('P31', 'Q860861'),
         # archaeological findings
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q10855061>')),
+        ('P31', 'Q10855061'),
         # literary work
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q7725634>')),
+        ('P31', 'Q7725634'),
+    ],
+    EntityLabel.LANGUAGE: [
+        ('P31', 'Q34770'),
+        ('P31', 'Q1288568'),
+    ],
+    EntityLabel.DATE: [
+        ('P31', 'Q14795564'),
+        # days of the week
+        ('P2894', 'Q132'),
+        ('P2894', 'Q105'),
+        ('P2894', 'Q127'),
+        ('P2894', 'Q128'),
+        ('P2894', 'Q129'),
+        ('P2894', 'Q130'),
+        ('P2894', 'Q131'),
+    ],
+}
+
+WIKIDATA_PROPERTY_FORMAT = '<http://www.wikidata.org/prop/direct/{}>'
+WIKIDATA_ENTITY_FORMAT = '<http://www.wikidata.org/entity/{}>'
+
+# the bits of the type signatures of the entities (see `src/type_store.py`),
+# bit i is set when the entity has the attribute TYPE_SIGNATURE_TEMPLATES[i]
+# (at most 128 templates)
+TYPE_SIGNATURE_TEMPLATES: List[Tuple[str, str]] = list(dict.fromkeys(
+    [('P31', item) for item in LABEL_CLASSES.values()] +
+    [template for templates in LABEL_TEMPLATES.values() for template in templates]))
+
+# identifies the templates (and the order of the template counts) a type
+# store was built for, the store is ignored when they change
+TYPE_SIGNATURE_FINGERPRINT = zlib.crc32(repr(
+    (TYPE_SIGNATURE_TEMPLATES, [label.name for label in LABEL_TEMPLATES])).encode())
 
-    }
-    attributes = fetch_attributes(entity_id)
-    return len(attributes & template_attributes) / len(template_attributes)
 
+@cached
+def label_class(label: EntityLabel) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Returns the Trident IDs of the (instance of, class) attribute
+    required by a label of `LABEL_CLASSES`, resolved on first use.
+    """
+    return (fetch_id(WIKIDATA_PROPERTY_FORMAT.format('P31')),
+            fetch_id(WIKIDATA_ENTITY_FORMAT.format(LABEL_CLASSES[label])))
+
+
+@cached
+def label_templates(label: EntityLabel) -> FrozenSet[Tuple[Optional[int], Optional[int]]]:
+    """
+    Returns the Trident IDs of the (predicate, object) templates of a
+    label of `LABEL_TEMPLATES`, resolved on first use.
+    """
+    return frozenset(
+        (fetch_id(WIKIDATA_PROPERTY_FORMAT.format(prop)), fetch_id(WIKIDATA_ENTITY_FORMAT.format(item)))
+        for prop, item in LABEL_TEMPLATES[label])
 
-def score_law(entity_id: int) -> float:
-    attributes = fetch_attributes(entity_id)
-    if (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q7748>')) not in attributes:
+
+@cached
+def label_signature(label: EntityLabel) -> int:
+    """
+    Returns the type signature bits of the templates of a label
+    (or of its class, see `LABEL_CLASSES`).
+    """
+    templates = [('P31', LABEL_CLASSES[label])] if label in LABEL_CLASSES else LABEL_TEMPLATES[label]
+    signature = 0
+    for template in templates:
+        signature |= 1 << TYPE_SIGNATURE_TEMPLATES.index(template)
+    return signature
+
+
+@cached
+def get_type_store() -> Optional[TypeStore]:
+    """
+    Returns the type store of the entities (see `scripts/build_type_store.py`),
+    None if it is not available.
+    """
+    return load_type_store(TYPE_SIGNATURE_FINGERPRINT)
+
+
+def score_type_signature(store: TypeStore, label: EntityLabel, candidate: CandidateNamedEntity) -> float:
+    """
+    Same as `score_entity` from the type store, the entities which
+    are not in the store match no template.
+    """
+    match = WIKIDATA_ENTITY_URI_PATTERN.fullmatch(candidate.id)
+    signature = store.signature(int(match.group(1))) if match is not None else None
+    if signature is None:
         return 0
-    return len(attributes)
+    n_attributes, bits = signature
+    if label in LABEL_CLASSES:
+        return n_attributes if bits & label_signature(label) else 0
+    n_templates = store.template_counts[list(LABEL_TEMPLATES).index(label)]
+    return bin(bits & label_signature(label)).count('1') / n_templates
 
 
-def score_language(entity_id: int) -> float:
-    template_attributes = {
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q34770>')),
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q1288568>')),
-    }
-    attributes = fetch_attributes(entity_id)
-    return len(attributes & template_attributes) / len(template_attributes)
+@cached(maxsize=SCORE_CACHE_SIZE)
+def is_instance(label: EntityLabel, entity_id: int) -> bool:
+    """
+    Whether an entity is an instance of the class of a label of `LABEL_CLASSES`.
+    """
+    return get_trident_db().exists(entity_id, *label_class(label))
 
 
-def score_date(entity_id: int) -> float:
-    template_attributes = {
-        (PREDICATE_ID_P31, fetch_id('<http://www.wikidata.org/entity/Q14795564>')),
-        # days of the week
-        (PREDICATE_ID_P2894, fetch_id('<http://www.wikidata.org/entity/Q132>')),
-        (PREDICATE_ID_P2894, fetch_id('<http://www.wikidata.org/entity/Q105>')),
-        (PREDICATE_ID_P2894, fetch_id('<http://www.wikidata.org/entity/Q127>')),
-        (PREDICATE_ID_P2894, fetch_id('<http://www.wikidata.org/entity/Q128>')),
-        (PREDICATE_ID_P2894, fetch_id('<http://www.wikidata.org/entity/Q129>')),
-        (PREDICATE_ID_P2894, fetch_id('<http://www.wikidata.org/entity/Q130>')),
-        (PREDICATE_ID_P2894, fetch_id('<http://www.wikidata.org/entity/Q131>')),
-    }
-    attributes = fetch_attributes(entity_id)
-    return len(attributes & template_attributes) / len(template_attributes)
+def prefetch_candidates(client: KBClient, label: EntityLabel, candidates: List[CandidateNamedEntity]):
+    """
+    Fills the caches of the lookups which score the candidates with
+    batched requests to a knowledge base server (at most three round trips
+    instead of up to three per candidate).
+    """
+    # the cache keys are the positional arguments of the functions, see `cached`
+    terms = list(dict.fromkeys(
+        candidate.id for candidate in candidates if (candidate.id,) not in fetch_id.cache))
+    for term, entity_id in zip(terms, client.lookup_ids(terms)):
+        fetch_id.cache.put((term,), entity_id)
+    entity_ids = list(dict.fromkeys(fetch_id(candidate.id) for candidate in candidates))
+
+    if label in LABEL_CLASSES:
+        unknown = [entity_id for entity_id in entity_ids if (label, entity_id) not in is_instance.cache]
+        instances = client.exists_many([(entity_id, *label_class(label)) for entity_id in unknown])
+        for entity_id, instance in zip(unknown, instances):
+            is_instance.cache.put((label, entity_id), instance)
+        # only the attributes of the instances are counted
+        entity_ids = [entity_id for entity_id in entity_ids if is_instance(label, entity_id)]
+
+    unknown = [entity_id for entity_id in entity_ids if (entity_id,) not in fetch_attributes.cache]
+    for entity_id, attributes in zip(unknown, client.po_many(unknown)):
+        fetch_attributes.cache.put((entity_id,), set(attributes))
+
+
+@cached(maxsize=SCORE_CACHE_SIZE)
+def score_entity(label: EntityLabel, entity_id: int) -> float:
+    """
+    Scores a knowledge base entity based on compliance with a specific
+    NER label, the Trident lock must be held (unless the knowledge base
+    servers are used).
+
+    Parameters
+    ----------
+    label `EntityLabel`
+    The label to compare the entity with.
+
+    entity_id `int`
+    The Trident internal ID.
+
+    Returns
+    -------
+    `float` The compliance score.
+    """
+    if label in LABEL_CLASSES:
+        if not is_instance(label, entity_id):
+            return 0
+        # prioritize entities with more annotations
+        return len(fetch_attributes(entity_id))
+
+    templates = label_templates(label)
+    return len(templates.intersection(fetch_attributes(entity_id))) / len(templates)
+
+
+def score_candidate(label: EntityLabel, candidate: CandidateNamedEntity) -> float:
+    """
+    This function scores a named entity candidate based on compliance with
+    a specific NER label.
+
+    Parameters
+    ----------
+    label `EntityLabel`
+    The label to compare the candidates with.
+
+    candidate `CandidateNamedEntity`
+    The list of named entity candidates.
+
+    Returns
+    -------
+    `float` The compliance score.
+    """
+    return score_candidates(label, [candidate])[0]
+
+
+def score_candidates(label: EntityLabel, candidates: List[CandidateNamedEntity]) -> List[float]:
+    """
+    Same as `score_candidate` for many candidates. They are scored with
+    the type store if it is available, otherwise with Trident (the lock is
+    only acquired once) or with batched requests to a knowledge base server.
+
+    Parameters
+    ----------
+    label `EntityLabel`
+    The label to compare the candidates with.
+
+    candidates `List[CandidateNamedEntity]`
+    The named entity candidates.
+
+    Returns
+    -------
+    `List[float]` The compliance score of each candidate.
+    """
+    store = get_type_store()
+    if store is not None:
+        return [score_type_signature(store, label, candidate) for candidate in candidates]
+    db = get_trident_db()
+    if isinstance(db, KBClient):
+        prefetch_candidates(db, label, candidates)
+        return [score_entity(label, fetch_id(candidate.id)) for candidate in candidates]
+    with trident_lock:
+        return [score_entity(label, fetch_id(candidate.id)) for candidate in candidates]
@@ -1,18 +1,132 @@
-from functools import partial
-from typing import Dict, List, Optional, Tuple
+import logging
+import re
+from typing import Dict, List, Optional, Set, Tuple
 
 import elasticsearch as es
 
-from src.interfaces import CandidateNamedEntity, NamedEntity
-from src.knowledge_base import score_candidate
-from src.utils import cached
+from src.interfaces import (CandidateNamedEntity, CandidateQueryConfig,
+                            NamedEntity)
+from src.knowledge_base import score_candidates
+from src.shared_cache import SharedCache
+from src.utils import LRUCache
 
 
-@cached
-def generate_entity_candidates(es_client: es.Elasticsearch, entity: NamedEntity) -> List[CandidateNamedEntity]:
+ES_INDEX = "wikidata_en"
+
+# maximum number of searches sent in a single '_msearch' request
+ES_MSEARCH_BATCH_SIZE = 200
+
+# fields of the candidate documents used as label, in order of preference
+CANDIDATE_LABEL_FIELDS = ['schema_name', 'rdfs_label', 'skos_prefLabel', 'skos_altLabel', 'wikidata_P1476']
+
+# only these fields of the candidate documents are sent back
+CANDIDATE_SOURCE_FIELDS = CANDIDATE_LABEL_FIELDS + ['schema_description']
+
+# shapes of the candidate query, see `CandidateQueryConfig`
+CANDIDATE_QUERY_SHAPES = ['query_string', 'escaped_query_string', 'multi_match', 'match']
+
+# characters of the Lucene query syntax, escaped in 'escaped_query_string' queries
+QUERY_STRING_RESERVED_PATTERN = re.compile(r'([+\-=&|!(){}\[\]^"~*?:\\/])')
+
+# maximum number of names whose candidates are cached by a process
+CANDIDATES_CACHE_SIZE = 50_000
+
+# candidates of the names already searched by this process, the query
+# does not depend on the entity label so each name is searched once
+candidates_cache = LRUCache(maxsize=CANDIDATES_CACHE_SIZE, name='src.linking.candidates_cache')
+
+
+def escape_query_string(text: str) -> str:
+    """
+    Escapes the Lucene query syntax in a text, e.g. 'AT&T' or
+    'C++ (language)' are searched as plain words.
     """
-    Queries local elasticsearch instance for entity candidates based on simple
-    string comparison between named entity and wikidata `doc.schema_name`.
+    # '<' and '>' cannot be escaped, they are removed
+    return QUERY_STRING_RESERVED_PATTERN.sub(
+        r'\\\1', text.replace('<', ' ').replace('>', ' '))
+
+
+def candidate_search_body(name: str, config: CandidateQueryConfig = CandidateQueryConfig()) -> dict:
+    """
+    Returns the body of the elasticsearch query for the candidates of
+    a named entity, only the fields read by `parse_candidates` are retrieved.
+
+    Parameters
+    ----------
+    name: `str`
+    Name of the named entity.
+
+    config: `CandidateQueryConfig`
+    Shape of the query.
+
+    Returns
+    -------
+    `dict` The search body.
+    """
+    query: dict
+    if config.shape == 'query_string':
+        # the name is parsed as Lucene syntax, e.g. 'AC/DC' fails
+        query = {"query_string": {"query": name}}
+    elif config.shape == 'escaped_query_string':
+        query = {"query_string": {"query": escape_query_string(name)}}
+    elif config.shape == 'multi_match':
+        query = {"multi_match": {"query": name, "fields": CANDIDATE_LABEL_FIELDS}}
+    elif config.shape == 'match':
+        query = {"match": {CANDIDATE_LABEL_FIELDS[0]: {"query": name}}}
+    else:
+        raise ValueError(
+            f'unknown candidate query shape \'{config.shape}\', expected one of {CANDIDATE_QUERY_SHAPES}')
+
+    if config.keyword_boost > 0:
+        # the label fields are also indexed as keywords (default dynamic mapping)
+        query = {"bool": {
+            "must": query,
+            "should": [
+                {"term": {f'{field}.keyword': {"value": name, "boost": config.keyword_boost}}}
+                for field in CANDIDATE_LABEL_FIELDS]}}
+
+    return {
+        "size": config.size,
+        "_source": CANDIDATE_SOURCE_FIELDS,
+        "query": query}
+
+
+def parse_candidates(response: dict) -> List[CandidateNamedEntity]:
+    """
+    Returns the candidates found in the response of a candidate search.
+    """
+    candidates: List[CandidateNamedEntity] = []
+    for hit in response['hits']['hits']:
+        description = hit['_source'].get("schema_description", "")
+        # we skip disambiguation pages as we don't want to perform external network requests
+        # to actually use them
+        if 'Wikimedia disambiguation page' in description:
+            continue
+
+        label: str = ""
+        for field in CANDIDATE_LABEL_FIELDS:
+            if field in hit['_source']:
+                label = hit['_source'][field]
+                break
+
+        candidates.append(CandidateNamedEntity(
+            id=hit["_id"],
+            es_score=hit["_score"],
+            label=label,
+            description=description))
+
+    return candidates
+
+
+def generate_entity_candidates(
+    es_client: es.Elasticsearch,
+    entity: NamedEntity,
+    config: CandidateQueryConfig = CandidateQueryConfig()
+) -> List[CandidateNamedEntity]:
+    """
+    Queries local elasticsearch instance for entity candidates based on
+    string comparison between named entity and the wikidata label fields.
+    See `generate_entity_candidates_batch`.
 
     Parameters
     ----------
@@ -22,41 +136,115 @@ def generate_entity_candidates(es_client: es.Elasticsearch, entity: NamedEntity)
     entity: `NamedEntity`
     Named entity extracted from text.
 
+    config: `CandidateQueryConfig`
+    Shape of the candidate query.
+
     Returns
     -------
     `List[CandidateNamedEntity]` List of candidates in the form of wikidata docs metadata.
     """
-    try:
-        response = es_client.search(
-            size=15,
-            index="wikidata_en",
-            request_cache=True,
-            body={"query": {"query_string": {"query": entity.name, }}})
-
-        candidates: List[CandidateNamedEntity] = []
-        for hit in response['hits']['hits']:
-            description = hit['_source'].get("schema_description", "")
-            # we skip disambiguation pages as we don't want to perform external network requests
-            # to actually use them
-            if 'Wikimedia disambiguation page' in description:
-                continue
+    return generate_entity_candidates_batch(es_client, [entity], config)[0]
+
+
+def generate_entity_candidates_batch(
+    es_client: es.Elasticsearch,
+    entities: List[NamedEntity],
+    config: CandidateQueryConfig = CandidateQueryConfig(),
+    shared_cache: Optional[SharedCache] = None,
+    failed: Optional[Set[str]] = None
+) -> List[List[CandidateNamedEntity]]:
+    """
+    Same as `generate_entity_candidates` for many named entities at once.
+    The names which were not searched yet by this process (nor by another
+    one, with a shared cache) are sent in a single `_msearch` request (per
+    `ES_MSEARCH_BATCH_SIZE` names) and only the label fields of the
+    candidates are retrieved.
+
+    Parameters
+    ----------
+    es_client: `elasticsearch.Elasticsearch`
+    Elasticsearch client instance (thread safe client).
 
-            label: str = ""
-            for field in ['schema_name', 'rdfs_label', 'skos_prefLabel', 'skos_altLabel', 'wikidata_P1476']:
-                if field in hit['_source']:
-                    label = hit['_source'][field]
-                    break
+    entities: `List[NamedEntity]`
+    Named entities extracted from text, possibly repeated.
 
-            candidates.append(CandidateNamedEntity(
-                id=hit["_id"],
-                es_score=hit["_score"],
-                label=label,
-                description=description))
+    config: `CandidateQueryConfig`
+    Shape of the candidate query.
 
-        return candidates
+    shared_cache: `Optional[SharedCache]`
+    The cache shared by the worker processes, if any.
 
-    except es.ElasticsearchException as e:
-        return []
+    failed: `Optional[Set[str]]`
+    If provided, the names whose search failed are added to it.
+
+    Returns
+    -------
+    `List[List[CandidateNamedEntity]]` The candidates of each entity, in
+    the same order. Entities whose search failed have no candidates.
+    """
+    # the candidates found by this call, cached entries may be evicted meanwhile
+    found: Dict[str, List[CandidateNamedEntity]] = {}
+    uncached: List[str] = []
+    for name in dict.fromkeys(entity.name for entity in entities):
+        candidates = candidates_cache.get(name)
+        if candidates is None:
+            uncached.append(name)
+        else:
+            found[name] = candidates
+
+    if shared_cache is not None and len(uncached) > 0:
+        shared = shared_cache.get_candidates(uncached)
+        for name, candidates in shared.items():
+            found[name] = candidates
+            candidates_cache.put(name, candidates)
+        uncached = [name for name in uncached if name not in shared]
+
+    # failed searches are not cached
+    searched: Dict[str, List[CandidateNamedEntity]] = {}
+    for start in range(0, len(uncached), ES_MSEARCH_BATCH_SIZE):
+        batch = uncached[start:start + ES_MSEARCH_BATCH_SIZE]
+        body: List[dict] = []
+        for name in batch:
+            body.append({"index": ES_INDEX, "request_cache": True})
+            body.append(candidate_search_body(name, config))
+        try:
+            responses = es_client.msearch(body=body)['responses']
+        except es.ElasticsearchException as e:
+            logging.error(f'candidate search failed: {e}')
+            found.update((name, []) for name in batch)
+            if failed is not None:
+                failed.update(batch)
+            continue
+
+        for name, response in zip(batch, responses):
+            if 'error' in response:
+                logging.error(
+                    f'candidate search failed for \'{name}\': {response["error"]}')
+                found[name] = []
+                if failed is not None:
+                    failed.add(name)
+                continue
+            found[name] = searched[name] = parse_candidates(response)
+            candidates_cache.put(name, found[name])
+
+    if shared_cache is not None:
+        shared_cache.put_candidates(searched)
+    return [found[entity.name] for entity in entities]
+
+
+def elasticsearch_connection_stats(es_client: es.Elasticsearch) -> Tuple[int, int]:
+    """
+    Returns the number of HTTP requests sent by an elasticsearch client ([0])
+    and the number of connections it opened to send them ([1]).
+    """
+    requests, connections = 0, 0
+    for connection in es_client.transport.connection_pool.connections:
+        # only the urllib3 based connections keep a pool of HTTP connections
+        pool = getattr(connection, 'pool', None)
+        if pool is not None:
+            requests += pool.num_requests
+            connections += pool.num_connections
+    return requests, connections
 
 
 def choose_entity_candidate(
@@ -68,9 +256,9 @@ def choose_entity_candidate(
     to perform SPARQL queris tailored to the specific entity category and
     pick the most likely candidate.
 
-    This function sorts the provided canidate list in place
-    in descending order based on their score of compliance with
-    a specific NER label.
+    The candidate list is not modified as it is shared by the entities
+    with the same name (see `candidates_cache`), the first candidate with
+    the highest score of compliance with the NER label is chosen.
 
     Parameters
     ----------
@@ -92,9 +280,8 @@ def choose_entity_candidate(
     if entity in candidate_cache:
         return candidate_cache[entity]
 
-    candidates.sort(key=partial(score_candidate, entity.label), reverse=True)
-
-    candidate_cache[entity] = candidates[0]
+    scores = score_candidates(entity.label, candidates)
+    candidate_cache[entity] = candidates[scores.index(max(scores))]
     return candidate_cache[entity]
 
 
@@ -1,20 +1,201 @@
+import itertools
+import re
 import typing
+from html.parser import HTMLParser
 
-import bs4
 import spacy
+from spacy.tokens import Doc
 
+from src.gazetteer import Gazetteer
 from src.globals import dump_popular_entities
-from src.interfaces import EntityLabel, EntityMapping, NamedEntity
+from src.interfaces import (EntityLabel, EntityMapping, GazetteerMatch,
+                            NamedEntity, TextBlock, TextChunk)
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
 
 NON_RELEVANT_HTML_TAGS = ["script", "style", "link", "noscript"]
 
-spacy_nlp = spacy.load("en_core_web_sm")
+# elements without content nor end tag
+VOID_HTML_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+                  "link", "meta", "param", "source", "track", "wbr"}
+
+# elements which start a new block of text
+BLOCK_HTML_TAGS = {"address", "article", "aside", "blockquote", "br", "dd", "div",
+                   "dl", "dt", "fieldset", "figcaption", "figure", "footer", "form",
+                   "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main",
+                   "nav", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul"}
+
+# elements allowed in the page head, any other one starts the body even
+# if the head is not closed (e.g. '<head><title>T</title><body>')
+HEAD_HTML_TAGS = {"base", "link", "meta", "noscript", "script", "style", "template", "title"}
+
+# beginning of the HTML document, after the WARC and HTTP headers
+HTML_START_PATTERN = re.compile(r'<!doctype|<html|<head|<body', re.IGNORECASE)
+
+# the preloaded entities are found by the gazetteer, the linker only
+# reads the named entities of spaCy (tok2vec and ner)
+SPACY_EXCLUDED_COMPONENTS = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+spacy_nlp = spacy.load("en_core_web_sm", exclude=SPACY_EXCLUDED_COMPONENTS)
+
+popular_entities_gazetteer = Gazetteer(dump_popular_entities)
+
+# long texts go through NER in chunks of at most 'NER_CHUNK_SIZE' characters
+# (well below 'spacy_nlp.max_length'), each one read with 'NER_CHUNK_OVERLAP'
+# characters of context on both sides
+NER_CHUNK_SIZE = 10_000
+NER_CHUNK_OVERLAP = 200
+
+# chunks preferably end after a sentence, otherwise after a whitespace
+SENTENCE_END_PATTERN = re.compile(r'[.!?]["\')\]]?\s+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+class _TextCollector:
+    """
+    Streaming text collector, it receives start tag, end tag and text
+    events from a tokenizer (it can be used directly as `lxml` parser target)
+    and keeps the text of the page body. Subtrees of `NON_RELEVANT_HTML_TAGS`
+    and the page head (until it is closed or a body element starts) are
+    dropped without ever building a DOM.
+    If the page has no body, the text outside the head is kept.
+
+    The text is split in blocks at the boundaries of `BLOCK_HTML_TAGS`,
+    keeping track of how much of each block is link text.
+    """
+
+    def __init__(self):
+        self.blocks: typing.List[TextBlock] = []
+        self._parts: typing.List[str] = []
+        self._link_length = 0
+        self._skip_depth = 0
+        self._head_depth = 0
+        self._link_depth = 0
+        self._has_body = False
+        self._body_closed = False
+
+    def start(self, tag: str, attrib=None):
+        tag = tag.lower()
+        if self._head_depth > 0 and tag != 'head' and tag not in HEAD_HTML_TAGS:
+            self._head_depth = 0
+        if tag in BLOCK_HTML_TAGS:
+            self._close_block()
+        if tag in VOID_HTML_TAGS:
+            return
+        if tag in NON_RELEVANT_HTML_TAGS:
+            self._skip_depth += 1
+        elif tag == 'head':
+            self._head_depth += 1
+        elif tag == 'a':
+            self._link_depth += 1
+        elif tag == 'body' and not self._has_body:
+            # text found before the body is not part of it
+            self._has_body = True
+            self.blocks = []
+            self._parts = []
+            self._link_length = 0
+
+    def end(self, tag: str):
+        tag = tag.lower()
+        if tag in BLOCK_HTML_TAGS:
+            self._close_block()
+        if tag in VOID_HTML_TAGS:
+            return
+        if tag in NON_RELEVANT_HTML_TAGS and self._skip_depth > 0:
+            self._skip_depth -= 1
+        elif tag == 'head' and self._head_depth > 0:
+            self._head_depth -= 1
+        elif tag == 'a' and self._link_depth > 0:
+            self._link_depth -= 1
+        elif tag == 'body' and self._has_body:
+            self._body_closed = True
+
+    def data(self, text: str):
+        if self._skip_depth == 0 and self._head_depth == 0 and not self._body_closed:
+            self._parts.append(text)
+            if self._link_depth > 0:
+                self._link_length += len(text)
+
+    def close(self) -> typing.List[TextBlock]:
+        self._close_block()
+        return self.blocks
+
+    def _close_block(self):
+        if len(self._parts) == 0:
+            return
+        self.blocks.append(TextBlock(
+            text=''.join(self._parts), link_length=self._link_length))
+        self._parts = []
+        self._link_length = 0
+
+
+class _PythonHTMLTokenizer(HTMLParser):
+    """
+    Pure-Python fallback used when `lxml` is not available, it forwards
+    the events of the standard library tokenizer to a `_TextCollector`.
+    """
+
+    def __init__(self, collector: _TextCollector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def extract_text_blocks_from_html(page: str) -> typing.List[TextBlock]:
+    """
+    Extracts the text blocks from HTML page, removing scripts and other
+    non-relevant strings. The page is tokenized in a single streaming pass
+    (with `lxml` if available) and no DOM is built.
+
+    Parameters
+    ----------
+    page: `str`
+    The target HTML page.
+
+    Returns
+    -------
+    `List[TextBlock]` The text blocks in document order.
+    """
+    html_start = HTML_START_PATTERN.search(page)
+
+    if html_start is None:
+        return []
+
+    collector = _TextCollector()
+    if etree is not None:
+        parser = etree.HTMLParser(
+            target=collector, recover=True, no_network=True)
+        parser.feed(page[html_start.start():])
+        return typing.cast(typing.List[TextBlock], parser.close())
+    tokenizer = _PythonHTMLTokenizer(collector)
+    tokenizer.feed(page[html_start.start():])
+    tokenizer.close()
+    return collector.close()
+
+
+def join_text_blocks(blocks: typing.Iterable[TextBlock], separator: str = '') -> str:
+    """
+    Joins text blocks into a single line of text.
+    """
+    text = separator.join(block.text for block in blocks)
+    return text.strip().replace("\n", " ").replace("\r", " ")
 
 
 def extract_text_from_html(page: str) -> str:
     """
     Extracts text from HTML page, removing scripts and other non-relevant
-    strings.
+    strings (see `extract_text_blocks_from_html`).
 
     Parameters
     ----------
@@ -25,129 +206,207 @@ def extract_text_from_html(page: str) -> str:
     -------
     `str` The extracted text
     """
-    html_start_idx = page.find('<!DOCTYPE')
-
-    if html_start_idx == -1:
-        return ''
+    return join_text_blocks(extract_text_blocks_from_html(page))
+
+
+def _find_chunk_end(text: str, start: int, limit: int) -> int:
+    # the chunk is cut at the last sentence end (or whitespace) found in
+    # the second half of the allowed range, at 'limit' if there is none
+    for pattern in (SENTENCE_END_PATTERN, WHITESPACE_PATTERN):
+        end = None
+        for match in pattern.finditer(text, start + (limit - start) // 2, limit):
+            end = match.end()
+        if end is not None:
+            return end
+    return limit
+
+
+def split_text_chunks(
+    text: str,
+    chunk_size: int = NER_CHUNK_SIZE,
+    overlap: int = NER_CHUNK_OVERLAP
+) -> typing.List[TextChunk]:
+    """
+    Splits a text in chunks for NER, at sentence boundaries when possible.
+    The owned regions of the chunks cover the text without overlapping,
+    a text shorter than `chunk_size` is a single chunk.
 
-    soup = bs4.BeautifulSoup(page[html_start_idx:], features="html.parser")
-    for tag in soup(NON_RELEVANT_HTML_TAGS):
-        tag.extract()
+    Parameters
+    ----------
+    text: `str`
+    Raw text
 
-    return typing.cast(str, soup.body.get_text().strip().replace("\n", " ").replace("\r", " "))
+    chunk_size: `int`
+    Maximum number of characters owned by a chunk.
 
+    overlap: `int`
+    Number of context characters read on both sides of the owned region.
 
-def extract_entities(text: str) -> typing.Tuple[typing.Set[NamedEntity], typing.List[EntityMapping]]:
+    Returns
+    -------
+    `List[TextChunk]` At least one chunk, in text order.
+    """
+    chunks: typing.List[TextChunk] = []
+    owned_start = 0
+    while True:
+        if len(text) - owned_start <= chunk_size:
+            owned_end = len(text)
+        else:
+            owned_end = _find_chunk_end(
+                text, owned_start, owned_start + chunk_size)
+        chunks.append(TextChunk(
+            start=max(0, owned_start - overlap),
+            end=min(len(text), owned_end + overlap),
+            owned_start=owned_start,
+            owned_end=owned_end))
+        if owned_end >= len(text):
+            return chunks
+        owned_start = owned_end
+
+
+def extract_entities(
+    text: str,
+    skip_covered: bool = False
+) -> typing.Tuple[typing.Set[NamedEntity], typing.List[EntityMapping]]:
     """
     Returns the named entities found in the text and some entity mappings that were found
-    using preloaded knowledge.
+    using preloaded knowledge. Long texts are processed in chunks (see `split_text_chunks`).
 
     Parameters
     ----------
     text: `str`
     Raw text
 
+    skip_covered: `bool`
+    Do not run spaCy if every capitalized token of the text is part of
+    a preloaded entity.
+
     Returns
     -------
     `Tuple[Set[NamedEntity], List[EntityMapping], List[numpy.ndarray]]`
     A tuple containing the Set of labeled named entities that were found [0] and some entity
     mappings which were produced directly from cached values [1].
     """
+    return extract_entities_batch([text], batch_size=1, skip_covered=skip_covered)[0]
+
+
+def extract_entities_batch(
+    texts: typing.List[str],
+    batch_size: int = 8,
+    n_process: int = 1,
+    skip_covered: bool = False
+) -> typing.List[typing.Tuple[typing.Set[NamedEntity], typing.List[EntityMapping]]]:
+    """
+    Same as `extract_entities` for many texts at once, the chunks of all
+    the texts are streamed through spaCy in batches (see `spacy.Language.pipe`).
+
+    Parameters
+    ----------
+    texts: `List[str]`
+    Raw texts
+
+    batch_size: `int`
+    Number of chunks processed together by spaCy.
+
+    n_process: `int`
+    Number of processes used by spaCy, it must be 1 inside a
+    `multiprocessing.Pool` worker.
 
-    doc = spacy_nlp(text)
+    skip_covered: `bool`
+    See `extract_entities`.
+
+    Returns
+    -------
+    `List[Tuple[Set[NamedEntity], List[EntityMapping]]]`
+    The result of `extract_entities` for each text, in the same order.
+    """
+    matches = [popular_entities_gazetteer.find(text) for text in texts]
+    results: typing.List[typing.Tuple[typing.Set[NamedEntity], typing.List[EntityMapping]]] = [
+        _extract_entities_from_chunks([], match) for match in matches]
 
-    # we first perform a simple pass on single tokens and proper nouns
-    # and we match them to the popular entities that we have preloaded
-    # from trident and elasticsearch. This already produces good mappings
-    # with very little computation time.
+    def stream_chunks() -> typing.Iterator[typing.Tuple[str, typing.Tuple[int, TextChunk]]]:
+        for text_id, text in enumerate(texts):
+            if skip_covered and matches[text_id].complete:
+                continue
+            for chunk in split_text_chunks(text):
+                yield text[chunk.start:chunk.end], (text_id, chunk)
+
+    docs = spacy_nlp.pipe(stream_chunks(), as_tuples=True,
+                          batch_size=batch_size, n_process=n_process)
+    for text_id, text_docs in itertools.groupby(docs, key=lambda d: d[1][0]):
+        results[text_id] = _extract_entities_from_chunks(
+            ((doc, chunk) for doc, (_, chunk) in text_docs), matches[text_id])
+    return results
+
+
+def _extract_entities_from_chunks(
+    chunks: typing.Iterable[typing.Tuple[Doc, TextChunk]],
+    match: GazetteerMatch
+) -> typing.Tuple[typing.Set[NamedEntity], typing.List[EntityMapping]]:
+    # only the (text, label) of the owned entities are kept, an entity
+    # which overlaps an entity kept by the previous chunk is the same
+    # one seen across the boundary
+    ents: typing.List[typing.Tuple[str, str]] = []
+    last_entity_end = 0
+    for doc, chunk in chunks:
+        for entity in doc.ents:
+            entity_start = chunk.start + entity.start_char
+            if chunk.owned_start <= entity_start < chunk.owned_end and entity_start >= last_entity_end:
+                ents.append((entity.text, entity.label_))
+                last_entity_end = chunk.start + entity.end_char
+
+    # we first match the text against the popular entities that we have
+    # preloaded from trident and elasticsearch (see 'Gazetteer').
+    # This already produces good mappings with very little computation time.
 
     cached_mappings: typing.List[EntityMapping] = []
     cached_entities: typing.Set[str] = set()
 
-    def add_preloaded_entity(current_entity: str):
+    def add_preloaded_entity(current_entity: str, dump_name: typing.Optional[str] = None):
         # we already added this
         if current_entity in cached_entities:
             return
-        cached_entity = dump_popular_entities[current_entity]
+        cached_entity = dump_popular_entities[dump_name or current_entity]
         cached_entities.add(current_entity)
         cached_mappings.append(
             EntityMapping(named_entity=current_entity,
                           entity_url=cached_entity))
 
-    current_propn: typing.List[str] = []
-    for token in doc:
-
-        if token.pos_ == 'PROPN' and len(current_propn) > 0:
-            current_propn.append(token.text)
-
-        if not (len(token.text) > 0 and token.text[0].isupper()) or (len(token.text) > 1 and token.text[1].isupper()):
-            continue
-
-        # if we find a match with the single token
-        if token.text in dump_popular_entities:
-            add_preloaded_entity(token.text)
-            continue
-
-        token_text_low = token.text.lower()
-        if token_text_low in dump_popular_entities:
-            add_preloaded_entity(token_text_low)
-            continue
-
-        # end of the proper noun group
-        if token.pos_ != 'PROPN' and len(current_propn) > 0:
-            current_entity = ' '.join(current_propn)
-            current_entity_low = ' '.join(current_propn)
-            # do we have a match in preloaded entities?
-            # if so let's store the mapping without further analysis
-            if current_entity in dump_popular_entities:
-                add_preloaded_entity(current_entity)
-            elif current_entity[:-1] in dump_popular_entities:
-                add_preloaded_entity(current_entity[:-1])
-            elif current_entity_low in dump_popular_entities:
-                add_preloaded_entity(current_entity_low)
-            elif current_entity_low[:-1] in dump_popular_entities:
-                add_preloaded_entity(current_entity_low[:-1])
-            current_propn = []
+    for hit in match.hits:
+        add_preloaded_entity(hit.name, hit.key)
 
     # entities that were not matched previously are now added
     # to the pipeline and further processed in the next steps
 
     entities: typing.Set[NamedEntity] = set()
 
-    for entity in doc.ents:
-        if entity.text in cached_entities:
+    for entity_text, entity_label in ents:
+        if entity_text in cached_entities:
             continue
 
         # we perform another round of preloaded mappings
         # on entities that were only found by SpaCy to
         # further reduce the amount of entities that will
         # be processed in the computation-heavy pipeline
+        # (the dump lookups ignore case and whitespace)
 
-        if entity.text in dump_popular_entities:
-            add_preloaded_entity(entity.text)
-            continue
-        elif entity.text[:-1] in dump_popular_entities:
-            add_preloaded_entity(entity.text[:-1])
-            continue
-
-        entity_text_low = entity.text.lower()
-        if entity_text_low in dump_popular_entities:
-            add_preloaded_entity(entity_text_low)
+        if entity_text in dump_popular_entities:
+            add_preloaded_entity(entity_text)
             continue
-        elif entity_text_low[:-1] in dump_popular_entities:
-            add_preloaded_entity(entity_text_low[:-1])
+        elif entity_text[:-1] in dump_popular_entities:
+            add_preloaded_entity(entity_text[:-1])
             continue
 
-        if not (len(entity.text) > 0 and entity.text[0].isupper()) or (len(entity.text) > 1 and entity.text[1].isupper()):
+        if not (len(entity_text) > 0 and entity_text[0].isupper()) or (len(entity_text) > 1 and entity_text[1].isupper()):
             continue
 
         # NOTE(andrea): we may not want to do this but looking at the sample
         # simple numbers and date/times are not considered
-        if entity.label_ in {'CARDINAL', 'ORDINAL', 'PERCENT', 'QUANTITY', 'TIME', 'MONEY', 'DATE'}:
+        if entity_label in {'CARDINAL', 'ORDINAL', 'PERCENT', 'QUANTITY', 'TIME', 'MONEY', 'DATE'}:
             continue
 
         # we prevent entities from having multiple spaces inside the string
-        multiple_spaces_split = entity.text.strip().split('  ')
+        multiple_spaces_split = entity_text.strip().split('  ')
 
         for sub_entt in multiple_spaces_split:
             # we don't want URLs
@@ -155,6 +414,6 @@ def extract_entities(text: str) -> typing.Tuple[typing.Set[NamedEntity], typing.
                 continue
 
             entities.add(NamedEntity(name=sub_entt.strip(),
-                                     label=EntityLabel(entity.label_)))
+                                     label=EntityLabel(entity_label)))
 
     return entities, cached_mappings
@@ -0,0 +1,132 @@
+import re
+from typing import List, Set, Tuple
+
+from src.interfaces import PruningConfig, PruningReport, TextBlock
+from src.parsing import join_text_blocks
+
+# used to compare paragraphs regardless of case, punctuation and spacing
+NON_WORD_PATTERN = re.compile(r'\W+')
+
+
+def remove_boilerplate(blocks: List[TextBlock], config: PruningConfig) -> Tuple[List[TextBlock], int]:
+    """
+    Block-level boilerplate removal (navigation menus, link lists, footers).
+    A block is boilerplate if most of its text is link text, or if it is
+    a short block (low text density) which is not next to a content block.
+
+    Parameters
+    ----------
+    blocks: `List[TextBlock]`
+    The text blocks of a page.
+
+    config: `PruningConfig`
+    The pruning options.
+
+    Returns
+    -------
+    `Tuple[List[TextBlock], int]` The remaining blocks ([0]) and the
+    number of removed characters ([1]).
+    """
+    # whitespace-only blocks are ignored when looking for neighbours
+    blocks = [block for block in blocks if not block.text.isspace()]
+    n_words = [len(block.text.split()) for block in blocks]
+    is_link_dense = [
+        block.link_length > config.max_link_density * len(block.text.strip())
+        for block in blocks]
+    is_content = [not is_link_dense[i] and n_words[i] >= config.min_content_words
+                  for i in range(len(blocks))]
+
+    kept: List[TextBlock] = []
+    removed_chars = 0
+    for i, block in enumerate(blocks):
+        next_to_content = (i > 0 and is_content[i - 1]) or \
+            (i < len(blocks) - 1 and is_content[i + 1])
+        if is_link_dense[i] or (n_words[i] < config.min_block_words and not next_to_content):
+            removed_chars += len(block.text)
+            continue
+        kept.append(block)
+    return kept, removed_chars
+
+
+def remove_duplicate_blocks(blocks: List[TextBlock]) -> Tuple[List[TextBlock], int]:
+    """
+    Removes blocks which repeat an earlier block of the page once case,
+    punctuation and spacing are ignored.
+
+    Parameters
+    ----------
+    blocks: `List[TextBlock]`
+    The text blocks of a page.
+
+    Returns
+    -------
+    `Tuple[List[TextBlock], int]` The remaining blocks ([0]) and the
+    number of removed characters ([1]).
+    """
+    seen: Set[str] = set()
+    kept: List[TextBlock] = []
+    removed_chars = 0
+    for block in blocks:
+        fingerprint = NON_WORD_PATTERN.sub(' ', block.text.lower()).strip()
+        if fingerprint in seen:
+            removed_chars += len(block.text)
+            continue
+        if fingerprint:
+            seen.add(fingerprint)
+        kept.append(block)
+    return kept, removed_chars
+
+
+def truncate_text(text: str, max_chars: int) -> Tuple[str, int]:
+    """
+    Truncates the text to at most `max_chars` characters, at the last
+    whitespace before the limit when possible.
+
+    Returns
+    -------
+    `Tuple[str, int]` The truncated text ([0]) and the number of removed
+    characters ([1]).
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text, 0
+    cut = text.rfind(' ', 0, max_chars)
+    if cut <= 0:
+        cut = max_chars
+    return text[:cut], len(text) - cut
+
+
+def prune_text_blocks(blocks: List[TextBlock], config: PruningConfig) -> Tuple[str, PruningReport]:
+    """
+    Pre-NLP stage which reduces the text sent to NER: boilerplate removal,
+    near-duplicate paragraph elimination and a hard cap on the number of
+    characters per page. The cost of NER is linear in the number of tokens.
+
+    Parameters
+    ----------
+    blocks: `List[TextBlock]`
+    The text blocks of a page (see `extract_text_blocks_from_html`).
+
+    config: `PruningConfig`
+    The pruning options.
+
+    Returns
+    -------
+    `Tuple[str, PruningReport]` The pruned text ([0]) and the number of
+    characters removed by each stage ([1]).
+    """
+    if not config.enabled:
+        return join_text_blocks(blocks), PruningReport()
+
+    blocks, boilerplate_chars = remove_boilerplate(blocks, config)
+
+    duplicate_chars = 0
+    if config.remove_duplicates:
+        blocks, duplicate_chars = remove_duplicate_blocks(blocks)
+
+    text, truncated_chars = truncate_text(
+        join_text_blocks(blocks, separator=' '), config.max_chars)
+
+    return text, PruningReport(
+        boilerplate_chars=boilerplate_chars,
+        duplicate_chars=duplicate_chars,
+        truncated_chars=truncated_chars)
@@ -0,0 +1,160 @@
+import logging
+import pickle
+import sqlite3
+import threading
+import typing
+
+from src.interfaces import CandidateNamedEntity, NamedEntity
+from src.utils import CacheStats
+
+# maximum number of keys per lookup query, older SQLite versions accept
+# at most 999 variables per query (2 per link key)
+SHARED_CACHE_LOOKUP_SIZE = 400
+
+# how long (in seconds) a process waits for a write lock held by another one
+SHARED_CACHE_TIMEOUT = 60
+
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS candidates (name TEXT PRIMARY KEY, candidates BLOB NOT NULL)',
+    # a NULL candidate means that the entity has no candidate
+    'CREATE TABLE IF NOT EXISTS links (name TEXT NOT NULL, label TEXT NOT NULL, candidate BLOB, '
+    'PRIMARY KEY (name, label))',
+]
+
+_LinkKey = typing.Tuple[str, str]
+
+
+def _chunks(items: typing.List[typing.Any]) -> typing.Iterator[typing.List[typing.Any]]:
+    for start in range(0, len(items), SHARED_CACHE_LOOKUP_SIZE):
+        yield items[start:start + SHARED_CACHE_LOOKUP_SIZE]
+
+
+def create_shared_cache(path: str, fingerprint: str):
+    """
+    Creates the shared cache file if needed, it is emptied if it was
+    filled with another configuration (e.g. another candidate query).
+    This has to be done once, before the processes open it.
+
+    Parameters
+    ----------
+    path: `str`
+    The SQLite file path.
+
+    fingerprint: `str`
+    Identifies the configuration the cached values depend on.
+    """
+    connection = sqlite3.connect(path, timeout=SHARED_CACHE_TIMEOUT, isolation_level=None)
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('BEGIN IMMEDIATE')
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        row = connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            if row is not None:
+                logging.info(f'\'{path}\' was filled with another configuration, it is emptied')
+            connection.execute('DELETE FROM candidates')
+            connection.execute('DELETE FROM links')
+            connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+
+class SharedCache:
+    """
+    Cache of the entity candidates (by name) and of the chosen candidates
+    (by name and label) shared by all the worker processes, backed by a
+    SQLite file (see `create_shared_cache`). Each process opens its own
+    connection, the lookups and the writes are batched.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(
+            path, timeout=SHARED_CACHE_TIMEOUT, isolation_level=None, check_same_thread=False)
+        # the writes are only lost if the machine crashes, the cache is
+        # rebuilt from elasticsearch and Trident anyway
+        self._connection.execute('PRAGMA synchronous=OFF')
+        self._lock = threading.Lock()
+        # hits, misses and entries written by this process of each table
+        self._stats = {'candidates': [0, 0, 0], 'links': [0, 0, 0]}
+
+    def _count(self, table: str, hits: int, lookups: int):
+        self._stats[table][0] += hits
+        self._stats[table][1] += lookups - hits
+
+    def get_candidates(self, names: typing.List[str]) -> typing.Dict[str, typing.List[CandidateNamedEntity]]:
+        """
+        Returns the cached candidates of the names which have them.
+        """
+        found: typing.Dict[str, typing.List[CandidateNamedEntity]] = {}
+        with self._lock:
+            for chunk in _chunks(names):
+                rows = self._connection.execute(
+                    f'SELECT name, candidates FROM candidates WHERE name IN ({",".join("?" * len(chunk))})',
+                    chunk)
+                found.update((name, pickle.loads(blob)) for name, blob in rows)
+            self._count('candidates', len(found), len(names))
+        return found
+
+    def put_candidates(self, candidates: typing.Dict[str, typing.List[CandidateNamedEntity]]):
+        if len(candidates) == 0:
+            return
+        with self._lock:
+            self._connection.execute('BEGIN')
+            cursor = self._connection.executemany(
+                'INSERT OR IGNORE INTO candidates (name, candidates) VALUES (?, ?)',
+                [(name, pickle.dumps(value)) for name, value in candidates.items()])
+            self._connection.execute('COMMIT')
+            self._stats['candidates'][2] += cursor.rowcount
+
+    def get_links(
+        self,
+        entities: typing.Iterable[NamedEntity]
+    ) -> typing.Dict[NamedEntity, typing.Optional[CandidateNamedEntity]]:
+        """
+        Returns the cached chosen candidate of the entities which have one,
+        None when an entity is known to have no candidate.
+        """
+        keys: typing.Dict[_LinkKey, NamedEntity] = {
+            (entity.name, entity.label.name): entity for entity in entities}
+        found: typing.Dict[NamedEntity, typing.Optional[CandidateNamedEntity]] = {}
+        with self._lock:
+            for chunk in _chunks(list(keys)):
+                rows = self._connection.execute(
+                    'SELECT name, label, candidate FROM links WHERE '
+                    + ' OR '.join(['(name = ? AND label = ?)'] * len(chunk)),
+                    [value for key in chunk for value in key])
+                for name, label, blob in rows:
+                    found[keys[(name, label)]] = pickle.loads(blob) if blob is not None else None
+            self._count('links', len(found), len(keys))
+        return found
+
+    def put_links(self, links: typing.Dict[NamedEntity, typing.Optional[CandidateNamedEntity]]):
+        if len(links) == 0:
+            return
+        with self._lock:
+            self._connection.execute('BEGIN')
+            cursor = self._connection.executemany(
+                'INSERT OR IGNORE INTO links (name, label, candidate) VALUES (?, ?, ?)',
+                [(entity.name, entity.label.name, pickle.dumps(candidate) if candidate is not None else None)
+                 for entity, candidate in links.items()])
+            self._connection.execute('COMMIT')
+            self._stats['links'][2] += cursor.rowcount
+
+    def stats(self) -> typing.Dict[str, CacheStats]:
+        """
+        Returns the counters of the lookups of this process by table, the
+        size is the number of entries it added (the entries written by
+        another process first are ignored).
+        """
+        with self._lock:
+            return {f'shared.{table}': CacheStats(hits=hits, misses=misses, size=size)
+                    for table, (hits, misses, size) in self._stats.items()}
+
+    def close(self):
+        self._connection.close()
+
@@ -0,0 +1,162 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import typing
+from array import array
+
+TYPE_STORE_PATH = os.getenv(
+    'TYPE_STORE_PATH', "assets/wikidata-type-signatures.bin")
+
+# type store layout (little endian):
+# header | template counts (uint32, n_labels) | padding to 8 bytes |
+# QIDs (uint32, count, sorted) | attribute counts (uint32, count) |
+# signatures (2 x uint64 per entity, low bits first)
+TYPE_STORE_MAGIC = b'WDTYPES1'
+TYPE_STORE_HEADER = struct.Struct('<8sIII')
+
+
+def _padding(size: int) -> int:
+    return -size % 8
+
+
+def write_type_store(
+    path: str,
+    fingerprint: int,
+    template_counts: typing.Sequence[int],
+    rows: typing.Iterable[typing.Tuple[int, int, int]]
+) -> int:
+    """
+    Writes a type store: the attribute count and the type signature (a
+    bitmask of the matched label templates, see `src/knowledge_base.py`)
+    of the entities, sorted by QID so that the file can be memory-mapped
+    and searched in place (see `TypeStore`).
+
+    Parameters
+    ----------
+    path: `str`
+    The output path, the file is replaced atomically.
+
+    fingerprint: `int`
+    Identifies the templates the signature bits refer to.
+
+    template_counts: `Sequence[int]`
+    Number of distinct templates of each scored label.
+
+    rows: `Iterable[Tuple[int, int, int]]`
+    The (numeric QID, attribute count, signature) of the entities.
+
+    Returns
+    -------
+    `int` Number of entities written.
+    """
+    rows = sorted(rows)
+    qids = array('I', (qid for qid, _, _ in rows))
+    counts = array('I', (count for _, count, _ in rows))
+    signatures = array('Q')
+    for _, _, signature in rows:
+        signatures.append(signature & 0xFFFFFFFFFFFFFFFF)
+        signatures.append(signature >> 64)
+    template_count_array = array('I', template_counts)
+    if sys.byteorder == 'big':
+        for values in (qids, counts, signatures, template_count_array):
+            values.byteswap()
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(TYPE_STORE_HEADER.pack(
+            TYPE_STORE_MAGIC, fingerprint, len(template_counts), len(rows)))
+        f.write(template_count_array.tobytes())
+        f.write(b'\0' * _padding(TYPE_STORE_HEADER.size + 4 * len(template_counts)))
+        f.write(qids.tobytes())
+        f.write(counts.tobytes())
+        f.write(signatures.tobytes())
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+class TypeStore:
+    """
+    Read-only QID to (attribute count, type signature) mapping backed by
+    a memory-mapped type store (see `write_type_store`). Lookups are
+    binary searches on the mapped file, they need neither the knowledge
+    base nor a lock and the pages are shared by all the processes.
+    """
+
+    def __init__(self, path: str, fingerprint: int):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count: int
+        magic, file_fingerprint, n_labels, self._count = TYPE_STORE_HEADER.unpack_from(self._mmap)
+        if magic != TYPE_STORE_MAGIC:
+            raise ValueError(f'\'{path}\' is not a type store (or was built by another version).')
+        if file_fingerprint != fingerprint:
+            raise ValueError(f'\'{path}\' was built for other label templates.')
+        counts_start = TYPE_STORE_HEADER.size
+        qids_start = counts_start + 4 * n_labels
+        qids_start += _padding(qids_start)
+        attributes_start = qids_start + 4 * self._count
+        signatures_start = attributes_start + 4 * self._count
+        if len(self._mmap) != signatures_start + 16 * self._count:
+            raise ValueError(f'\'{path}\' is truncated.')
+
+        self.template_counts = array('I', self._mmap[counts_start:counts_start + 4 * n_labels])
+        self._qids: typing.Sequence[int]
+        self._attributes: typing.Sequence[int]
+        self._signatures: typing.Sequence[int]
+        if sys.byteorder == 'little':
+            view = memoryview(self._mmap)
+            self._qids = view[qids_start:attributes_start].cast('I')
+            self._attributes = view[attributes_start:signatures_start].cast('I')
+            self._signatures = view[signatures_start:].cast('Q')
+        else:
+            self.template_counts.byteswap()
+            self._qids = array('I', self._mmap[qids_start:attributes_start])
+            self._attributes = array('I', self._mmap[attributes_start:signatures_start])
+            self._signatures = array('Q', self._mmap[signatures_start:])
+            for values in (self._qids, self._attributes, self._signatures):
+                typing.cast(array, values).byteswap()
+
+    def signature(self, qid: int) -> typing.Optional[typing.Tuple[int, int]]:
+        """
+        Returns the attribute count ([0]) and the type signature ([1]) of
+        an entity, None if it matches no template.
+        """
+        i = bisect.bisect_left(self._qids, qid)
+        if i == self._count or self._qids[i] != qid:
+            return None
+        return self._attributes[i], self._signatures[2 * i] | (self._signatures[2 * i + 1] << 64)
+
+    def __len__(self) -> int:
+        return self._count
+
+
+def load_type_store(fingerprint: int, path: str = TYPE_STORE_PATH) -> typing.Optional[TypeStore]:
+    """
+    Memory-maps the type store if it was built for the current label
+    templates, the candidates are scored with the knowledge base otherwise.
+
+    Parameters
+    ----------
+    fingerprint: `int`
+    Identifies the current label templates.
+
+    path: `str`
+    The type store path.
+
+    Returns
+    -------
+    `Optional[TypeStore]` The type store or None.
+    """
+    if not os.path.exists(path):
+        logging.info(f'\'{path}\' not found, candidates are scored with Trident '
+                     '(run scripts/build_type_store.py)')
+        return None
+    try:
+        return TypeStore(path, fingerprint)
+    except ValueError as e:
+        logging.warning(f'{e} Run scripts/build_type_store.py')
+        return None
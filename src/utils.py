@@ -1,24 +1,354 @@
+import datetime
+import functools
+import logging
+import sys
+import threading
+import time
 import typing
-from typing import Dict, Optional
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from multiprocessing.pool import Pool
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional, Set,
+                    Tuple, TypeVar)
 
 import numpy as np
-from decorator import decorate
+from dateutil import parser as date_parser
 from scipy.spatial import distance
 
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+# named caches (e.g. those created by 'cached'), see 'cache_stats'
+CACHES: Dict[str, 'LRUCache'] = {}
+
+_MISSING = object()
+
+# how often (in seconds) the input of 'imap_bounded' checks whether its
+# consumer stopped while it waits for a result to be consumed
+IMAP_GATE_POLL_INTERVAL = 0.1
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    """
+    Counters of a cache. Lookups which waited for a concurrent
+    computation of the same key count as hits.
+    """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    size: int = 0
+
+
+class _Pending:
+    # a value being computed by a thread, the other threads wait for it
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: typing.Any = None
+        self.error: Optional[BaseException] = None
+
+
+class LRUCache:
+    """
+    Thread safe cache with least recently used eviction. It is bounded by
+    its number of entries (`maxsize`) and/or by the total size of its
+    values (`maxbytes`, measured with `sizeof`), entries can also expire
+    `ttl` seconds after they were stored. None disables a bound.
+
+    Concurrent misses of the same key are computed once (see `get_or_compute`).
+    A cache with a `name` is reported by `cache_stats`.
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        maxbytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[typing.Any], int] = sys.getsizeof,
+        name: Optional[str] = None
+    ):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        # key -> (value, size, expiration time)
+        self._entries: 'OrderedDict[typing.Hashable, Tuple[typing.Any, int, float]]' = OrderedDict()
+        self._pending: Dict[typing.Hashable, _Pending] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+        if name is not None:
+            CACHES[name] = self
+
+    def _get(self, key: typing.Hashable) -> typing.Any:
+        # the lock must be held
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if self.ttl is not None and entry[2] < time.monotonic():
+            self._remove(key)
+            self._evictions += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _remove(self, key: typing.Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _put(self, key: typing.Hashable, value: typing.Any):
+        # the lock must be held
+        if key in self._entries:
+            self._remove(key)
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        expiration = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+        self._entries[key] = (value, size, expiration)
+        self._bytes += size
+        while len(self._entries) > 1 and (
+                (self.maxsize is not None and len(self._entries) > self.maxsize) or
+                (self.maxbytes is not None and self._bytes > self.maxbytes)):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        with self._lock:
+            value = self._get(key)
+            if value is _MISSING:
+                self._misses += 1
+                return default
+            self._hits += 1
+            return value
+
+    def put(self, key: typing.Hashable, value: typing.Any):
+        with self._lock:
+            self._put(key, value)
+
+    def get_or_compute(self, key: typing.Hashable, compute: Callable[[], R]) -> R:
+        """
+        Returns the cached value of a key, computing and storing it on a
+        miss. A thread which misses a key already being computed by another
+        thread waits for its value (or error) instead of computing it again.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not _MISSING:
+                self._hits += 1
+                return typing.cast(R, value)
+            pending = self._pending.get(key)
+            owner = pending is None
+            if pending is None:
+                pending = self._pending[key] = _Pending()
+                self._misses += 1
+            else:
+                self._hits += 1
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return typing.cast(R, pending.value)
+
+        try:
+            pending.value = compute()
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if pending.error is None:
+                    self._put(key, pending.value)
+            pending.done.set()
+        return typing.cast(R, pending.value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits, misses=self._misses,
+                evictions=self._evictions, size=len(self._entries))
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        with self._lock:
+            return self._get(key) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def cached(
+    f: Optional[Callable[..., R]] = None,
+    *,
+    maxsize: Optional[int] = None,
+    maxbytes: Optional[int] = None,
+    ttl: Optional[float] = None,
+    sizeof: Callable[[typing.Any], int] = sys.getsizeof,
+    key: Optional[Callable[..., typing.Hashable]] = None
+):
+    """
+    Caches the results of a function in a `LRUCache`, as `@cached` or
+    `@cached(maxsize=...)`. The cache is the `cache` attribute of the
+    decorated function and its counters are reported by `cache_stats`.
+
+    Parameters
+    ----------
+    maxsize, maxbytes, ttl, sizeof
+    The bounds of the cache, see `LRUCache` (unbounded by default).
+
+    key: `Optional[Callable[..., Hashable]]`
+    Builds the cache key from the arguments of the function, e.g. to
+    leave out a client instance. The positional arguments by default.
+    """
+    def decorator(f: Callable[..., R]) -> Callable[..., R]:
+        cache = LRUCache(maxsize=maxsize, maxbytes=maxbytes, ttl=ttl, sizeof=sizeof,
+                         name=f'{f.__module__}.{f.__qualname__}')
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            else:
+                cache_key = (args, frozenset(kwargs.items())) if kwargs else args
+            return cache.get_or_compute(cache_key, lambda: f(*args, **kwargs))
+
+        wrapper.cache = cache  # type: ignore
+        return wrapper
+
+    return decorator(f) if f is not None else decorator
+
+
+def cache_stats() -> Dict[str, CacheStats]:
+    """
+    Returns the counters of the caches of this process by name.
+    """
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+def imap_bounded(pool: Pool, f: Callable[[T], R], iterable: Iterable[T],
+                 max_in_flight: int, chunksize: int = 1) -> Iterator[R]:
+    """
+    Same as `multiprocessing.pool.Pool.imap_unordered` but with backpressure.
+    The pool task handler consumes its input eagerly, here it is gated by a
+    semaphore so that at most `max_in_flight` items are submitted and not
+    yet returned at any time, i.e. the iterable is consumed lazily. Once
+    the results stop being consumed (e.g. a worker raised), the input is
+    ended so that the pool can be terminated.
+
+    Parameters
+    ----------
+    pool: `multiprocessing.pool.Pool`
+    The target process pool.
+
+    f: `Callable[[T], R]`
+    The function applied to every item.
+
+    iterable: `Iterable[T]`
+    The (possibly lazy) input items.
+
+    max_in_flight: `int`
+    Maximum number of submitted items whose result was not consumed yet.
+    It is raised to `chunksize` if lower, otherwise a chunk could never fill.
+
+    chunksize: `int`
+    Number of items sent to a worker at once.
+
+    Returns
+    -------
+    `Iterator[R]` The results in completion order.
+    """
+    semaphore = threading.Semaphore(max(max_in_flight, chunksize))
+    closed = threading.Event()
+
+    def gated() -> Iterator[T]:
+        for item in iterable:
+            # the pool task handler runs this, it must not wait forever
+            while not semaphore.acquire(timeout=IMAP_GATE_POLL_INTERVAL):
+                if closed.is_set():
+                    return
+            yield item
 
-def _cache(f, *args, **kwargs):
-    key = (args, frozenset(kwargs.items())) if kwargs else args
     try:
-        return f.cache[key]
-    except KeyError:
-        value = f(*args, **kwargs)
-        f.cache[key] = value
-        return value
+        for result in pool.imap_unordered(f, gated(), chunksize):
+            semaphore.release()
+            yield result
+    finally:
+        closed.set()
 
 
-def cached(f):
-    f.cache = {}
-    return decorate(f, _cache)
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Groups the items of an iterable in lists of `size` items, the last
+    list may be shorter. The iterable is consumed lazily.
+
+    Parameters
+    ----------
+    iterable: `Iterable[T]`
+    The input items.
+
+    size: `int`
+    Number of items per batch.
+
+    Returns
+    -------
+    `Iterator[List[T]]` The batches in input order.
+    """
+    batch: List[T] = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class ArchiveProgress:
+    """
+    Thread safe bookkeeping of the records submitted and completed for
+    each archive, used to find out when an archive is done while the
+    records of many archives are interleaved in the same pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._submitted: Dict[int, int] = {}
+        self._completed: Dict[int, int] = {}
+        self._exhausted: Set[int] = set()
+
+    def submit(self, archive_id: int):
+        with self._lock:
+            self._submitted[archive_id] = self._submitted.get(
+                archive_id, 0) + 1
+
+    def exhaust(self, archive_id: int) -> bool:
+        """
+        Marks the archive as fully read. Returns True if the archive is done.
+        """
+        with self._lock:
+            self._exhausted.add(archive_id)
+            return self._is_done(archive_id)
+
+    def complete(self, archive_id: int) -> bool:
+        """
+        Marks a record of the archive as processed. Returns True if the
+        archive is done.
+        """
+        with self._lock:
+            self._completed[archive_id] = self._completed.get(
+                archive_id, 0) + 1
+            return self._is_done(archive_id)
+
+    def _is_done(self, archive_id: int) -> bool:
+        return archive_id in self._exhausted and \
+            self._completed.get(archive_id, 0) == self._submitted.get(archive_id, 0)
 
 
 def get_trident_id_from_wd_uri(uri: str) -> Optional[str]:
@@ -28,17 +358,36 @@ def get_trident_id_from_wd_uri(uri: str) -> Optional[str]:
         return None
 
 
-def load_dumps(*labels) -> Dict[str, str]:
-    out = {}
-    for label in labels:
-        with open(f'src/dumps/wd-dump_{label}.tsv', 'r') as f:
-            for line in f:
-                try:
-                    _, name, uri = line.split('\t')
-                    out[name.strip()] = uri.strip()
-                except ValueError:
-                    continue
-    return out
+@lru_cache(maxsize=1024)
+def parse_warc_date(raw_date: str) -> Optional[datetime.datetime]:
+    """
+    Parses a `WARC-Date` value. WARC dates are ISO-8601 timestamps in the
+    fixed `YYYY-MM-DDThh:mm:ssZ` format, which is parsed by slicing;
+    anything else is handed to `dateutil`.
+
+    Parameters
+    ----------
+    raw_date: `str`
+    The raw header value.
+
+    Returns
+    -------
+    `Optional[datetime.datetime]` The parsed date or None if it is not valid.
+    """
+    if len(raw_date) == 20 and raw_date[4] == '-' and raw_date[10] == 'T' and raw_date[19] == 'Z':
+        try:
+            return datetime.datetime(
+                int(raw_date[0:4]), int(raw_date[5:7]), int(raw_date[8:10]),
+                int(raw_date[11:13]), int(raw_date[14:16]), int(raw_date[17:19]),
+                tzinfo=datetime.timezone.utc)
+        except ValueError:
+            pass
+    try:
+        return typing.cast(datetime.datetime, date_parser.parse(raw_date))
+    except (date_parser.ParserError, OverflowError):
+        logging.log(
+            logging.WARN, f"warc date '{raw_date}' format is not correct")
+        return None
 
 
 def calculate_similarity(vector_a: np.ndarray, vector_b: np.ndarray) -> float:
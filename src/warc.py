@@ -1,17 +1,293 @@
-import datetime
-import gzip
+import bisect
+import glob
+import io
 import logging
-import re
-from typing import Generator, Optional
+import os
+import zlib
+from typing import (BinaryIO, Dict, Generator, Iterable, List, Optional, Set,
+                    Tuple)
 
-from dateutil import parser as date_parser
-
-from src.interfaces import WARCRecordMetadata
+from src.interfaces import WARCRecordLocation, WARCRecordMetadata
 
 WARC_VERSION = 1.0
+WARC_VERSION_LINE = f"WARC/{WARC_VERSION}".encode()
+
+# 1 MiB read buffer for uncompressed archives
+WARC_READ_BUFFER_SIZE: int = 1 << 20
+
+# size of the compressed chunks fed to the decompressor, and maximum
+# size of the inflated chunks it returns
+GZIP_CHUNK_SIZE: int = 1 << 16
+# gzip container, see `zlib.decompressobj`
+GZIP_WBITS: int = 31
+
+WARC_INDEX_SUFFIX = '.idx'
+WARC_INDEX_HEADER = '#warc-index\tv2'
+
+
+WARC_EXTENSIONS = ('.warc', '.warc.gz')
+
+
+def _is_gzipped(path: str) -> bool:
+    return path.endswith('.gz')
+
+
+def find_warc_archives(patterns: Iterable[str]) -> List[str]:
+    """
+    Expands archive paths, glob patterns and directories (searched
+    recursively for `.warc` and `.warc.gz` files) into a list of
+    archive paths.
+
+    Parameters
+    ----------
+    patterns: `Iterable[str]`
+    Archive paths, glob patterns or directories.
+
+    Returns
+    -------
+    `List[str]` The archive paths, without duplicates.
+    """
+    paths: List[str] = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in sorted(os.walk(pattern)):
+                paths.extend(os.path.join(root, name) for name in sorted(files)
+                             if name.endswith(WARC_EXTENSIONS))
+        elif any(c in pattern for c in '*?['):
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            paths.append(pattern)
+    return list(dict.fromkeys(paths))
+
+
+def _iter_warc_records(
+    fd: BinaryIO,
+    read_payload: bool = True,
+    skip_record_ids: Optional[Set[str]] = None
+) -> Generator[Tuple[int, int, Optional[str], bytes], None, None]:
+    """
+    Iterates over the records of a binary WARC stream.
+
+    The header block of each record is read line by line until the first
+    blank line, the payload is then read in a single call using the
+    `Content-Length` header. Records without a valid `Content-Length`
+    are skipped, the stream is scanned for the next version line.
+
+    Parameters
+    ----------
+    fd: `BinaryIO`
+    A binary stream positioned at the beginning of a WARC record.
+
+    read_payload: `bool`
+    If False, payloads are skipped (with a seek if the stream is
+    seekable) and empty records are yielded.
+
+    skip_record_ids: `Optional[Set[str]]`
+    Records whose payload is skipped, as if `read_payload` was False.
+
+    Returns
+    -------
+    `Generator[Tuple[int, int, Optional[str], bytes], None, None]`
+    A generator of tuples in the form (offset, length, record id, record).
+    The record bytes include the header block (without the version line)
+    and the payload.
+    """
+    while True:
+        offset = fd.tell()
+        line = fd.readline()
+        if not line:
+            return
+        # skips the blank lines which separate two consecutive records
+        if line.rstrip() != WARC_VERSION_LINE:
+            continue
+
+        headers: List[bytes] = []
+        content_length: Optional[int] = None
+        record_id: Optional[str] = None
+        for line in iter(fd.readline, b''):
+            if line in (b'\r\n', b'\n'):
+                break
+            headers.append(line)
+            key, _, value = line.partition(b':')
+            if key == b'Content-Length':
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    content_length = None
+            elif key == b'WARC-Record-ID':
+                record_id = value.strip().decode('utf-8', errors='ignore')
+
+        if content_length is None or content_length < 0:
+            logging.error(f'skipping the WARC record at offset {offset}: missing or invalid Content-Length')
+            continue
+
+        if not read_payload or (skip_record_ids and record_id in skip_record_ids):
+            _skip(fd, content_length)
+            yield offset, fd.tell() - offset, record_id, b''
+            continue
+
+        headers.append(b'\r\n')
+        headers.append(fd.read(content_length))
+
+        yield offset, fd.tell() - offset, record_id, b''.join(headers)
+
+
+def _skip(fd: BinaryIO, size: int):
+    if fd.seekable():
+        fd.seek(size, io.SEEK_CUR)
+        return
+    while size > 0:
+        chunk = fd.read(min(size, WARC_READ_BUFFER_SIZE))
+        if not chunk:
+            return
+        size -= len(chunk)
+
+
+class _GzipMembersReader(io.RawIOBase):
+    """
+    Inflates a multi-member gzip stream on the fly, at most
+    `GZIP_CHUNK_SIZE` inflated bytes are held at any time. Compliant
+    `.warc.gz` archives compress every record in its own member, so that
+    each member can be inflated independently.
+
+    The compressed location of the member which holds a given inflated
+    position is known once the member is fully inflated (see `locate`).
+    """
+
+    def __init__(self, fd: BinaryIO):
+        self._fd = fd
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._data = b''
+        self._output = memoryview(b'')
+        self._exhausted = False
+        self._consumed = 0
+        self._position = 0
+        self._inflated = 0
+        # inflated start and compressed offset of each member
+        self._starts: List[int] = [0]
+        self._offsets: List[int] = [0]
+        # compressed offset to length of the complete members
+        self.lengths: Dict[int, int] = {}
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        while len(self._output) == 0:
+            if not self._inflate():
+                return 0
+        size = min(len(buffer), len(self._output))
+        buffer[:size] = self._output[:size]
+        self._output = self._output[size:]
+        self._position += size
+        return size
+
+    def locate(self, position: int) -> int:
+        """
+        Returns the compressed offset of the member which holds an
+        inflated position.
+        """
+        return self._offsets[bisect.bisect_right(self._starts, position) - 1]
 
+    def _inflate(self) -> bool:
+        if self._exhausted:
+            return False
+        if not self._data:
+            self._data = self._fd.read(GZIP_CHUNK_SIZE)
+            if not self._data:
+                if self._consumed > 0:
+                    logging.warning(f'truncated gzip member at offset {self._offsets[-1]}')
+                self._exhausted = True
+                return False
 
-def stream_records_from_warc(path: str) -> Generator[str, None, None]:
+        try:
+            inflated = self._decompressor.decompress(self._data, GZIP_CHUNK_SIZE)
+        except zlib.error as e:
+            logging.error(f'corrupted gzip member at offset {self._offsets[-1]}: {e}')
+            self._exhausted = True
+            return False
+        self._output = memoryview(inflated)
+        self._inflated += len(inflated)
+
+        if not self._decompressor.eof:
+            self._consumed += len(self._data) - len(self._decompressor.unconsumed_tail)
+            self._data = self._decompressor.unconsumed_tail
+            return True
+
+        length = self._consumed + len(self._data) - len(self._decompressor.unused_data)
+        self.lengths[self._offsets[-1]] = length
+        self._data = self._decompressor.unused_data
+        self._consumed = 0
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._starts.append(self._inflated)
+        self._offsets.append(self._offsets[-1] + length)
+        return True
+
+
+def _iter_archive(
+    path: str,
+    lengths: Dict[int, int],
+    read_payload: bool = True,
+    skip_record_ids: Optional[Set[str]] = None
+) -> Generator[Tuple[int, Optional[str], bytes], None, None]:
+    """
+    Same as `_iter_warc_records` but for a WARC archive path. Records
+    are yielded as soon as they are read, `.warc.gz` archives are inflated
+    on the fly so that a large member is never held in memory.
+
+    Offsets always refer to the file on disk: for `.warc.gz` archives they
+    are the ones of the gzip member which contains the record. The lengths
+    of the records (or of the members) are added to `lengths` once known,
+    i.e. when the member is fully inflated (at the latest once the next
+    record is yielded or the archive is exhausted).
+    """
+    if not _is_gzipped(path):
+        with open(path, 'rb', buffering=WARC_READ_BUFFER_SIZE) as fd:
+            for offset, length, record_id, record in _iter_warc_records(fd, read_payload, skip_record_ids):
+                lengths[offset] = length
+                yield offset, record_id, record
+        return
+
+    with open(path, 'rb') as fd:
+        reader = _GzipMembersReader(fd)
+        for position, _, record_id, record in _iter_warc_records(
+                io.BufferedReader(reader, WARC_READ_BUFFER_SIZE), read_payload, skip_record_ids):
+            # the members before the one of the record are complete
+            lengths.update(reader.lengths)
+            reader.lengths.clear()
+            yield reader.locate(position), record_id, record
+        lengths.update(reader.lengths)
+
+
+def _group_by_location(
+    entries: Iterable[Tuple[int, Optional[str]]],
+    lengths: Dict[int, int]
+) -> Generator[Tuple[int, int, List[Optional[str]]], None, None]:
+    """
+    Groups consecutive (offset, record id) entries which share the same
+    location, a single gzip member may contain more than one record.
+    The length of a location is looked up once the next one is reached.
+    """
+    location: Optional[int] = None
+    record_ids: List[Optional[str]] = []
+    for offset, record_id in entries:
+        if location is not None and location != offset:
+            yield location, lengths[location], record_ids
+            record_ids = []
+        location = offset
+        record_ids.append(record_id)
+    if location is not None:
+        yield location, lengths[location], record_ids
+
+
+def stream_records_from_warc(
+    path: str,
+    write_index: bool = False,
+    skip_record_ids: Optional[Set[str]] = None
+) -> Generator[bytes, None, None]:
     """
     This functions streams WARC records from WARC files.
 
@@ -21,93 +297,225 @@ def stream_records_from_warc(path: str) -> Generator[str, None, None]:
     ----------
     `path` A valid WARC file path.
 
+    `write_index` Whether to write a sidecar offset index (see `load_warc_index`)
+    once the archive has been fully read.
+
+    `skip_record_ids` Records which are not read nor yielded (e.g. already
+    processed by a previous run). If the archive has an offset index, only
+    the byte ranges of the remaining records are read.
+
     Returns
     -------
-    `Generator[str, None, None]` A generator of WARC record strings. 
+    `Generator[bytes, None, None]` A generator of WARC record bytes.
     """
-    with gzip.open(path, 'rt', errors='ignore') as fd:
-        payload: str = ''
-        for line in fd:
-            if line.strip() == f"WARC/{WARC_VERSION}":
-                yield payload
-                payload = ''
-            else:
-                payload += line
-        yield payload
+    if skip_record_ids and not write_index and load_warc_index(path) is not None:
+        for location in stream_record_locations_from_warc(path, skip_record_ids):
+            for record in read_warc_records(location, skip_record_ids):
+                yield record
+        return
 
+    # the lengths are only known once the record (or its member) is read
+    index_entries: List[Tuple[str, int]] = []
+    lengths: Dict[int, int] = {}
+    for offset, record_id, record in _iter_archive(path, lengths, skip_record_ids=skip_record_ids):
+        if write_index and record_id is not None:
+            index_entries.append((record_id, offset))
+        if skip_record_ids and record_id in skip_record_ids:
+            continue
+        yield record
 
-def extract_metadata_from_warc(warc_record: str) -> WARCRecordMetadata:
+    if write_index:
+        write_warc_index(path, [(record_id, offset, lengths[offset]) for record_id, offset in index_entries])
+
+
+def stream_record_locations_from_warc(
+    path: str,
+    skip_record_ids: Optional[Set[str]] = None
+) -> Generator[WARCRecordLocation, None, None]:
     """
-    Extracts metadata from WARC record.
+    Streams the byte ranges of the records of a WARC archive instead of
+    the records themselves, so that they can be read (and inflated) by
+    the process which is going to handle them (see `read_warc_records`).
+
+    The sidecar offset index is used if it exists, otherwise the archive
+    is scanned once to find the gzip member boundaries (the inflated
+    bytes are discarded) and the index is written for the next runs.
 
     Parameters
     ----------
-    warc_record: `str`
-    The target WARC record string. 
+    path: `str`
+    A valid WARC file path.
+
+    skip_record_ids: `Optional[Set[str]]`
+    Locations whose records are all in this set are not yielded.
 
     Returns
     -------
-    `WARCRecordMetadata` The extracted WARC metadata dataclass.
+    `Generator[WARCRecordLocation, None, None]` A generator of record locations.
     """
+    index = load_warc_index(path)
+    lengths: Dict[int, int] = {}
+    if index is not None:
+        lengths.update(index.values())
+        entries: Iterable[Tuple[int, Optional[str]]] = sorted(
+            (offset, record_id) for record_id, (offset, _) in index.items())
+    else:
+        index_entries: List[Tuple[str, int]] = []
 
-    w_type: Optional[str] = None
-    date: Optional[datetime.datetime] = None
-    trec_id: Optional[str] = None
-    ip_addr: Optional[str] = None
-    digest: Optional[str] = None
-    uri: Optional[str] = None
-    record_id: Optional[str] = None
+        def scan() -> Generator[Tuple[int, Optional[str]], None, None]:
+            for offset, record_id, _ in _iter_archive(path, lengths, read_payload=False):
+                if record_id is not None:
+                    index_entries.append((record_id, offset))
+                yield offset, record_id
 
-    for line in warc_record.splitlines():
-        w_type_match = re.search(r'^WARC-Type: ([a-zA-Z0-9]+)$', line)
-        if w_type_match is not None:
-            w_type = w_type_match.groups()[0]
+        entries = scan()
 
-        try:
-            date_match = re.search(r'^WARC-Date: ([a-zA-Z0-9\:\-]+)$', line)
-            if date_match is not None:
-                date = date_parser.parse(date_match.groups()[0])
-        except date_parser.ParserError:
-            logging.log(
-                logging.WARN, f"warc record '{trec_id}' date format is not correct")
+    for offset, length, record_ids in _group_by_location(entries, lengths):
+        if skip_record_ids and all(record_id in skip_record_ids for record_id in record_ids):
             continue
+        yield WARCRecordLocation(path=path, offset=offset, length=length)
+
+    if index is None:
+        write_warc_index(path, [(record_id, offset, lengths[offset]) for record_id, offset in index_entries])
+
+
+def write_warc_index(path: str, entries: Iterable[Tuple[str, int, int]]):
+    """
+    Writes the sidecar offset index of a WARC archive. The index is first
+    written to a temporary file and then atomically moved in place so that
+    a partially written index is never picked up.
+
+    Parameters
+    ----------
+    path: `str`
+    The WARC archive path.
+
+    entries: `Iterable[Tuple[str, int, int]]`
+    Tuples in the form (record id, offset, length).
+    """
+    index_path = path + WARC_INDEX_SUFFIX
+    with open(index_path + '.tmp', 'w') as f:
+        f.write(f'{WARC_INDEX_HEADER}\n')
+        for record_id, offset, length in entries:
+            f.write(f'{record_id}\t{offset}\t{length}\n')
+    os.replace(index_path + '.tmp', index_path)
+
+
+def load_warc_index(path: str) -> Optional[Dict[str, Tuple[int, int]]]:
+    """
+    Loads the sidecar offset index of a WARC archive if one exists.
+    Offsets and lengths refer to the file on disk, for `.warc.gz` archives
+    they delimit the gzip member which contains the record.
+
+    Parameters
+    ----------
+    path: `str`
+    The WARC archive path.
+
+    Returns
+    -------
+    `Optional[Dict[str, Tuple[int, int]]]` Mapping from record id to the
+    (offset, length) of the record, None if there is no valid index.
+    """
+    try:
+        with open(path + WARC_INDEX_SUFFIX, 'r') as f:
+            if f.readline().rstrip('\n') != WARC_INDEX_HEADER:
+                logging.warning(
+                    f"ignoring outdated WARC index for '{path}'")
+                return None
+            index: Dict[str, Tuple[int, int]] = {}
+            for line in f:
+                record_id, offset, length = line.rstrip('\n').split('\t')
+                index[record_id] = (int(offset), int(length))
+            return index
+    except FileNotFoundError:
+        return None
+
+
+def read_warc_records(location: WARCRecordLocation, skip_record_ids: Optional[Set[str]] = None) -> List[bytes]:
+    """
+    Reads the WARC records found at a given location of the archive
+    (see `stream_record_locations_from_warc`), inflating them if needed.
+
+    Parameters
+    ----------
+    location: `WARCRecordLocation`
+    The byte range of the records in the archive.
+
+    skip_record_ids: `Optional[Set[str]]`
+    Records which are not returned.
+
+    Returns
+    -------
+    `List[bytes]` The WARC record bytes, same as yielded by `stream_records_from_warc`.
+    """
+    with open(location.path, 'rb') as fd:
+        fd.seek(location.offset)
+        data = fd.read(location.length)
+
+    if _is_gzipped(location.path):
+        data = zlib.decompress(data, GZIP_WBITS)
+
+    return [record for _, _, record_id, record in _iter_warc_records(io.BytesIO(data), skip_record_ids=skip_record_ids)
+            if not (skip_record_ids and record_id in skip_record_ids)]
 
-        trec_id_match = re.search(
-            r'^WARC-(Trec|TREC)-ID: ([a-zA-Z0-9\-]+)$', line)
-        if trec_id_match is not None:
-            trec_id = trec_id_match.groups()[1]
-
-        ip_addr_match = re.search(
-            r'^WARC-IP-Address: ([a-zA-Z0-9\-\.]+)$', line)
-        if ip_addr_match is not None:
-            ip_addr = ip_addr_match.groups()[0]
-
-        digest_match = re.search(
-            r'^WARC-Payload-Digest: ([a-zA-Z0-9\-\.\:]+)$', line)
-        if digest_match is not None:
-            digest = digest_match.groups()[0]
-
-        uri_match = re.search(r'^WARC-Target-URI: (.+)$', line)
-        if uri_match is not None:
-            uri = uri_match.groups()[0]
-
-        record_id_match = re.search(r'^WARC-Record-ID: (.+)$', line)
-        if record_id_match is not None:
-            record_id = record_id_match.groups()[0]
-            # NOTE(andrea): here we are assuming that record id is the last field
-            # if this is not always true then we must find a different way to deal
-            # with WARC metadata parsing without scanning the whole file everytime.
+
+def parse_warc_headers(warc_record: str) -> Dict[str, str]:
+    """
+    Parses the header block of a WARC record in a single pass. Parsing
+    stops at the first blank line, the HTTP headers and the HTML are
+    never scanned.
+
+    Parameters
+    ----------
+    warc_record: `str`
+    The target WARC record string.
+
+    Returns
+    -------
+    `Dict[str, str]` The WARC header fields.
+    """
+    headers: Dict[str, str] = {}
+    start = 0
+    while True:
+        end = warc_record.find('\n', start)
+        if end == -1:
+            end = len(warc_record)
+        line = warc_record[start:end].rstrip('\r')
+        if not line:
             break
+        key, sep, value = line.partition(':')
+        if sep:
+            headers[key] = value.strip()
+        start = end + 1
+    return headers
+
+
+def extract_metadata_from_warc(warc_record: str) -> WARCRecordMetadata:
+    """
+    Extracts metadata from WARC record.
+
+    Parameters
+    ----------
+    warc_record: `str`
+    The target WARC record string. 
+
+    Returns
+    -------
+    `WARCRecordMetadata` The extracted WARC metadata dataclass.
+    """
+    headers = parse_warc_headers(warc_record)
 
+    record_id = headers.get('WARC-Record-ID')
     if record_id is None:
         raise ValueError()
 
     return WARCRecordMetadata(
-        trec_id=trec_id,
-        w_type=w_type,
-        date=date,
-        ip_addr=ip_addr,
-        digest=digest,
-        uri=uri,
+        trec_id=headers.get('WARC-TREC-ID', headers.get('WARC-Trec-ID')),
+        w_type=headers.get('WARC-Type'),
+        raw_date=headers.get('WARC-Date'),
+        ip_addr=headers.get('WARC-IP-Address'),
+        digest=headers.get('WARC-Payload-Digest'),
+        uri=headers.get('WARC-Target-URI'),
         record_id=record_id
     )
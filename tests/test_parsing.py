@@ -0,0 +1,32 @@
+import pytest
+
+from src.parsing import _PythonHTMLTokenizer, _TextCollector, join_text_blocks
+
+etree = pytest.importorskip('lxml.etree')
+
+PAGES = [
+    '<html><head><title>T</title></head><body><p>text</p></body></html>',
+    # the head is never closed, the body starts it anyway
+    '<html><head><title>T</title><body><p>text',
+    '<html><head><title>T</title><p>text</p></html>',
+    '<html><head><meta charset="utf-8"><script>var x;</script><div>text</div>',
+]
+
+
+def lxml_text(page: str) -> str:
+    parser = etree.HTMLParser(target=_TextCollector(), recover=True, no_network=True)
+    parser.feed(page)
+    return join_text_blocks(parser.close())
+
+
+def python_text(page: str) -> str:
+    collector = _TextCollector()
+    tokenizer = _PythonHTMLTokenizer(collector)
+    tokenizer.feed(page)
+    tokenizer.close()
+    return join_text_blocks(collector.close())
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_tokenizers_agree(page):
+    assert python_text(page) == lxml_text(page) == 'text'
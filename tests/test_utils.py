@@ -0,0 +1,34 @@
+import itertools
+import multiprocessing as mp
+import time
+
+import pytest
+
+from src.utils import imap_bounded
+
+
+def fail_on_three(item: int) -> int:
+    if item == 3:
+        raise ValueError(f'item {item}')
+    # the results are not all ready when the error is raised
+    time.sleep(0.01)
+    return item
+
+
+def test_imap_bounded_results():
+    with mp.Pool(2) as pool:
+        results = imap_bounded(pool, fail_on_three, [0, 1, 2, 4, 5], max_in_flight=2)
+        assert sorted(results) == [0, 1, 2, 4, 5]
+
+
+def test_imap_bounded_worker_error():
+    pool = mp.Pool(2)
+    try:
+        # the input never ends, the pool task handler waits on the gate
+        with pytest.raises(ValueError, match='item 3'):
+            for _ in imap_bounded(pool, fail_on_three, itertools.count(), max_in_flight=2):
+                pass
+    finally:
+        # returns once the task handler is out of the gate
+        pool.terminate()
+        pool.join()